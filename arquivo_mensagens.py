@@ -0,0 +1,281 @@
+# arquivo_mensagens.py
+# Particionamento mensal e arquivo frio das mensagens.
+#
+# No PostgreSQL, "messages" é particionada por mês em "timestamp" (migração
+# 11), com partições messages_pAAAAMM criadas com antecedência
+# (garantir_particoes) e uma partição DEFAULT (messages_default) que recebe o
+# que cair fora delas: um mês sem partição nunca vira erro de INSERT. As
+# partições são criadas na migração e por uma tarefa própria do lifespan
+# (a cada PARTICOES_INTERVALO_H horas), que não depende do arquivamento.
+# Os índices de cada partição só cobrem o mês dela.
+#
+# O arquivamento pega os meses inteiros mais velhos que ARQUIVO_MENSAGENS_DIAS
+# e grava as mensagens deles em messages_arquivo, em blocos de até
+# ARQUIVO_BLOCO mensagens consecutivas da mesma conversa (JSON + zlib). Depois
+# tira o mês da tabela quente: no PostgreSQL a partição é desanexada e apagada
+# (sem DELETE linha a linha); nos outros bancos é um DELETE pelo intervalo.
+# Cada mês é uma transação. get_conversation lê o arquivo (anteriores) só
+# quando a rolagem passa da última mensagem quente da conversa.
+#
+# O arquivamento roda no lifespan a cada ARQUIVO_MENSAGENS_INTERVALO_H horas
+# (0 desliga só ele) ou manualmente:  python arquivo_mensagens.py
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, func, insert, select, text
+
+from database import engine
+from models import Message, MensagemArquivo
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO_MENSAGENS_DIAS = int(os.getenv("ARQUIVO_MENSAGENS_DIAS", "180"))
+ARQUIVO_MENSAGENS_INTERVALO_H = float(os.getenv("ARQUIVO_MENSAGENS_INTERVALO_H", "24"))
+ARQUIVO_BLOCO = 500
+PARTICOES_A_FRENTE = 3    # meses criados além do atual
+PARTICOES_INTERVALO_H = 6  # criação de partições: sempre ligada
+PARTICAO_DEFAULT = "messages_default"
+LOTE_INSERCAO = 200       # blocos por INSERT
+LEITURA_BLOCOS = 4        # blocos lidos por consulta ao rolar o arquivo
+
+
+def _mes(d) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _proximo_mes(d: date) -> date:
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def _nome_particao(mes: date) -> str:
+    return f"messages_p{mes:%Y%m}"
+
+
+# === PARTIÇÕES (PostgreSQL) ===
+def particionada(conn) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'messages'")).scalar() == "p"
+
+
+def _criar_particao(conn, mes: date, com_default: bool) -> None:
+    nome = _nome_particao(mes)
+    if conn.execute(text("SELECT to_regclass(:n)"), {"n": nome}).scalar():
+        return
+    criar = (f"CREATE TABLE {nome} PARTITION OF messages "
+             f"FOR VALUES FROM ('{mes}') TO ('{_proximo_mes(mes)}')")
+    no_mes = f"timestamp >= '{mes}' AND timestamp < '{_proximo_mes(mes)}'"
+    if not com_default or not conn.execute(text(f"SELECT 1 FROM {PARTICAO_DEFAULT} WHERE {no_mes} LIMIT 1")).first():
+        conn.execute(text(criar))
+        return
+    # O PostgreSQL não cria a partição se a DEFAULT já tem linhas do mês:
+    # elas saem da DEFAULT e voltam pela tabela-mãe, já na partição nova
+    conn.execute(text(f"CREATE TEMP TABLE _mes_na_default ON COMMIT DROP AS SELECT * FROM {PARTICAO_DEFAULT} WHERE {no_mes}"))
+    conn.execute(text(f"DELETE FROM {PARTICAO_DEFAULT} WHERE {no_mes}"))
+    conn.execute(text(criar))
+    conn.execute(text("INSERT INTO messages SELECT * FROM _mes_na_default"))
+    conn.execute(text("DROP TABLE _mes_na_default"))
+
+
+def garantir_particoes(conn, desde: Optional[date] = None, meses_a_frente: int = PARTICOES_A_FRENTE) -> None:
+    """Cria as partições mensais de `desde` (padrão: mês atual) até meses_a_frente adiante, e a DEFAULT."""
+    if not particionada(conn):
+        return
+    # Workers sobem juntos: um cria, os outros esperam e encontram tudo pronto
+    conn.execute(text("SELECT pg_advisory_xact_lock(724003)"))
+    com_default = conn.execute(text("SELECT to_regclass(:n)"), {"n": PARTICAO_DEFAULT}).scalar() is not None
+    mes = _mes(desde or datetime.utcnow())
+    fim = _mes(datetime.utcnow())
+    for _ in range(meses_a_frente + 1):
+        fim = _proximo_mes(fim)
+    while mes < fim:
+        _criar_particao(conn, mes, com_default)
+        mes = _proximo_mes(mes)
+    if not com_default:
+        conn.execute(text(f"CREATE TABLE {PARTICAO_DEFAULT} PARTITION OF messages DEFAULT"))
+
+
+def _meses_com_mensagens(conn, corte: date) -> List[date]:
+    if particionada(conn):
+        nomes = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'messages'::regclass"
+        )).scalars()
+        meses = {date(int(n[-6:-2]), int(n[-2:]), 1) for n in nomes if n.startswith("messages_p")}
+        # Meses que só existem na DEFAULT (partição não criada a tempo) também são arquivados
+        if conn.execute(text("SELECT to_regclass(:n)"), {"n": PARTICAO_DEFAULT}).scalar():
+            mais_velha = conn.execute(text(f"SELECT MIN(timestamp) FROM {PARTICAO_DEFAULT}")).scalar()
+            mes = _mes(mais_velha) if mais_velha else corte
+            while mes < corte:
+                meses.add(mes)
+                mes = _proximo_mes(mes)
+        return sorted(m for m in meses if m < corte)
+    mais_velha = conn.execute(select(func.min(Message.timestamp))).scalar()
+    if mais_velha is None:
+        return []
+    meses, mes = [], _mes(mais_velha)
+    while mes < corte:
+        meses.append(mes)
+        mes = _proximo_mes(mes)
+    return meses
+
+
+# === ARQUIVAMENTO ===
+def _bloco(conversa: str, mensagens: list) -> dict:
+    return {
+        "conversa": conversa,
+        "primeiro_id": mensagens[0][0],
+        "ultimo_id": mensagens[-1][0],
+        "quantidade": len(mensagens),
+        "inicio": mensagens[0][4],
+        "fim": mensagens[-1][4],
+        "dados": zlib.compress(json.dumps(
+            [[i, s, r, c, t.isoformat()] for i, s, r, c, t in mensagens], separators=(",", ":")
+        ).encode()),
+    }
+
+
+def arquivar_mes(conn, mes: date) -> int:
+    """Move as mensagens do mês para messages_arquivo. Retorna quantas foram movidas."""
+    inicio, fim = datetime.combine(mes, datetime.min.time()), datetime.combine(_proximo_mes(mes), datetime.min.time())
+    no_mes = (Message.timestamp >= inicio, Message.timestamp < fim)
+    linhas = conn.execute(
+        select(Message.conversa, Message.id, Message.sender_id, Message.receiver_id, Message.content, Message.timestamp)
+        .where(*no_mes)
+        .order_by(Message.conversa, Message.id)
+        .execution_options(stream_results=True, yield_per=5000)
+    )
+
+    total, blocos, atual, conversa_atual = 0, [], [], None
+    for conversa, *mensagem in linhas:
+        if conversa != conversa_atual or len(atual) >= ARQUIVO_BLOCO:
+            if atual:
+                blocos.append(_bloco(conversa_atual, atual))
+            atual, conversa_atual = [], conversa
+        atual.append(mensagem)
+        total += 1
+        if len(blocos) >= LOTE_INSERCAO:
+            conn.execute(insert(MensagemArquivo), blocos)
+            blocos = []
+    if atual:
+        blocos.append(_bloco(conversa_atual, atual))
+    if blocos:
+        conn.execute(insert(MensagemArquivo), blocos)
+
+    nome = _nome_particao(mes)
+    if particionada(conn) and conn.execute(text("SELECT to_regclass(:n)"), {"n": nome}).scalar():
+        conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {nome}"))
+        conn.execute(text(f"DROP TABLE {nome}"))
+    else:
+        conn.execute(delete(Message).where(*no_mes))
+    return total
+
+
+def arquivar(dias: int = ARQUIVO_MENSAGENS_DIAS, agora: Optional[datetime] = None) -> int:
+    """Arquiva os meses inteiros mais velhos que `dias`. Retorna o total de mensagens movidas."""
+    corte = _mes((agora or datetime.utcnow()) - timedelta(days=dias))
+    with engine.connect() as conn:
+        meses = _meses_com_mensagens(conn, corte)
+    total = 0
+    for mes in meses:
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql" and not conn.execute(
+                text("SELECT pg_try_advisory_xact_lock(724002)")
+            ).scalar():
+                logger.info("Arquivamento já em andamento em outro processo")
+                return total
+            movidas = arquivar_mes(conn, mes)
+        if movidas:
+            logger.info("Mensagens de %s arquivadas: %s", f"{mes:%Y-%m}", movidas)
+        total += movidas
+    return total
+
+
+# === LEITURA DO ARQUIVO ===
+# Enquanto nada foi arquivado, conversas curtas não consultam messages_arquivo
+_em_uso = {"valor": False, "verificar_em": 0.0}
+VERIFICAR_USO_S = 60
+
+
+async def _arquivo_em_uso(db) -> bool:
+    agora = time.monotonic()
+    if agora >= _em_uso["verificar_em"]:
+        _em_uso["valor"] = (await db.execute(select(MensagemArquivo.id).limit(1))).first() is not None
+        _em_uso["verificar_em"] = agora + VERIFICAR_USO_S
+    return _em_uso["valor"]
+
+
+async def anteriores(db, conversa: str, antes_de: Optional[int], quantidade: int) -> List[dict]:
+    """Até `quantidade` mensagens arquivadas com id < antes_de, da mais nova para a mais velha."""
+    if not await _arquivo_em_uso(db):
+        return []
+    encontradas = []
+    cursor = antes_de
+    while len(encontradas) < quantidade:
+        query = select(MensagemArquivo.primeiro_id, MensagemArquivo.dados).where(MensagemArquivo.conversa == conversa)
+        if cursor is not None:
+            query = query.where(MensagemArquivo.primeiro_id < cursor)
+        blocos = (await db.execute(query.order_by(MensagemArquivo.ultimo_id.desc()).limit(LEITURA_BLOCOS))).all()
+        if not blocos:
+            break
+        for primeiro_id, dados in blocos:
+            for i, s, r, c, t in reversed(json.loads(zlib.decompress(dados))):
+                if cursor is None or i < cursor:
+                    encontradas.append({"id": i, "sender_id": s, "receiver_id": r, "content": c, "timestamp": t})
+            cursor = primeiro_id
+    return encontradas[:quantidade]
+
+
+# === TAREFAS PERIÓDICAS ===
+def manter_particoes() -> None:
+    with engine.begin() as conn:
+        garantir_particoes(conn)
+
+
+def manutencao() -> int:
+    manter_particoes()
+    return arquivar()
+
+
+class TarefaPeriodica:
+    """Roda `funcao` em thread ao subir e depois a cada intervalo_h horas (0 desliga)."""
+
+    def __init__(self, nome: str, funcao, intervalo_h: float):
+        self.nome = nome
+        self.funcao = funcao
+        self.intervalo = intervalo_h * 3600
+        self._tarefa = None
+
+    def start(self) -> None:
+        if self.intervalo > 0:
+            self._tarefa = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._tarefa:
+            self._tarefa.cancel()
+            await asyncio.gather(self._tarefa, return_exceptions=True)
+            self._tarefa = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.funcao)
+            except Exception:
+                logger.exception("Falha na tarefa periódica: %s", self.nome)
+            await asyncio.sleep(self.intervalo)
+
+
+# Separadas: desligar o arquivamento não pode deixar a tabela sem partições futuras
+particionador = TarefaPeriodica("criação de partições de mensagens", manter_particoes, PARTICOES_INTERVALO_H)
+arquivador = TarefaPeriodica("arquivamento de mensagens", arquivar, ARQUIVO_MENSAGENS_INTERVALO_H)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Mensagens arquivadas: {manutencao()}")
@@ -0,0 +1,59 @@
+# benchmarks/bench_chat_commit.py
+# Compara o envio de mensagens com e sem group commit (CHAT_GROUP_COMMIT).
+#
+# Para cada concorrência roda o cenário enviar_mensagem do bench_routes.py em
+# processos novos, um com o caminho atual (uma transação por mensagem) e outro
+# com o group commit, e mostra p50/p95, vazão e a variação.
+#
+# Uso: python benchmarks/bench_chat_commit.py --concorrencias 1,8,32 --requisicoes 1000 [--janela-ms 5]
+# Requer DATABASE_URL já populado por benchmarks/seed.py.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+MODOS = {"por_mensagem": "false", "group_commit": "true"}
+
+
+def rodar(modo: str, concorrencia: int, args) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json") as saida:
+        subprocess.run(
+            [sys.executable, os.path.join(AQUI, "bench_routes.py"), "--cenarios", "enviar_mensagem",
+             "--requisicoes", str(args.requisicoes), "--concorrencia", str(concorrencia),
+             "--salvar", saida.name],
+            check=True, stdout=subprocess.DEVNULL,
+            env={**os.environ, "CHAT_GROUP_COMMIT": MODOS[modo], "CHAT_GROUP_COMMIT_MS": str(args.janela_ms)},
+        )
+        with open(saida.name) as arquivo:
+            return json.load(arquivo)["cenarios"]["enviar_mensagem"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concorrencias", default="1,8,32")
+    parser.add_argument("--requisicoes", type=int, default=1000)
+    parser.add_argument("--janela-ms", type=float, default=5.0)
+    parser.add_argument("--json", help="grava os resultados neste arquivo")
+    args = parser.parse_args()
+
+    resultados = {}
+    print(f"{'concorrência':<13}{'modo':<14}{'p50 ms':>9}{'p95 ms':>9}{'req/s':>10}{'erros':>7}")
+    for concorrencia in (int(c) for c in args.concorrencias.split(",")):
+        por_modo = {modo: rodar(modo, concorrencia, args) for modo in MODOS}
+        resultados[concorrencia] = por_modo
+        for modo, r in por_modo.items():
+            print(f"{concorrencia:<13}{modo:<14}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['rps']:>10.1f}{r['erros']:>7}")
+        ganho = por_modo["group_commit"]["rps"] / por_modo["por_mensagem"]["rps"]
+        print(f"{'':<13}{'vazão':<14}{ganho:>27.2f}x")
+
+    if args.json:
+        with open(args.json, "w") as arquivo:
+            json.dump({"janela_ms": args.janela_ms, "requisicoes": args.requisicoes, "resultados": resultados},
+                      arquivo, indent=2)
+
+
+if __name__ == "__main__":
+    main()
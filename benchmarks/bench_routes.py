@@ -0,0 +1,242 @@
+# benchmarks/bench_routes.py
+# Carga nas rotas de users, chat, movimento e pagamento, com concorrência
+# configurável. Por padrão roda o app no próprio processo (httpx + ASGI, sem
+# rede) contra o banco de DATABASE_URL já populado por benchmarks/seed.py, com
+# o uploader fake. Mede p50/p95/p99, vazão, erros e queries SQL por requisição.
+#
+# Uso:
+#   python benchmarks/bench_routes.py --requisicoes 500 --concorrencia 16
+#   python benchmarks/bench_routes.py --cenarios feed,inbox --salvar benchmarks/baseline.json
+#   python benchmarks/bench_routes.py --comparar benchmarks/baseline.json --tolerancia 20
+#   python benchmarks/bench_routes.py --url http://localhost:8000   (servidor já rodando; sem contagem de queries)
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEDIA_UPLOADER", "fake")
+# Todas as requisições saem do mesmo IP: sem isso o limite por usuário mediria só 429
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+# Cenários chamam as rotas sem token (mede as rotas, não a autenticação)
+os.environ.setdefault("AUTH_OBRIGATORIA", "false")
+
+import httpx  # noqa: E402
+from sqlalchemy import event, func, select  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+SENHA = "bench123"
+
+
+# === CONTAGEM DE QUERIES (todas as engines do processo, sync e async) ===
+class ContadorQueries:
+    def __init__(self):
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.total += 1
+
+
+contador = ContadorQueries()
+
+
+# === CENÁRIOS ===
+# Cada cenário devolve (método, caminho, kwargs do httpx) para uma requisição
+def _cenarios(ids: dict) -> dict:
+    p, c = ids["participantes"], ids["clientes"]
+    escolher = random.choice
+    return {
+        # users
+        "feed": lambda: ("GET", "/users/feed", {"params": {"limit": 20}}),
+        "feed_filtrado": lambda: ("GET", "/users/feed", {"params": {"preco_max": 30000, "campos": "bio", "limit": 50}}),
+        "busca": lambda: ("GET", "/users/search", {"params": {"q": escolher(["ana", "mari", "silva", "musica", "jul"])}}),
+        "login": lambda: ("POST", "/users/login", {"data": {"email": f"usuario{escolher(c)}@bench.local", "senha": SENHA}}),
+        "lista_usuarios": lambda: ("GET", "/users/list", {"params": {"role": "participante"}}),
+        # chat
+        "enviar_mensagem": lambda: ("POST", "/messages/send", {"json": {
+            "sender_id": escolher(c), "receiver_id": escolher(p), "content": "mensagem do benchmark"}}),
+        "conversa": lambda: ("GET", "/messages/conversation", {"params": {"user1": escolher(c), "user2": escolher(p)}}),
+        "inbox": lambda: ("GET", f"/messages/inbox/{escolher(p)}", {}),
+        # movimento
+        "criar_movimento": lambda: ("POST", "/movimentos", {"data": {
+            "cliente_id": escolher(c), "participante_id": escolher(p), "tipo": escolher(["fotos", "videos", "acompanhante"])}}),
+        "movimentos_cliente": lambda: ("GET", f"/movimentos/cliente/{escolher(c)}", {}),
+        "chat_liberado": lambda: ("GET", f"/chat/liberado/{escolher(c)}/{escolher(p)}", {}),
+        "listar_movimentos": lambda: ("GET", "/movimentos/list", {"params": {"limit": 100}}),
+        # pagamento
+        "pagamento_pix": lambda: ("POST", "/pagamento/pix", {"json": {"participante_id": escolher(p)}}),
+    }
+
+
+# /users/list devolve todos os participantes: fica fora do padrão em bases grandes
+PADRAO = [
+    "feed", "feed_filtrado", "busca", "login", "enviar_mensagem", "conversa", "inbox",
+    "criar_movimento", "movimentos_cliente", "chat_liberado", "listar_movimentos", "pagamento_pix",
+]
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+async def rodar_cenario(cliente: httpx.AsyncClient, gerar, requisicoes: int, concorrencia: int, em_processo: bool) -> dict:
+    latencias, erros = [], 0
+    restantes = iter(range(requisicoes))
+    queries_antes = contador.total
+
+    async def worker():
+        nonlocal erros
+        for _ in restantes:
+            metodo, caminho, kwargs = gerar()
+            inicio = time.perf_counter()
+            resposta = await cliente.request(metodo, caminho, **kwargs)
+            latencias.append(time.perf_counter() - inicio)
+            if resposta.status_code >= 400:
+                erros += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+    return {
+        "requisicoes": requisicoes,
+        "erros": erros,
+        "rps": round(requisicoes / duracao, 1),
+        "p50_ms": round(_percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(_percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(_percentil(latencias, 99) * 1000, 2),
+        "media_ms": round(statistics.mean(latencias) * 1000, 2),
+        "queries_por_requisicao": round((contador.total - queries_antes) / requisicoes, 2) if em_processo else None,
+    }
+
+
+def _carregar_ids() -> dict:
+    from database import SessionLocal
+    from models import User
+
+    db = SessionLocal()
+    try:
+        linhas = db.execute(select(User.id, User.role).where(User.status != "suspenso")).all()
+    finally:
+        db.close()
+    ids = {
+        "participantes": [i for i, r in linhas if r == "participante"],
+        "clientes": [i for i, r in linhas if r == "cliente"],
+    }
+    if not ids["participantes"] or not ids["clientes"]:
+        sys.exit("Banco vazio: rode benchmarks/seed.py antes.")
+    return ids
+
+
+async def executar(args) -> dict:
+    random.seed(args.semente)
+    ids = _carregar_ids()
+    cenarios = _cenarios(ids)
+    escolhidos = args.cenarios.split(",") if args.cenarios else PADRAO
+    desconhecidos = [c for c in escolhidos if c not in cenarios]
+    if desconhecidos:
+        sys.exit(f"Cenários desconhecidos: {', '.join(desconhecidos)}. Disponíveis: {', '.join(cenarios)}")
+
+    resultados = {}
+    if args.url:
+        contexto = None
+        cliente = httpx.AsyncClient(base_url=args.url, timeout=60)
+    else:
+        import main
+
+        event.listen(Engine, "before_cursor_execute", contador)
+        contexto = main.app.router.lifespan_context(main.app)
+        await contexto.__aenter__()
+        cliente = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=60)
+
+    try:
+        for nome in escolhidos:
+            # Aquecimento: caches, pools e índices em memória antes de medir
+            await rodar_cenario(cliente, cenarios[nome], min(20, args.requisicoes), args.concorrencia, not args.url)
+            resultados[nome] = await rodar_cenario(
+                cliente, cenarios[nome], args.requisicoes, args.concorrencia, not args.url
+            )
+            r = resultados[nome]
+            print(f"{nome:<20} p50 {r['p50_ms']:>8.2f}  p95 {r['p95_ms']:>8.2f}  p99 {r['p99_ms']:>8.2f} ms"
+                  f"  {r['rps']:>8.1f} req/s  erros {r['erros']:>4}  queries/req {r['queries_por_requisicao']}")
+    finally:
+        await cliente.aclose()
+        if contexto is not None:
+            await contexto.__aexit__(None, None, None)
+    return resultados
+
+
+def comparar(resultados: dict, baseline: dict, tolerancia: float) -> bool:
+    """Imprime a variação do p95 contra a baseline; False se algum piorou além da tolerância (%)."""
+    ok = True
+    print(f"\nComparação com a baseline (tolerância {tolerancia:.0f}% no p95):")
+    for nome, atual in resultados.items():
+        anterior = baseline["cenarios"].get(nome)
+        if not anterior:
+            print(f"{nome:<20} sem baseline")
+            continue
+        variacao = (atual["p95_ms"] - anterior["p95_ms"]) / anterior["p95_ms"] * 100 if anterior["p95_ms"] else 0.0
+        queries = ""
+        if atual["queries_por_requisicao"] is not None and anterior.get("queries_por_requisicao") is not None:
+            if atual["queries_por_requisicao"] > anterior["queries_por_requisicao"]:
+                queries = f"  queries/req {anterior['queries_por_requisicao']} -> {atual['queries_por_requisicao']}"
+        regressao = variacao > tolerancia or bool(queries)
+        ok = ok and not regressao
+        print(f"{nome:<20} p95 {anterior['p95_ms']:>8.2f} -> {atual['p95_ms']:>8.2f} ms ({variacao:+.1f}%)"
+              f"{queries}{'  REGRESSÃO' if regressao else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cenarios", help="lista separada por vírgula (padrão: todos menos lista_usuarios)")
+    parser.add_argument("--requisicoes", type=int, default=200, help="por cenário")
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--url", help="servidor já rodando; sem isso o app roda no próprio processo")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--salvar", help="grava os resultados como baseline neste arquivo")
+    parser.add_argument("--comparar", help="baseline a comparar")
+    parser.add_argument("--tolerancia", type=float, default=20.0, help="piora aceitável do p95, em %%")
+    args = parser.parse_args()
+
+    resultados = asyncio.run(executar(args))
+
+    if args.salvar:
+        from database import engine
+        from models import Message, Movimento, User
+
+        with engine.connect() as conn:
+            volumes = {
+                t.__tablename__: conn.execute(select(func.count()).select_from(t)).scalar()
+                for t in (User, Message, Movimento)
+            }
+        with open(args.salvar, "w") as arquivo:
+            json.dump({
+                "gerado_em": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "banco": engine.dialect.name,
+                "volumes": volumes,
+                "python": platform.python_version(),
+                "requisicoes": args.requisicoes,
+                "concorrencia": args.concorrencia,
+                "cenarios": resultados,
+            }, arquivo, indent=2, ensure_ascii=False)
+        print(f"\nBaseline gravada em {args.salvar}")
+
+    if args.comparar:
+        with open(args.comparar) as arquivo:
+            baseline = json.load(arquivo)
+        if not comparar(resultados, baseline, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# benchmarks/bench_startup.py
+# Mede o tempo de subida da API em processos novos (como num cold start):
+# importação do main, startup do lifespan e a primeira e a segunda requisição.
+#
+# Uso: python benchmarks/bench_startup.py --rodadas 5 [--rota /users/list] [--json saida.json]
+# Requer DATABASE_URL apontando para um banco já migrado (python migrations.py).
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Roda dentro do processo filho; imprime as medições em JSON
+SONDA = """
+import json, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as cliente:
+    t2 = time.perf_counter()
+    r1 = cliente.get(sys.argv[1])
+    t3 = time.perf_counter()
+    cliente.get(sys.argv[1])
+    t4 = time.perf_counter()
+print(json.dumps({
+    "importacao": t1 - t0,
+    "lifespan": t2 - t1,
+    "primeira_requisicao": t3 - t2,
+    "segunda_requisicao": t4 - t3,
+    "status": r1.status_code,
+}))
+"""
+
+
+def rodar(rota: str) -> dict:
+    saida = subprocess.run(
+        [sys.executable, "-c", SONDA, rota],
+        cwd=RAIZ, capture_output=True, text=True, check=True,
+        env={**os.environ, "PYTHONPATH": RAIZ},
+    )
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rodadas", type=int, default=5)
+    parser.add_argument("--rota", default="/")
+    parser.add_argument("--json", help="grava o resumo neste arquivo")
+    args = parser.parse_args()
+
+    medicoes = [rodar(args.rota) for _ in range(args.rodadas)]
+    resumo = {}
+    for etapa in ("importacao", "lifespan", "primeira_requisicao", "segunda_requisicao"):
+        valores = [m[etapa] * 1000 for m in medicoes]
+        resumo[etapa] = {"mediana_ms": round(statistics.median(valores), 1), "max_ms": round(max(valores), 1)}
+        print(f"{etapa:<22} mediana {resumo[etapa]['mediana_ms']:>8.1f} ms   máx {resumo[etapa]['max_ms']:>8.1f} ms")
+
+    total = [sum(m[e] for e in ("importacao", "lifespan", "primeira_requisicao")) * 1000 for m in medicoes]
+    resumo["ate_primeira_resposta_ms"] = round(statistics.median(total), 1)
+    print(f"{'até a 1ª resposta':<22} mediana {resumo['ate_primeira_resposta_ms']:>8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as arquivo:
+            json.dump({"rota": args.rota, "rodadas": args.rodadas, "resumo": resumo}, arquivo, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# benchmarks/bench_uploads.py
+# Compara o upload sequencial antigo com o upload concorrente de media_uploads,
+# usando o FakeUploader com latência simulada (sem rede).
+#
+# Uso: python benchmarks/bench_uploads.py --arquivos 20 --latencia-ms 200
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import UploadFile  # noqa: E402
+
+import media_uploads  # noqa: E402
+
+
+def criar_arquivos(quantidade: int, tamanho: int):
+    return [UploadFile(file=io.BytesIO(os.urandom(tamanho)), filename=f"foto{i}.jpg") for i in range(quantidade)]
+
+
+def sequencial(uploader, arquivos):
+    inicio = time.perf_counter()
+    for arquivo in arquivos:
+        uploader.upload(arquivo.file, "usuarios", "auto")
+    return time.perf_counter() - inicio
+
+
+async def upload_varios(arquivos):
+    """Sobe os arquivos em paralelo pelo pool de media_uploads; devolve os erros."""
+    async def enviar(arquivo: UploadFile) -> dict:
+        try:
+            return await media_uploads.upload_async(arquivo.file, "usuarios", "auto")
+        except Exception as e:
+            return {"arquivo": arquivo.filename, "erro": str(e)}
+
+    resultados = await asyncio.gather(*(enviar(a) for a in arquivos))
+    return [r for r in resultados if "erro" in r]
+
+
+async def concorrente(arquivos):
+    # Mede também o atraso do event loop durante os uploads
+    atrasos = []
+    parar = asyncio.Event()
+
+    async def batimento():
+        while not parar.is_set():
+            antes = time.perf_counter()
+            await asyncio.sleep(0.01)
+            atrasos.append(time.perf_counter() - antes - 0.01)
+
+    monitor = asyncio.create_task(batimento())
+    inicio = time.perf_counter()
+    erros = await upload_varios(arquivos)
+    duracao = time.perf_counter() - inicio
+    parar.set()
+    await monitor
+    return duracao, max(atrasos, default=0.0), erros
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arquivos", type=int, default=20)
+    parser.add_argument("--latencia-ms", type=int, default=200)
+    parser.add_argument("--tamanho-kb", type=int, default=256)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        uploader = media_uploads.FakeUploader(pasta=pasta, latencia=args.latencia_ms / 1000)
+        media_uploads.set_uploader(uploader)
+
+        t_seq = sequencial(uploader, criar_arquivos(args.arquivos, args.tamanho_kb * 1024))
+        t_conc, atraso_loop, erros = asyncio.run(
+            concorrente(criar_arquivos(args.arquivos, args.tamanho_kb * 1024))
+        )
+
+    print(f"arquivos={args.arquivos} latencia={args.latencia_ms}ms workers={media_uploads.UPLOAD_MAX_WORKERS}")
+    print(f"sequencial : {t_seq * 1000:8.1f} ms (bloqueia o event loop o tempo todo)")
+    print(f"concorrente: {t_conc * 1000:8.1f} ms  maior atraso do loop: {atraso_loop * 1000:.1f} ms  erros: {len(erros)}")
+    print(f"ganho      : {t_seq / t_conc:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
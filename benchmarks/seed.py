@@ -0,0 +1,206 @@
+# benchmarks/seed.py
+# Popula o banco de DATABASE_URL com volumes realistas para os benchmarks:
+# usuários (participantes e clientes, com fotos em user_media), mensagens em
+# conversas com caixa de entrada (conversas_resumo) e movimentos.
+#
+# Uso: python benchmarks/seed.py --usuarios 100000 --mensagens 2000000 --movimentos 1000000
+# Todos os usuários têm a senha "bench123" e email usuario{id}@bench.local.
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, insert, select, text  # noqa: E402
+
+import migrations  # noqa: E402
+from arquivo_mensagens import garantir_particoes  # noqa: E402
+from database import engine  # noqa: E402
+from models import ConversaResumo, Message, Movimento, User, UserMedia  # noqa: E402
+from security import hash_senha  # noqa: E402
+
+SENHA = "bench123"
+
+NOMES = ["Ana", "Beatriz", "Carla", "Daniela", "Eduarda", "Fernanda", "Gabriela", "Helena", "Isabela",
+         "Júlia", "Larissa", "Mariana", "Natália", "Paula", "Rafaela", "Sofia", "Bruno", "Carlos",
+         "Diego", "Felipe", "Gustavo", "João", "Lucas", "Marcos", "Pedro", "Rafael", "Thiago"]
+SOBRENOMES = ["Silva", "Souza", "Oliveira", "Santos", "Pereira", "Lima", "Costa", "Ferreira", "Almeida",
+              "Ribeiro", "Carvalho", "Gomes", "Martins", "Araújo", "Barbosa", "Rocha"]
+TRECHOS_BIO = ["Adoro música ao vivo", "viagens pelo litoral", "café da manhã demorado", "dança de salão",
+               "cinema nacional", "trilhas no fim de semana", "boa conversa", "gastronomia japonesa",
+               "fotografia", "academia todos os dias", "livros de ficção", "samba e pagode"]
+FRASES = ["Oi, tudo bem?", "Podemos conversar hoje?", "Adorei suas fotos!", "Qual horário fica bom?",
+          "Combinado então.", "Estou chegando.", "Obrigado pela conversa!", "Até mais tarde."]
+
+
+def _lotes(linhas, tamanho):
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _inserir(tabela, linhas, tamanho: int, rotulo: str) -> int:
+    total = 0
+    inicio = time.perf_counter()
+    for lote in _lotes(linhas, tamanho):
+        with engine.begin() as conn:
+            conn.execute(insert(tabela), lote)
+        total += len(lote)
+        print(f"\r{rotulo}: {total}", end="", flush=True)
+    print(f"  ({time.perf_counter() - inicio:.1f} s)")
+    return total
+
+
+def _proximo_id(tabela) -> int:
+    with engine.connect() as conn:
+        return (conn.execute(select(func.max(tabela.c.id))).scalar() or 0) + 1
+
+
+def semear_usuarios(quantidade: int, proporcao_participantes: float, lote: int, rnd: random.Random):
+    usuarios = User.__table__
+    primeiro = _proximo_id(usuarios)
+    senha = hash_senha(SENHA)
+    agora = datetime.utcnow()
+    papeis = {}
+
+    def linhas():
+        for user_id in range(primeiro, primeiro + quantidade):
+            role = "participante" if rnd.random() < proporcao_participantes else "cliente"
+            papeis[user_id] = role
+            yield {
+                "id": user_id,
+                "name": f"{rnd.choice(NOMES)} {rnd.choice(SOBRENOMES)}",
+                "email": f"usuario{user_id}@bench.local",
+                "senha": senha,
+                "role": role,
+                "bio": ", ".join(rnd.sample(TRECHOS_BIO, 3)) if role == "participante" else None,
+                "status": "suspenso" if rnd.random() < 0.01 else "disponível",
+                "exclusao_pendente": False,
+                "maior_idade": True,
+                "saldo": 0,
+                "valor_acompanhante": rnd.choice([15000, 20000, 30000, 50000]) if role == "participante" else 0,
+                "aceitou_termos": True,
+                "atualizado_em": agora,
+            }
+
+    _inserir(usuarios, linhas(), lote, "usuarios")
+    participantes = [u for u, r in papeis.items() if r == "participante"]
+    clientes = [u for u, r in papeis.items() if r == "cliente"]
+
+    def midias():
+        for user_id in participantes:
+            for posicao in range(rnd.randint(2, 5)):
+                yield {
+                    "user_id": user_id, "tipo": "foto", "posicao": posicao,
+                    "url": f"https://res.cloudinary.com/bench/image/upload/usuarios/{user_id}_{posicao}.jpg",
+                    "public_id": f"usuarios/{user_id}_{posicao}", "criado_em": agora,
+                }
+
+    _inserir(UserMedia.__table__, midias(), lote, "user_media")
+    return participantes, clientes
+
+
+def semear_mensagens(quantidade: int, participantes, clientes, lote: int, rnd: random.Random):
+    """Conversas cliente-participante com ~40 mensagens cada, em ordem cronológica."""
+    primeiro = _proximo_id(Message.__table__)
+    conversas = [(rnd.choice(clientes), rnd.choice(participantes)) for _ in range(max(1, quantidade // 40))]
+    inicio = datetime.utcnow() - timedelta(days=90)
+    passo = timedelta(days=90) / max(quantidade, 1)
+    resumo = {}
+
+    def linhas():
+        for n in range(quantidade):
+            cliente, participante = conversas[rnd.randrange(len(conversas))]
+            sender, receiver = (cliente, participante) if rnd.random() < 0.5 else (participante, cliente)
+            m = {
+                "id": primeiro + n,
+                "sender_id": sender,
+                "receiver_id": receiver,
+                "content": rnd.choice(FRASES),
+                "timestamp": inicio + passo * n,
+                "conversa": f"{min(sender, receiver)}:{max(sender, receiver)}",
+            }
+            for dono, contraparte, recebida in ((sender, receiver, False), (receiver, sender, True)):
+                linha = resumo.setdefault((dono, contraparte), {
+                    "user_id": dono, "contraparte_id": contraparte, "nao_lidas": 0, "recebeu": False,
+                })
+                linha.update(ultima_mensagem_id=m["id"], ultima_mensagem=m["content"],
+                             ultimo_remetente_id=sender, ultimo_timestamp=m["timestamp"])
+                if recebida:
+                    linha["recebeu"] = True
+                    linha["nao_lidas"] = rnd.randint(0, 3)
+            yield m
+
+    with engine.begin() as conn:
+        garantir_particoes(conn, desde=inicio)   # PostgreSQL: partições dos meses semeados
+    _inserir(Message.__table__, linhas(), lote, "messages")
+    with engine.connect() as conn:
+        nomes = dict(conn.execute(select(User.id, User.name)).all())
+    for linha in resumo.values():
+        linha["contraparte_nome"] = nomes.get(linha["contraparte_id"])
+    _inserir(ConversaResumo.__table__, resumo.values(), lote, "conversas_resumo")
+
+
+def semear_movimentos(quantidade: int, participantes, clientes, lote: int, rnd: random.Random):
+    agora = datetime.utcnow()
+    aguardando = set()
+
+    def linhas():
+        for n in range(quantidade):
+            cliente, participante = rnd.choice(clientes), rnd.choice(participantes)
+            tipo = rnd.choice(["fotos", "videos", "acompanhante"])
+            sorteio = rnd.random()
+            timestamp = agora - timedelta(minutes=rnd.randint(0, 60 * 24 * 180))
+            if sorteio < 0.2 and (cliente, participante, tipo) not in aguardando:
+                aguardando.add((cliente, participante, tipo))
+                status, expiracao = "aguardando", None
+            elif sorteio < 0.3:
+                status, expiracao = "liberado", agora + timedelta(minutes=rnd.randint(1, 60))
+            else:
+                status, expiracao = "expirado", timestamp + timedelta(hours=1)
+            yield {
+                "cliente_id": cliente, "participante_id": participante, "tipo": tipo,
+                "valor": 1000, "metodo": rnd.choice(["pix", "cartao"]), "status": status,
+                "timestamp": timestamp, "repassado": status == "expirado" and rnd.random() < 0.8,
+                "expiracao": expiracao,
+            }
+
+    _inserir(Movimento.__table__, linhas(), lote, "movimentos")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--usuarios", type=int, default=100_000)
+    parser.add_argument("--participantes", type=float, default=0.3, help="proporção de participantes")
+    parser.add_argument("--mensagens", type=int, default=2_000_000)
+    parser.add_argument("--movimentos", type=int, default=1_000_000)
+    parser.add_argument("--lote", type=int, default=10_000)
+    parser.add_argument("--semente", type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.semente)
+    migrations.upgrade(engine)
+    participantes, clientes = semear_usuarios(args.usuarios, args.participantes, args.lote, rnd)
+    semear_mensagens(args.mensagens, participantes, clientes, args.lote, rnd)
+    semear_movimentos(args.movimentos, participantes, clientes, args.lote, rnd)
+
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Ids explícitos: as sequências precisam continuar depois deles
+            for tabela in ("usuarios", "messages"):
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{tabela}', 'id'), (SELECT MAX(id) FROM {tabela}))"
+                ))
+        conn.execute(text("ANALYZE"))
+
+
+if __name__ == "__main__":
+    main()
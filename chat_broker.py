@@ -0,0 +1,202 @@
+# chat_broker.py
+# Distribuição de eventos do chat em tempo real (WebSocket).
+#
+# As rotas publicam eventos para um usuário e cada conexão WebSocket aberta
+# recebe os eventos numa fila asyncio própria. O broker em memória atende um
+# único processo; com vários workers do uvicorn use CHAT_BROKER=postgres, que
+# repassa os eventos entre processos via LISTEN/NOTIFY do próprio PostgreSQL.
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Eventos pendentes por conexão antes de descartar os mais antigos
+MAX_FILA = int(os.getenv("CHAT_BROKER_MAX_FILA", "100"))
+
+
+class ChatBroker:
+    """Interface dos brokers do chat.
+
+    `publish` pode ser chamado de qualquer thread (rotas síncronas rodam no
+    threadpool); `subscribe` e `unsubscribe` são chamados dentro do event loop.
+    """
+
+    def publish(self, user_id: int, evento: dict) -> None:
+        raise NotImplementedError
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        raise NotImplementedError
+
+    def unsubscribe(self, user_id: int, fila: asyncio.Queue) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryBroker(ChatBroker):
+    """Fan-out dentro do processo. Usado em testes e em deploys com um worker."""
+
+    def __init__(self, max_fila: int = MAX_FILA):
+        self.max_fila = max_fila
+        self._assinantes: Dict[int, Dict[asyncio.Queue, asyncio.AbstractEventLoop]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        fila = asyncio.Queue(maxsize=self.max_fila)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._assinantes.setdefault(user_id, {})[fila] = loop
+        return fila
+
+    def unsubscribe(self, user_id: int, fila: asyncio.Queue) -> None:
+        with self._lock:
+            filas = self._assinantes.get(user_id)
+            if not filas:
+                return
+            filas.pop(fila, None)
+            if not filas:
+                del self._assinantes[user_id]
+
+    def conectados(self, user_id: int) -> int:
+        with self._lock:
+            return len(self._assinantes.get(user_id, {}))
+
+    def publish(self, user_id: int, evento: dict) -> None:
+        with self._lock:
+            alvos = list(self._assinantes.get(user_id, {}).items())
+        for fila, loop in alvos:
+            try:
+                loop.call_soon_threadsafe(self._entregar, fila, evento)
+            except RuntimeError:
+                # Loop já encerrado: a conexão será removida no unsubscribe
+                pass
+
+    @staticmethod
+    def _entregar(fila: asyncio.Queue, evento: dict) -> None:
+        # Cliente lento não pode segurar memória: descarta o evento mais antigo
+        if fila.full():
+            fila.get_nowait()
+        fila.put_nowait(evento)
+
+
+class PostgresBroker(InMemoryBroker):
+    """Compartilha eventos entre workers usando LISTEN/NOTIFY.
+
+    Cada processo mantém uma conexão escutando o canal e entrega localmente o
+    que recebe; o próprio publicador também recebe a notificação, então não há
+    entrega local direta (evita duplicidade).
+    """
+
+    CANAL = "deumatch_chat"
+    # Limite do payload do NOTIFY no PostgreSQL
+    MAX_PAYLOAD = 7900
+
+    def __init__(self, dsn: str, max_fila: int = MAX_FILA):
+        super().__init__(max_fila)
+        self.dsn = dsn
+        self._conn_publicacao = None
+        self._lock_publicacao = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+
+    def _conectar(self):
+        import psycopg2
+
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        self._iniciar_listener()
+        return super().subscribe(user_id)
+
+    def publish(self, user_id: int, evento: dict) -> None:
+        payload = json.dumps({"u": user_id, "e": evento}, default=str)
+        if len(payload.encode("utf-8")) > self.MAX_PAYLOAD:
+            logger.warning("Evento do chat grande demais para NOTIFY; entregando só neste worker")
+            super().publish(user_id, evento)
+            return
+        with self._lock_publicacao:
+            try:
+                if self._conn_publicacao is None or self._conn_publicacao.closed:
+                    self._conn_publicacao = self._conectar()
+                with self._conn_publicacao.cursor() as cur:
+                    cur.execute("SELECT pg_notify(%s, %s)", (self.CANAL, payload))
+            except Exception:
+                logger.exception("Falha ao publicar evento do chat; entregando só neste worker")
+                self._conn_publicacao = None
+                super().publish(user_id, evento)
+
+    def _iniciar_listener(self) -> None:
+        if self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._escutar, name="chat-broker", daemon=True)
+                self._listener.start()
+
+    def _escutar(self) -> None:
+        espera = 1
+        while not self._parar.is_set():
+            try:
+                conn = self._conectar()
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.CANAL}")
+                espera = 1
+                while not self._parar.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notificacao = conn.notifies.pop(0)
+                        dados = json.loads(notificacao.payload)
+                        InMemoryBroker.publish(self, dados["u"], dados["e"])
+                conn.close()
+            except Exception:
+                logger.exception("Conexão LISTEN do chat caiu; reconectando em %ss", espera)
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+
+    def close(self) -> None:
+        self._parar.set()
+        if self._conn_publicacao is not None:
+            self._conn_publicacao.close()
+
+
+# === BROKER DO PROCESSO ===
+def _dsn_libpq(url: str) -> str:
+    """postgresql+psycopg2://... -> postgresql://... (psycopg2 não aceita o +driver do SQLAlchemy)."""
+    esquema, separador, resto = url.partition("://")
+    return esquema.split("+", 1)[0] + separador + resto
+
+
+_broker: Optional[ChatBroker] = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> ChatBroker:
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                tipo = os.getenv("CHAT_BROKER", "memory")
+                if tipo == "postgres":
+                    _broker = PostgresBroker(_dsn_libpq(os.getenv("DATABASE_URL")))
+                elif tipo == "memory":
+                    _broker = InMemoryBroker()
+                else:
+                    raise EnvironmentError(f"CHAT_BROKER inválido: {tipo}")
+    return _broker
+
+
+def set_broker(broker: ChatBroker) -> None:
+    """Troca o broker do processo (testes)."""
+    global _broker
+    _broker = broker
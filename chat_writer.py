@@ -0,0 +1,117 @@
+# chat_writer.py
+# Group commit das mensagens do chat (opcional: CHAT_GROUP_COMMIT=true).
+#
+# Sem ele, cada send_message é uma transação com seu próprio commit (e fsync).
+# Com ele, as mensagens que chegam dentro de CHAT_GROUP_COMMIT_MS são gravadas
+# juntas (até CHAT_GROUP_COMMIT_MAX): um INSERT de várias linhas com
+# RETURNING, o upsert da caixa de entrada e um único commit. Cada chamada de
+# gravar() recebe de volta a própria linha (id e timestamp). Se o lote falhar,
+# as mensagens são regravadas uma a uma, para o erro de uma não derrubar as
+# outras. O custo é a espera da janela (alguns ms) em cada envio.
+import asyncio
+import logging
+import os
+from typing import List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from conversas import upsert_resumo
+from database import get_async_engine
+from models import Message
+
+logger = logging.getLogger(__name__)
+
+CHAT_GROUP_COMMIT = os.getenv("CHAT_GROUP_COMMIT", "false").lower() in ("1", "true", "sim")
+CHAT_GROUP_COMMIT_MS = float(os.getenv("CHAT_GROUP_COMMIT_MS", "5"))
+CHAT_GROUP_COMMIT_MAX = int(os.getenv("CHAT_GROUP_COMMIT_MAX", "200"))
+
+COLUNAS = (Message.id, Message.sender_id, Message.receiver_id, Message.content, Message.timestamp)
+
+
+async def _inserir(mensagens: List[dict]) -> List[dict]:
+    """Grava as mensagens e a caixa de entrada numa transação; linhas na ordem de entrada."""
+    async with get_async_engine().begin() as conn:
+        resultado = await conn.execute(
+            insert(Message).returning(*COLUNAS, sort_by_parameter_order=True), mensagens
+        )
+        linhas = [dict(linha._mapping) for linha in resultado]
+        await conn.execute(upsert_resumo(conn.dialect.name, linhas))
+    return linhas
+
+
+class EscritorMensagens:
+    def __init__(self, janela_ms: float = CHAT_GROUP_COMMIT_MS, maximo: int = CHAT_GROUP_COMMIT_MAX):
+        self.janela = janela_ms / 1000
+        self.maximo = maximo
+        self._fila: Optional[asyncio.Queue] = None
+        self._tarefa: Optional[asyncio.Task] = None
+        self.lotes = 0
+        self.mensagens = 0
+
+    async def start(self) -> None:
+        self._fila = asyncio.Queue()
+        self._tarefa = asyncio.create_task(self._worker())
+
+    async def stop(self) -> None:
+        if self._tarefa is None:
+            return
+        # Grava o que já está na fila antes de parar
+        await self._fila.join()
+        self._tarefa.cancel()
+        await asyncio.gather(self._tarefa, return_exceptions=True)
+        self._tarefa = None
+        self._fila = None
+
+    async def gravar(self, mensagem: dict) -> dict:
+        if self._fila is None:
+            # Escritor não iniciado (ex.: scripts): grava direto, lote de um
+            return (await _inserir([mensagem]))[0]
+        futuro = asyncio.get_running_loop().create_future()
+        self._fila.put_nowait((mensagem, futuro))
+        return await futuro
+
+    async def _coletar(self) -> List[Tuple[dict, asyncio.Future]]:
+        lote = [await self._fila.get()]
+        prazo = asyncio.get_running_loop().time() + self.janela
+        while len(lote) < self.maximo:
+            restante = prazo - asyncio.get_running_loop().time()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self._fila.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _worker(self) -> None:
+        while True:
+            lote = await self._coletar()
+            try:
+                await self._gravar_lote(lote)
+            finally:
+                for _ in lote:
+                    self._fila.task_done()
+
+    async def _gravar_lote(self, lote: List[Tuple[dict, asyncio.Future]]) -> None:
+        try:
+            linhas = await _inserir([m for m, _ in lote])
+        except Exception:
+            logger.exception("Falha no lote de %s mensagens; gravando uma a uma", len(lote))
+            for mensagem, futuro in lote:
+                try:
+                    linha = (await _inserir([mensagem]))[0]
+                except Exception as e:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                else:
+                    if not futuro.done():
+                        futuro.set_result(linha)
+            return
+        self.lotes += 1
+        self.mensagens += len(lote)
+        for (_, futuro), linha in zip(lote, linhas):
+            if not futuro.done():   # quem chamou pode ter desistido (cancelado)
+                futuro.set_result(linha)
+
+
+escritor = EscritorMensagens()
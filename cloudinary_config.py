@@ -1,16 +1,32 @@
 # cloudinary_config.py
-import cloudinary
+# Configuração do Cloudinary sob demanda: feita uma vez, no primeiro uso do
+# uploader, e não na importação (o processo sobe sem esperar o SDK).
 import os
+import threading
 
-cloud_name = os.environ.get("CLOUDINARY_CLOUD_NAME")
-api_key = os.environ.get("CLOUDINARY_API_KEY")
-api_secret = os.environ.get("CLOUDINARY_API_SECRET")
+_configurado = False
+_lock = threading.Lock()
 
-if not all([cloud_name, api_key, api_secret]):
-    raise EnvironmentError("Variáveis do Cloudinary não estão definidas no ambiente.")
 
-cloudinary.config(
-    cloud_name=cloud_name,
-    api_key=api_key,
-    api_secret=api_secret
-)
+def configurar() -> None:
+    global _configurado
+    if _configurado:
+        return
+    with _lock:
+        if _configurado:
+            return
+        import cloudinary
+
+        cloud_name = os.environ.get("CLOUDINARY_CLOUD_NAME")
+        api_key = os.environ.get("CLOUDINARY_API_KEY")
+        api_secret = os.environ.get("CLOUDINARY_API_SECRET")
+
+        if not all([cloud_name, api_key, api_secret]):
+            raise EnvironmentError("Variáveis do Cloudinary não estão definidas no ambiente.")
+
+        cloudinary.config(
+            cloud_name=cloud_name,
+            api_key=api_key,
+            api_secret=api_secret
+        )
+        _configurado = True
@@ -0,0 +1,80 @@
+# conversas.py
+# Manutenção incremental da caixa de entrada (tabela conversas_resumo).
+#
+# Cada mensagem atualiza duas linhas: a visão do remetente e a do
+# destinatário. A caixa de entrada vira uma leitura indexada por
+# (user_id, ultimo_timestamp), sem varrer a tabela de mensagens.
+from sqlalchemy import case, func, or_, select, update
+
+from database import upsert_insert
+from models import ConversaResumo, User
+
+
+def linhas_resumo(mensagens):
+    """Agrupa mensagens (em ordem de id) em uma linha por (dono, contraparte)."""
+    linhas = {}
+    for m in mensagens:
+        for dono, contraparte, recebida in (
+            (m["sender_id"], m["receiver_id"], False),
+            (m["receiver_id"], m["sender_id"], True),
+        ):
+            linha = linhas.get((dono, contraparte))
+            if linha is None:
+                linha = linhas[(dono, contraparte)] = {
+                    "user_id": dono,
+                    "contraparte_id": contraparte,
+                    "nao_lidas": 0,
+                    "recebeu": False,
+                }
+            linha["ultima_mensagem_id"] = m["id"]
+            linha["ultima_mensagem"] = m["content"]
+            linha["ultimo_remetente_id"] = m["sender_id"]
+            linha["ultimo_timestamp"] = m["timestamp"]
+            if recebida:
+                linha["nao_lidas"] += 1
+                linha["recebeu"] = True
+    return list(linhas.values())
+
+
+def upsert_resumo(dialect_name: str, mensagens):
+    """Statement único que aplica as mensagens já gravadas ao resumo."""
+    insert = upsert_insert(dialect_name)
+    linhas = linhas_resumo(mensagens)
+    for linha in linhas:
+        # Nome só é gravado se ainda faltar; renomear_contraparte mantém depois
+        linha["contraparte_nome"] = (
+            select(User.name).where(User.id == linha["contraparte_id"]).scalar_subquery()
+        )
+
+    stmt = insert(ConversaResumo).values(linhas)
+    novo = stmt.excluded
+    # Commits concorrentes podem chegar fora de ordem: só avança a "última mensagem"
+    mais_nova = novo.ultima_mensagem_id > func.coalesce(ConversaResumo.ultima_mensagem_id, 0)
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "contraparte_id"],
+        set_={
+            "ultima_mensagem_id": case((mais_nova, novo.ultima_mensagem_id), else_=ConversaResumo.ultima_mensagem_id),
+            "ultima_mensagem": case((mais_nova, novo.ultima_mensagem), else_=ConversaResumo.ultima_mensagem),
+            "ultimo_remetente_id": case((mais_nova, novo.ultimo_remetente_id), else_=ConversaResumo.ultimo_remetente_id),
+            "ultimo_timestamp": case((mais_nova, novo.ultimo_timestamp), else_=ConversaResumo.ultimo_timestamp),
+            "contraparte_nome": func.coalesce(ConversaResumo.contraparte_nome, novo.contraparte_nome),
+            "nao_lidas": ConversaResumo.nao_lidas + novo.nao_lidas,
+            "recebeu": or_(ConversaResumo.recebeu, novo.recebeu),
+        },
+    )
+
+
+def marcar_lida(user_id: int, contraparte_id: int):
+    return (
+        update(ConversaResumo)
+        .where(ConversaResumo.user_id == user_id, ConversaResumo.contraparte_id == contraparte_id)
+        .values(nao_lidas=0)
+    )
+
+
+def renomear_contraparte(user_id: int, nome: str):
+    return (
+        update(ConversaResumo)
+        .where(ConversaResumo.contraparte_id == user_id)
+        .values(contraparte_nome=nome)
+    )
@@ -1,6 +1,9 @@
 import os
+import time
+from contextvars import ContextVar
 from dotenv import load_dotenv  # ← adicionado
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -13,12 +16,74 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise EnvironmentError("Variável DATABASE_URL não encontrada no ambiente.")
 
+# Pool de conexões configurável pelo ambiente (o SQLite usa o pool padrão)
+def _opcoes_pool(url: str) -> dict:
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        # Descarta conexões derrubadas pelo servidor/proxy antes de usá-las
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "sim"),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+
 # Cria o engine de conexão
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **_opcoes_pool(DATABASE_URL))
 
 # Sessão padrão
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# === RÉPLICA DE LEITURA (opcional) ===
+# Leituras pesadas podem ir para uma réplica. Sem DATABASE_REPLICA_URL tudo
+# continua no primário.
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# Depois de uma escrita, o cliente lê do primário por este tempo (lag da réplica)
+REPLICA_PIN_SECONDS = float(os.getenv("DB_REPLICA_PIN_SECONDS", "5"))
+COOKIE_PRIMARIO = "dm_primario"
+# Front em outro site não devolve o cookie: o cliente ecoa este header da resposta
+HEADER_PRIMARIO = "X-Primario-Ate"
+
+replica_engine = (
+    create_engine(DATABASE_REPLICA_URL, **_opcoes_pool(DATABASE_REPLICA_URL))
+    if DATABASE_REPLICA_URL else engine
+)
+ReplicaSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=replica_engine, info={"replica": bool(DATABASE_REPLICA_URL)}
+)
+
+# Verdadeiro quando a requisição atual deve ler do primário (ver main.fixar_primario)
+primario_fixado: ContextVar[bool] = ContextVar("primario_fixado", default=False)
+
+def deve_fixar_primario(valor) -> bool:
+    """O cookie/header guarda até quando (epoch) o cliente fica no primário."""
+    try:
+        ate = float(valor)
+    except (TypeError, ValueError):
+        return False
+    agora = time.time()
+    # Valor forjado no header não prende o cliente no primário além de uma janela
+    return agora < ate <= agora + REPLICA_PIN_SECONDS + 1
+
+# user_id (sub do token) -> até quando (epoch) lê do primário, neste processo
+_usuarios_fixados = {}
+MAX_USUARIOS_FIXADOS = 100000
+
+def fixar_usuario(user_id: int, ate: float) -> None:
+    if len(_usuarios_fixados) >= MAX_USUARIOS_FIXADOS:
+        agora = time.time()
+        for vencido in [u for u, t in _usuarios_fixados.items() if t <= agora]:
+            _usuarios_fixados.pop(vencido, None)
+    _usuarios_fixados[user_id] = ate
+
+def usuario_fixado(user_id: int) -> bool:
+    return _usuarios_fixados.get(user_id, 0) > time.time()
+
+def lendo_replica(db) -> bool:
+    """A sessão lê de uma réplica (resultado pode estar alguns segundos atrasado)."""
+    return bool(db.info.get("replica"))
+
 # Base para os modelos
 Base = declarative_base()
 
@@ -29,3 +94,70 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Leitura: réplica, exceto logo depois de o cliente escrever (read-your-writes)
+def get_read_db():
+    db = SessionLocal() if primario_fixado.get() else ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# === ENGINE ASSÍNCRONO (rotas async def) ===
+# Mesmo banco, driver assíncrono: as rotas async não bloqueiam o event loop
+# esperando o banco. Criado só quando alguma rota o usa pela primeira vez.
+def _url_async(url: str) -> str:
+    if url.startswith("sqlite"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    for prefixo in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefixo):
+            # asyncpg não reconhece sslmode; o equivalente é ssl
+            return "postgresql+asyncpg://" + url[len(prefixo):].replace("sslmode=", "ssl=")
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _url_async(DATABASE_URL)
+ASYNC_DATABASE_REPLICA_URL = (
+    os.getenv("ASYNC_DATABASE_REPLICA_URL") or (_url_async(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None)
+)
+
+# "primario" / "replica" -> (engine, sessionmaker)
+_async_engines = {}
+
+def _async_sessionmaker(papel: str = "primario"):
+    if papel == "replica" and not ASYNC_DATABASE_REPLICA_URL:
+        papel = "primario"
+    if papel not in _async_engines:
+        url = ASYNC_DATABASE_URL if papel == "primario" else ASYNC_DATABASE_REPLICA_URL
+        async_engine = create_async_engine(url, **_opcoes_pool(url))
+        # Sem expirar no commit: atributos lidos depois do commit não geram I/O implícito
+        _async_engines[papel] = (async_engine, async_sessionmaker(
+            async_engine, class_=AsyncSession, expire_on_commit=False, info={"replica": papel == "replica"}
+        ))
+    return _async_engines[papel][1]
+
+def get_async_engine():
+    _async_sessionmaker()
+    return _async_engines["primario"][0]
+
+async def get_async_db():
+    async with _async_sessionmaker()() as db:
+        yield db
+
+async def get_async_read_db():
+    async with _async_sessionmaker("primario" if primario_fixado.get() else "replica")() as db:
+        yield db
+
+async def dispose_async_engine():
+    for async_engine, _ in list(_async_engines.values()):
+        await async_engine.dispose()
+    _async_engines.clear()
+
+# insert() com suporte a ON CONFLICT (upsert) do dialeto em uso
+def upsert_insert(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upsert não suportado para {dialect_name}")
+    return insert
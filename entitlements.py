@@ -0,0 +1,110 @@
+# entitlements.py
+# Cache em memória das liberações de conteúdo/chat.
+#
+# A resposta de "o cliente X tem acesso a Y do participante Z?" só muda quando
+# um movimento é criado, liberado ou expira. As entradas valem até a
+# expiracao do movimento (ou ENTITLEMENT_CACHE_TTL, o que vier antes) e são
+# invalidadas por criar_movimento/liberar_movimento neste processo. O TTL limita
+# por quanto tempo outro worker pode responder com um estado antigo.
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+ENTITLEMENT_CACHE_TTL = timedelta(seconds=float(os.getenv("ENTITLEMENT_CACHE_TTL", "60")))
+ENTITLEMENT_CACHE_MAX = int(os.getenv("ENTITLEMENT_CACHE_MAX", "100000"))
+
+
+class EntitlementCache:
+    def __init__(self, ttl: timedelta = ENTITLEMENT_CACHE_TTL, max_entradas: int = ENTITLEMENT_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        # (cliente_id, participante_id, tipo) -> (estado, expiracao, valido_ate)
+        self._entradas = {}
+        # cliente_id -> (resultado de listar_movimentos_cliente, valido_ate)
+        self._clientes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidacoes = 0
+
+    def _valido_ate(self, agora: datetime, expiracao: Optional[datetime], ttl: Optional[timedelta] = None) -> datetime:
+        limite = agora + min(self.ttl, ttl or self.ttl)
+        return min(limite, expiracao) if expiracao else limite
+
+    def _abrir_espaco(self, agora: datetime) -> None:
+        if len(self._entradas) + len(self._clientes) < self.max_entradas:
+            return
+        self._entradas = {k: v for k, v in self._entradas.items() if v[2] > agora}
+        self._clientes = {k: v for k, v in self._clientes.items() if v[1] > agora}
+        if len(self._entradas) + len(self._clientes) >= self.max_entradas:
+            self._entradas.clear()
+            self._clientes.clear()
+
+    # === (cliente, participante, tipo) ===
+    def get(self, cliente_id: int, participante_id: int, tipo: str):
+        """Retorna (estado, expiracao) ou None se não houver entrada válida."""
+        agora = datetime.utcnow()
+        with self._lock:
+            entrada = self._entradas.get((cliente_id, participante_id, tipo))
+            if entrada is None or entrada[2] <= agora:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entrada[0], entrada[1]
+
+    def put(self, cliente_id: int, participante_id: int, tipo: str, estado,
+            expiracao: Optional[datetime] = None, ttl: Optional[timedelta] = None) -> None:
+        """ttl: validade menor que a padrão (ex.: leitura feita numa réplica atrasada)."""
+        agora = datetime.utcnow()
+        with self._lock:
+            self._abrir_espaco(agora)
+            self._entradas[(cliente_id, participante_id, tipo)] = (
+                estado, expiracao, self._valido_ate(agora, expiracao if estado is True else None, ttl)
+            )
+
+    # === visão completa de um cliente ===
+    def get_cliente(self, cliente_id: int) -> Optional[dict]:
+        agora = datetime.utcnow()
+        with self._lock:
+            entrada = self._clientes.get(cliente_id)
+            if entrada is None or entrada[1] <= agora:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entrada[0]
+
+    def put_cliente(self, cliente_id: int, resultado: dict, expiracao: Optional[datetime] = None,
+                    ttl: Optional[timedelta] = None) -> None:
+        """expiracao: a mais próxima entre as liberações ativas do cliente."""
+        agora = datetime.utcnow()
+        with self._lock:
+            self._abrir_espaco(agora)
+            self._clientes[cliente_id] = (resultado, self._valido_ate(agora, expiracao, ttl))
+
+    # === invalidação ===
+    def invalidar(self, cliente_id: int, participante_id: int, tipo: str) -> None:
+        with self._lock:
+            self._entradas.pop((cliente_id, participante_id, tipo), None)
+            self._clientes.pop(cliente_id, None)
+            self.invalidacoes += 1
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._clientes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "invalidacoes": self.invalidacoes,
+                "entradas": len(self._entradas),
+                "clientes": len(self._clientes),
+            }
+
+
+cache = EntitlementCache()
@@ -0,0 +1,115 @@
+# expiry_sweeper.py
+# Varredura periódica das liberações vencidas.
+#
+# Movimentos "liberado" cuja expiracao passou viram "expirado" em lotes
+# limitados (EXPIRY_SWEEP_BATCH), cada lote na sua transação. Para cada linha
+# expirada é emitido um evento: o cache de liberações é invalidado e o cliente
+# conectado ao WebSocket recebe "movimento_expirado". Com vários workers, o
+# PostgreSQL usa FOR UPDATE SKIP LOCKED para que os lotes não se sobreponham.
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Callable, List
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, update
+
+from chat_broker import get_broker
+from database import SessionLocal
+from entitlements import cache as entitlement_cache
+from models import Movimento
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_SWEEP_INTERVAL = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "30"))  # segundos
+EXPIRY_SWEEP_BATCH = int(os.getenv("EXPIRY_SWEEP_BATCH", "500"))
+
+_ouvintes: List[Callable[[dict], None]] = []
+
+
+def on_expirado(func: Callable[[dict], None]):
+    """Registra uma função chamada para cada movimento expirado."""
+    _ouvintes.append(func)
+    return func
+
+
+@on_expirado
+def _invalidar_cache(evento: dict) -> None:
+    entitlement_cache.invalidar(evento["cliente_id"], evento["participante_id"], evento["tipo"])
+
+
+@on_expirado
+def _avisar_cliente(evento: dict) -> None:
+    get_broker().publish(evento["cliente_id"], {"evento": "movimento_expirado", "dados": jsonable_encoder(evento)})
+
+
+def expirar_lote(db, agora: datetime, limite: int = EXPIRY_SWEEP_BATCH) -> List[dict]:
+    """Expira até `limite` movimentos vencidos e devolve as linhas alteradas."""
+    vencidos = (
+        select(Movimento.id)
+        .where(Movimento.status == "liberado", Movimento.expiracao <= agora)
+        .order_by(Movimento.expiracao)
+        .limit(limite)
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        vencidos = vencidos.with_for_update(skip_locked=True)
+
+    stmt = (
+        update(Movimento)
+        .where(Movimento.id.in_(vencidos), Movimento.status == "liberado")
+        .values(status="expirado")
+        .returning(Movimento.id, Movimento.cliente_id, Movimento.participante_id, Movimento.tipo, Movimento.expiracao)
+        .execution_options(synchronize_session=False)
+    )
+    linhas = [dict(linha._mapping) for linha in db.execute(stmt)]
+    db.commit()
+    return linhas
+
+
+def varrer() -> int:
+    """Expira todos os movimentos vencidos, lote a lote. Retorna o total."""
+    total = 0
+    db = SessionLocal()
+    try:
+        while True:
+            linhas = expirar_lote(db, datetime.utcnow())
+            for linha in linhas:
+                for ouvinte in _ouvintes:
+                    try:
+                        ouvinte(linha)
+                    except Exception:
+                        logger.exception("Falha no evento de expiração do movimento %s", linha["id"])
+            total += len(linhas)
+            if len(linhas) < EXPIRY_SWEEP_BATCH:
+                return total
+    finally:
+        db.close()
+
+
+class ExpirySweeper:
+    def __init__(self, intervalo: float = EXPIRY_SWEEP_INTERVAL):
+        self.intervalo = intervalo
+        self._tarefa = None
+
+    def start(self) -> None:
+        self._tarefa = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._tarefa:
+            self._tarefa.cancel()
+            await asyncio.gather(self._tarefa, return_exceptions=True)
+            self._tarefa = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                expirados = await asyncio.to_thread(varrer)
+                if expirados:
+                    logger.info("%s movimento(s) expirado(s)", expirados)
+            except Exception:
+                logger.exception("Falha na varredura de expiração")
+            await asyncio.sleep(self.intervalo)
+
+
+sweeper = ExpirySweeper()
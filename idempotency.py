@@ -0,0 +1,278 @@
+# idempotency.py
+# Suporte ao header Idempotency-Key (POST /movimentos e POST /messages/send).
+#
+# O app reenvia a requisição quando a conexão cai. Com a mesma Idempotency-Key,
+# a repetição recebe a resposta guardada da primeira, com o header
+# Idempotent-Replayed, e não grava nada de novo. Cada chave vale por
+# IDEMPOTENCY_TTL segundos dentro de um escopo (rota + usuário). Reusar a
+# chave com outro corpo dá 422; repetir enquanto a primeira ainda está em
+# andamento dá 409 com Retry-After. Só respostas de sucesso são guardadas: se
+# a primeira falha, a chave é liberada para uma nova tentativa. Se o processo
+# morre no meio, a reserva vence em IDEMPOTENCY_LEASE segundos e a próxima
+# tentativa assume a chave (o prazo precisa ser maior que a rota mais lenta).
+#
+# Backends (IDEMPOTENCY_BACKEND):
+#   memory    LRU com TTL no processo (padrão; responde sem ir ao banco).
+#   database  tabela idempotency_keys, compartilhada entre workers e servidores.
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import and_, delete, or_, select
+
+from database import SessionLocal, upsert_insert
+from models import IdempotencyKey
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))   # segundos
+IDEMPOTENCY_MAX = int(os.getenv("IDEMPOTENCY_MAX", "100000"))    # entradas no backend em memória
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "60"))  # segundos de reserva "em andamento"
+RETRY_AFTER_EM_ANDAMENTO = 1
+
+# Resultados de iniciar()
+NOVA, REPETIDA, EM_ANDAMENTO, CONFLITO = "nova", "repetida", "em_andamento", "conflito"
+
+
+def impressao(dados: dict) -> str:
+    return hashlib.sha256(json.dumps(jsonable_encoder(dados), sort_keys=True).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Interface dos backends.
+
+    iniciar() reserva a chave (NOVA) ou devolve o estado de quem chegou antes:
+    (REPETIDA, (status, corpo)), EM_ANDAMENTO ou CONFLITO.
+    """
+
+    # Backends que fazem I/O bloqueante rodam fora do event loop nas rotas async
+    bloqueante = False
+
+    def iniciar(self, chave: str, impressao: str) -> Tuple[str, Optional[Tuple[int, object]]]:
+        raise NotImplementedError
+
+    def concluir(self, chave: str, status_code: int, corpo) -> None:
+        raise NotImplementedError
+
+    def cancelar(self, chave: str) -> None:
+        raise NotImplementedError
+
+
+class InMemoryStore(IdempotencyStore):
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_entradas: int = IDEMPOTENCY_MAX):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        # chave -> [impressao, status_code (None = em andamento), corpo, expira_em]
+        self._entradas: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def iniciar(self, chave, impressao):
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada[3] > agora:
+                self._entradas.move_to_end(chave)
+                if entrada[0] != impressao:
+                    return CONFLITO, None
+                if entrada[1] is None:
+                    return EM_ANDAMENTO, None
+                return REPETIDA, (entrada[1], entrada[2])
+            self._entradas[chave] = [impressao, None, None, agora + self.ttl]
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)   # menos usada recentemente
+            return NOVA, None
+
+    def concluir(self, chave, status_code, corpo):
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                entrada[1], entrada[2] = status_code, corpo
+
+    def cancelar(self, chave):
+        with self._lock:
+            self._entradas.pop(chave, None)
+
+
+class DatabaseStore(IdempotencyStore):
+    bloqueante = True
+    # A cada quantas reservas o processo apaga as chaves vencidas
+    LIMPAR_A_CADA = 1000
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, lease: float = IDEMPOTENCY_LEASE):
+        self.ttl = timedelta(seconds=ttl)
+        self.lease = timedelta(seconds=lease)
+        self._reservas = 0
+
+    def iniciar(self, chave, impressao):
+        agora = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            self._reservas += 1
+            if self._reservas % self.LIMPAR_A_CADA == 0:
+                db.execute(delete(IdempotencyKey).where(IdempotencyKey.expira_em <= agora))
+            # Chave vencida, ou reserva de quem morreu no meio, é apagada antes: a reserva abaixo a recria
+            db.execute(delete(IdempotencyKey).where(
+                IdempotencyKey.chave == chave,
+                or_(
+                    IdempotencyKey.expira_em <= agora,
+                    and_(IdempotencyKey.status_code.is_(None), IdempotencyKey.em_andamento_ate <= agora),
+                ),
+            ))
+            insert_ = upsert_insert(db.get_bind().dialect.name)
+            reservada = db.execute(
+                insert_(IdempotencyKey)
+                .values(chave=chave, impressao=impressao, criado_em=agora, expira_em=agora + self.ttl,
+                        em_andamento_ate=agora + self.lease)
+                .on_conflict_do_nothing(index_elements=["chave"])
+                .returning(IdempotencyKey.chave)
+            ).first()
+            db.commit()
+            if reservada:
+                return NOVA, None
+            existente = db.execute(
+                select(IdempotencyKey.impressao, IdempotencyKey.status_code, IdempotencyKey.resposta)
+                .where(IdempotencyKey.chave == chave)
+            ).first()
+        finally:
+            db.close()
+        if existente is None:
+            return self.iniciar(chave, impressao)   # cancelada entre o INSERT e o SELECT
+        if existente.impressao != impressao:
+            return CONFLITO, None
+        if existente.status_code is None:
+            return EM_ANDAMENTO, None
+        return REPETIDA, (existente.status_code, json.loads(existente.resposta))
+
+    def concluir(self, chave, status_code, corpo):
+        db = SessionLocal()
+        try:
+            db.query(IdempotencyKey).filter(IdempotencyKey.chave == chave).update(
+                {"status_code": status_code, "resposta": json.dumps(corpo), "em_andamento_ate": None},
+                synchronize_session=False,
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def cancelar(self, chave):
+        db = SessionLocal()
+        try:
+            db.execute(delete(IdempotencyKey).where(IdempotencyKey.chave == chave))
+            db.commit()
+        finally:
+            db.close()
+
+
+# === BACKEND DO PROCESSO ===
+_store: Optional[IdempotencyStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> IdempotencyStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                tipo = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+                if tipo == "memory":
+                    _store = InMemoryStore()
+                elif tipo == "database":
+                    _store = DatabaseStore()
+                else:
+                    raise EnvironmentError(f"IDEMPOTENCY_BACKEND inválido: {tipo}")
+    return _store
+
+
+def set_store(store: IdempotencyStore) -> None:
+    """Troca o backend do processo (testes)."""
+    global _store
+    _store = store
+
+
+# === USO NAS ROTAS ===
+stats = {"repetidas": 0, "em_andamento": 0, "conflitos": 0}
+
+
+class Idempotencia:
+    """Contexto de uma requisição. Sem Idempotency-Key não faz nada.
+
+        with Idempotencia(idempotency_key, f"movimentos:{cliente_id}", dados) as idem:
+            if idem.resposta:
+                return idem.resposta
+            ...
+            return idem.guardar(resultado)
+
+    Nas rotas async, use `async with` (backends bloqueantes rodam em thread).
+    """
+
+    def __init__(self, chave: Optional[str], escopo: str, dados: dict):
+        self.chave = f"{escopo}:{chave}" if chave else None
+        self.impressao = impressao(dados) if chave else None
+        self.resposta: Optional[JSONResponse] = None
+        self._concluida = False
+        self._store = get_store() if chave else None
+
+    def _resultado(self, estado: str, guardada) -> None:
+        if estado == NOVA:
+            return
+        if estado == CONFLITO:
+            stats["conflitos"] += 1
+            raise HTTPException(status_code=422, detail="Idempotency-Key já usada com outra requisição.")
+        if estado == EM_ANDAMENTO:
+            stats["em_andamento"] += 1
+            raise HTTPException(
+                status_code=409, detail="Requisição com esta Idempotency-Key ainda em processamento.",
+                headers={"Retry-After": str(RETRY_AFTER_EM_ANDAMENTO)},
+            )
+        stats["repetidas"] += 1
+        self._concluida = True   # nada a guardar nem a cancelar
+        status_code, corpo = guardada
+        self.resposta = JSONResponse(corpo, status_code=status_code, headers={"Idempotent-Replayed": "true"})
+
+    def guardar(self, resultado, status_code: int = 200):
+        """Guarda o resultado (sucesso) para as repetições e o devolve."""
+        if self.chave:
+            self._store.concluir(self.chave, status_code, jsonable_encoder(resultado))
+            self._concluida = True
+        return resultado
+
+    async def guardar_async(self, resultado, status_code: int = 200):
+        if self.chave and self._store.bloqueante:
+            await asyncio.to_thread(self._store.concluir, self.chave, status_code, jsonable_encoder(resultado))
+            self._concluida = True
+            return resultado
+        return self.guardar(resultado, status_code)
+
+    def __enter__(self):
+        if self.chave:
+            self._resultado(*self._store.iniciar(self.chave, self.impressao))
+        return self
+
+    def __exit__(self, tipo, erro, tb):
+        if self.chave and not self._concluida:
+            self._store.cancelar(self.chave)   # falhou: a próxima tentativa executa de novo
+        return False
+
+    async def __aenter__(self):
+        if self.chave:
+            if self._store.bloqueante:
+                self._resultado(*await asyncio.to_thread(self._store.iniciar, self.chave, self.impressao))
+            else:
+                self._resultado(*self._store.iniciar(self.chave, self.impressao))
+        return self
+
+    async def __aexit__(self, tipo, erro, tb):
+        if self.chave and not self._concluida:
+            if self._store.bloqueante:
+                await asyncio.to_thread(self._store.cancelar, self.chave)
+            else:
+                self._store.cancelar(self.chave)
+        return False
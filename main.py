@@ -1,17 +1,110 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from database import Base, engine
-from routes import users, chat, movimento, pagamento  # Importando tudo de uma vez (boa prática)
+from database import (
+    engine, dispose_async_engine, primario_fixado, deve_fixar_primario, fixar_usuario, usuario_fixado,
+    COOKIE_PRIMARIO, HEADER_PRIMARIO, DATABASE_REPLICA_URL, REPLICA_PIN_SECONDS,
+)
+import migrations
+import chat_writer
+import media_jobs
+import security
+import search
+from expiry_sweeper import sweeper
+from arquivo_mensagens import arquivador, particionador
+from metrics import MetricsMiddleware
+from rate_limit import RateLimitMiddleware
+from routes import users, chat, movimento, pagamento, media, auth, monitoramento, dashboard, uploads  # Importando tudo de uma vez (boa prática)
+
+
+logger = logging.getLogger(__name__)
+
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() in ("1", "true", "sim")
 
-app = FastAPI()
+
+# Migrações rodam no deploy (python migrations.py); aqui só com AUTO_MIGRATE.
+# Clientes externos (Cloudinary, broker do chat) são criados no primeiro uso.
+# Tarefas de segundo plano do processo (fila de mídia e expiração de movimentos)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_MIGRATE:
+        await asyncio.to_thread(migrations.upgrade, engine)
+    else:
+        faltando = await asyncio.to_thread(migrations.pendentes, engine)
+        if faltando:
+            logger.warning("Migrações pendentes %s: rode `python migrations.py`", faltando)
+    await media_jobs.fila.start()
+    sweeper.start()
+    security.sincronizador_revogacoes.start()
+    search.atualizador_indice.start()
+    particionador.start()
+    arquivador.start()
+    if chat_writer.CHAT_GROUP_COMMIT:
+        await chat_writer.escritor.start()
+    yield
+    await chat_writer.escritor.stop()
+    await arquivador.stop()
+    await particionador.stop()
+    await sweeper.stop()
+    await security.sincronizador_revogacoes.stop()
+    await search.atualizador_indice.stop()
+    await media_jobs.fila.stop()
+    await dispose_async_engine()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Read-your-writes: quem acabou de escrever lê do primário por alguns segundos.
+# O front chama a API de outro site, então o cookie nem sempre volta. Valem:
+#   - o usuário do token (sub), fixado neste processo;
+#   - o header X-Primario-Ate da resposta, que o cliente ecoa (vale em qualquer worker);
+#   - o cookie, quando front e API são do mesmo site.
+@app.middleware("http")
+async def fixar_primario(request: Request, call_next):
+    if not DATABASE_REPLICA_URL:
+        return await call_next(request)
+    user_id = security.sub_do_header(request.headers.get("authorization"))
+    fixado = (
+        deve_fixar_primario(request.headers.get(HEADER_PRIMARIO))
+        or deve_fixar_primario(request.cookies.get(COOKIE_PRIMARIO))
+        or (user_id is not None and usuario_fixado(user_id))
+    )
+    token = primario_fixado.set(fixado)
+    try:
+        response = await call_next(request)
+    finally:
+        primario_fixado.reset(token)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        ate = time.time() + REPLICA_PIN_SECONDS
+        if user_id is not None:
+            fixar_usuario(user_id, ate)
+        response.headers[HEADER_PRIMARIO] = str(ate)
+        response.set_cookie(
+            COOKIE_PRIMARIO, str(ate),
+            max_age=int(REPLICA_PIN_SECONDS) + 1, httponly=True, samesite="lax",
+        )
+    return response
 
 # Inclusão das rotas
 app.include_router(users.router)
 app.include_router(chat.router)
 app.include_router(movimento.router)
 app.include_router(pagamento.router)
+app.include_router(media.router)
+app.include_router(auth.router)
+app.include_router(monitoramento.router)
+app.include_router(dashboard.router)
+app.include_router(uploads.router)
+
+# Limites por usuário e teto de uploads simultâneos (dentro do CORS: 429/503 legíveis no navegador)
+app.add_middleware(RateLimitMiddleware)
 
 # Middleware CORS
 app.add_middleware(
@@ -20,10 +113,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # cursor das listagens paginadas, ETag do feed, resposta repetida por Idempotency-Key,
+    # espera sugerida nos 429/503 e janela de leitura no primário (read-your-writes)
+    expose_headers=["X-Next-Cursor", "ETag", "Idempotent-Replayed", "Retry-After", "X-Primario-Ate"],
 )
 
-# Criação automática das tabelas
-Base.metadata.create_all(bind=engine)
+# Latência, status e queries por rota (exportados em /metrics)
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 def root():
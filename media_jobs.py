@@ -0,0 +1,212 @@
+# media_jobs.py
+# Processamento de mídia em segundo plano.
+#
+# As rotas gravam os arquivos recebidos num spool local (MEDIA_SPOOL_DIR),
+# registram um MediaJob e respondem na hora com o job_id. Um pool de workers
+# asyncio (MEDIA_JOB_WORKERS) envia os arquivos ao storage e atualiza o perfil.
+# O estado fica no banco: ao subir, cada processo retoma os jobs pendentes e
+# a reserva (UPDATE ... WHERE status = 'pendente') garante um único dono.
+# O spool é disco local: cada job guarda a instância que gravou os arquivos
+# (INSTANCIA) e só ela o retoma. Job de outra instância parado há mais de
+# 4 x MEDIA_JOB_TIMEOUT é dado como perdido (instância sumiu com o disco) e
+# vira "falhou"; arquivo ausente no spool também vira erro do job.
+# As mídias enviadas viram linhas em user_media.
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import aiofiles
+from fastapi import UploadFile
+from sqlalchemy import or_
+
+from database import SessionLocal
+from media_uploads import upload_async
+from midias import adicionar_midias, marcar_perfil_alterado
+from models import MediaJob
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = os.getenv("MEDIA_SPOOL_DIR", "/tmp/deumatch_spool")
+MEDIA_JOB_WORKERS = int(os.getenv("MEDIA_JOB_WORKERS", "2"))
+# Job "processando" há mais tempo que isso é considerado abandonado (worker caiu)
+MEDIA_JOB_TIMEOUT = timedelta(minutes=int(os.getenv("MEDIA_JOB_TIMEOUT_MIN", "30")))
+MEDIA_JOB_ABANDONO = MEDIA_JOB_TIMEOUT * 4
+# Identifica o disco do spool; workers da mesma máquina compartilham o mesmo
+INSTANCIA = os.getenv("MEDIA_INSTANCIA") or socket.gethostname()
+ERRO_SEM_SPOOL = "Arquivo não está no spool desta instância."
+
+CHUNK = 1024 * 1024
+
+
+# === SPOOL LOCAL ===
+async def salvar_no_spool(job_id: str, arquivos: List[UploadFile], tipo: str) -> List[dict]:
+    """Copia os uploads para o spool em blocos, sem carregar o arquivo inteiro."""
+    pasta = os.path.join(SPOOL_DIR, job_id)
+    os.makedirs(pasta, exist_ok=True)
+    salvos = []
+    for arquivo in arquivos:
+        caminho = os.path.join(pasta, uuid.uuid4().hex)
+        async with aiofiles.open(caminho, "wb") as saida:
+            while True:
+                bloco = await arquivo.read(CHUNK)
+                if not bloco:
+                    break
+                await saida.write(bloco)
+        salvos.append({"caminho": caminho, "nome": arquivo.filename, "tipo": tipo})
+    return salvos
+
+
+def novo_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def criar_job(db, job_id: str, user_id: int, arquivos: List[dict]) -> MediaJob:
+    """Adiciona o job à sessão; o commit fica com a rota (mesma transação do perfil)."""
+    job = MediaJob(id=job_id, user_id=user_id, status="pendente", arquivos=json.dumps(arquivos), instancia=INSTANCIA)
+    db.add(job)
+    return job
+
+
+def job_para_dict(job: MediaJob) -> dict:
+    resultado = json.loads(job.resultado) if job.resultado else {}
+    return {
+        "id": job.id,
+        "user_id": job.user_id,
+        "status": job.status,
+        "enviados": resultado.get("enviados", []),
+        "erros": resultado.get("erros", []),
+        "criado_em": job.criado_em,
+        "atualizado_em": job.atualizado_em,
+    }
+
+
+# === ACESSO AO BANCO (síncrono, roda em thread) ===
+def _reservar(job_id: str) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        reservado = db.query(MediaJob).filter(
+            MediaJob.id == job_id, MediaJob.status == "pendente"
+        ).update({"status": "processando", "atualizado_em": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        if not reservado:
+            return None
+        job = db.query(MediaJob).filter(MediaJob.id == job_id).first()
+        return {"user_id": job.user_id, "arquivos": json.loads(job.arquivos)}
+    finally:
+        db.close()
+
+
+def _concluir(job_id: str, user_id: int, resultados: List[dict]) -> None:
+    enviados = [r for r in resultados if "erro" not in r]
+    erros = [r for r in resultados if "erro" in r]
+    db = SessionLocal()
+    try:
+        # Uma linha por mídia em user_media: jobs simultâneos do mesmo perfil não conflitam
+        for tipo in ("foto", "video"):
+            do_tipo = [e for e in enviados if e["tipo"] == tipo]
+            if do_tipo:
+                db.execute(adicionar_midias(user_id, tipo, do_tipo))
+        if enviados:
+            db.execute(marcar_perfil_alterado(user_id))
+
+        job = db.query(MediaJob).filter(MediaJob.id == job_id).first()
+        job.status = "falhou" if erros and not enviados else "concluido"
+        job.resultado = json.dumps({"enviados": enviados, "erros": erros})
+        job.atualizado_em = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+
+def _pendentes() -> List[str]:
+    agora = datetime.utcnow()
+    # Jobs sem instância são de antes da coluna: qualquer uma tenta (arquivo ausente vira erro)
+    desta_instancia = or_(MediaJob.instancia == INSTANCIA, MediaJob.instancia.is_(None))
+    db = SessionLocal()
+    try:
+        # Jobs presos em "processando" (worker caiu no meio) voltam para a fila
+        db.query(MediaJob).filter(
+            desta_instancia, MediaJob.status == "processando", MediaJob.atualizado_em < agora - MEDIA_JOB_TIMEOUT
+        ).update({"status": "pendente"}, synchronize_session=False)
+        # De outra instância e parados há muito tempo: o spool deles não existe mais
+        db.query(MediaJob).filter(
+            ~desta_instancia,
+            MediaJob.status.in_(("pendente", "processando")),
+            MediaJob.atualizado_em < agora - MEDIA_JOB_ABANDONO,
+        ).update({
+            "status": "falhou",
+            "resultado": json.dumps({"enviados": [], "erros": [{"erro": ERRO_SEM_SPOOL}]}),
+            "atualizado_em": agora,
+        }, synchronize_session=False)
+        db.commit()
+        return [j.id for j in db.query(MediaJob.id).filter(
+            desta_instancia, MediaJob.status == "pendente"
+        ).order_by(MediaJob.criado_em)]
+    finally:
+        db.close()
+
+
+# === PROCESSAMENTO ===
+async def processar(job_id: str) -> None:
+    job = await asyncio.to_thread(_reservar, job_id)
+    if job is None:
+        return  # outro worker já pegou ou o job não existe
+
+    async def enviar(arquivo: dict) -> dict:
+        resource_type = "video" if arquivo["tipo"] == "video" else "auto"
+        if not os.path.exists(arquivo["caminho"]):
+            return {"arquivo": arquivo["nome"], "tipo": arquivo["tipo"], "erro": ERRO_SEM_SPOOL}
+        try:
+            enviado = await upload_async(arquivo["caminho"], "usuarios", resource_type)
+            return {"arquivo": arquivo["nome"], "tipo": arquivo["tipo"], **enviado}
+        except Exception as e:
+            return {"arquivo": arquivo["nome"], "tipo": arquivo["tipo"], "erro": str(e)}
+
+    resultados = await asyncio.gather(*(enviar(a) for a in job["arquivos"]))
+    await asyncio.to_thread(_concluir, job_id, job["user_id"], resultados)
+    shutil.rmtree(os.path.join(SPOOL_DIR, job_id), ignore_errors=True)
+
+
+class MediaJobQueue:
+    def __init__(self, workers: int = MEDIA_JOB_WORKERS):
+        self.workers = workers
+        self._fila: Optional[asyncio.Queue] = None
+        self._tarefas: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._fila = asyncio.Queue()
+        self._tarefas = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        for job_id in await asyncio.to_thread(_pendentes):
+            self._fila.put_nowait(job_id)
+
+    async def stop(self) -> None:
+        for tarefa in self._tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*self._tarefas, return_exceptions=True)
+        self._tarefas = []
+
+    def enqueue(self, job_id: str) -> None:
+        if self._fila is None:
+            # Sem workers neste processo (ex.: scripts): outro processo retoma ao subir
+            logger.warning("Fila de mídia não iniciada; job %s fica pendente no banco", job_id)
+            return
+        self._fila.put_nowait(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._fila.get()
+            try:
+                await processar(job_id)
+            except Exception:
+                logger.exception("Falha ao processar job de mídia %s", job_id)
+            finally:
+                self._fila.task_done()
+
+
+fila = MediaJobQueue()
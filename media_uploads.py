@@ -0,0 +1,105 @@
+# media_uploads.py
+# Upload de mídia fora do event loop.
+#
+# O SDK do Cloudinary é síncrono: cada upload roda num ThreadPoolExecutor
+# limitado (UPLOAD_MAX_WORKERS) e os arquivos de uma mesma requisição sobem em
+# paralelo. MEDIA_UPLOADER=fake troca o Cloudinary por um uploader local, usado
+# em testes e benchmarks.
+import asyncio
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+UPLOAD_MAX_WORKERS = int(os.getenv("UPLOAD_MAX_WORKERS", "8"))
+# Vídeos sobem pelo upload em partes do Cloudinary (o upload simples recusa
+# arquivos acima de ~100 MB); tamanho de cada parte enviada
+CLOUDINARY_CHUNK = 20 * 1024 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS, thread_name_prefix="upload")
+
+
+# === UPLOADERS ===
+class CloudinaryUploader:
+    def __init__(self):
+        import cloudinary_config
+
+        cloudinary_config.configurar()
+
+    def upload(self, arquivo, folder: str = "usuarios", resource_type: str = "auto") -> dict:
+        import cloudinary.uploader
+
+        if resource_type == "video":
+            result = cloudinary.uploader.upload_large(
+                arquivo, folder=folder, resource_type=resource_type, chunk_size=CLOUDINARY_CHUNK
+            )
+        else:
+            result = cloudinary.uploader.upload(arquivo, folder=folder, resource_type=resource_type)
+        return {"url": result["secure_url"], "public_id": result["public_id"]}
+
+    def destroy(self, public_id: str, resource_type: str = "image") -> None:
+        import cloudinary.uploader
+
+        cloudinary.uploader.destroy(public_id, resource_type=resource_type)
+
+
+class FakeUploader:
+    """Grava os arquivos numa pasta local, com latência simulada por upload."""
+
+    def __init__(self, pasta: str = None, latencia: float = None):
+        self.pasta = pasta or os.getenv("FAKE_UPLOAD_DIR", "/tmp/deumatch_uploads")
+        if latencia is None:
+            latencia = int(os.getenv("FAKE_UPLOAD_LATENCIA_MS", "0")) / 1000
+        self.latencia = latencia
+
+    def upload(self, arquivo, folder: str = "usuarios", resource_type: str = "auto") -> dict:
+        time.sleep(self.latencia)
+        public_id = f"{folder}/{uuid.uuid4().hex}"
+        destino = os.path.join(self.pasta, public_id)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        if isinstance(arquivo, str):
+            shutil.copyfile(arquivo, destino)
+        else:
+            with open(destino, "wb") as saida:
+                shutil.copyfileobj(arquivo, saida)
+        return {"url": f"file://{destino}", "public_id": public_id}
+
+    def destroy(self, public_id: str, resource_type: str = "image") -> None:
+        try:
+            os.remove(os.path.join(self.pasta, public_id))
+        except FileNotFoundError:
+            pass
+
+
+_uploader = None
+_uploader_lock = threading.Lock()
+
+
+def get_uploader():
+    global _uploader
+    if _uploader is None:
+        with _uploader_lock:
+            if _uploader is None:
+                tipo = os.getenv("MEDIA_UPLOADER", "cloudinary")
+                if tipo == "fake":
+                    _uploader = FakeUploader()
+                elif tipo == "cloudinary":
+                    _uploader = CloudinaryUploader()
+                else:
+                    raise EnvironmentError(f"MEDIA_UPLOADER inválido: {tipo}")
+    return _uploader
+
+
+def set_uploader(uploader) -> None:
+    """Troca o uploader do processo (testes e benchmarks)."""
+    global _uploader
+    _uploader = uploader
+
+
+# === UPLOAD ASSÍNCRONO ===
+async def upload_async(arquivo, folder: str = "usuarios", resource_type: str = "auto") -> dict:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, get_uploader().upload, arquivo, folder, resource_type)
+
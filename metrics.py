@@ -0,0 +1,220 @@
+# metrics.py
+# Métricas por rota no formato de texto do Prometheus (servidas em /metrics).
+#
+# O MetricsMiddleware mede a latência por rota (histograma), conta
+# requisições por status e mantém as requisições em andamento. Os eventos do
+# SQLAlchemy (todas as engines, síncronas e assíncronas) contam queries e
+# tempo de banco da requisição atual através de um ContextVar. Requisições mais
+# lentas que SLOW_REQUEST_MS vão para o log com as queries mais lentas e as
+# repetidas (sinal de N+1). Outros módulos expõem valores próprios com
+# registrar_coletor.
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+# Quantas queries guardar por requisição para o log de lentas
+MAX_QUERIES_REGISTRADAS = 200
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_QUERIES = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.contagens = [0] * len(buckets)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float) -> None:
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+        self.soma += valor
+        self.total += 1
+
+    def linhas(self, nome: str, rotulos: str) -> List[str]:
+        saida, acumulado = [], 0
+        for limite, contagem in zip(self.buckets, self.contagens):
+            acumulado += contagem
+            saida.append(f'{nome}_bucket{{{rotulos},le="{limite}"}} {acumulado}')
+        saida.append(f'{nome}_bucket{{{rotulos},le="+Inf"}} {self.total}')
+        saida.append(f"{nome}_sum{{{rotulos}}} {self.soma:.6f}")
+        saida.append(f"{nome}_count{{{rotulos}}} {self.total}")
+        return saida
+
+
+# === ESTADO DA REQUISIÇÃO ATUAL ===
+class EstadoRequisicao:
+    __slots__ = ("queries", "tempo_db", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.tempo_db = 0.0
+        self.statements: List[Tuple[str, float]] = []
+
+
+_requisicao: ContextVar[Optional[EstadoRequisicao]] = ContextVar("metricas_requisicao", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metricas_inicio", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _depois_query(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("metricas_inicio")
+    if not inicios:
+        return
+    duracao = time.perf_counter() - inicios.pop()
+    estado = _requisicao.get()
+    if estado is None:
+        return  # fora de requisição (workers de segundo plano)
+    estado.queries += 1
+    estado.tempo_db += duracao
+    if len(estado.statements) < MAX_QUERIES_REGISTRADAS:
+        estado.statements.append((statement, duracao))
+
+
+# === REGISTRO ===
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requisicoes: Dict[Tuple[str, str, str], int] = {}
+        self.latencia: Dict[Tuple[str, str], Histograma] = {}
+        self.queries: Dict[Tuple[str, str], Histograma] = {}
+        self.tempo_db: Dict[Tuple[str, str], float] = {}
+        self.em_andamento: Dict[str, int] = {}   # por método
+        self.coletores: List[Callable[[], List[str]]] = []
+
+    def iniciar(self, metodo: str) -> None:
+        with self._lock:
+            self.em_andamento[metodo] = self.em_andamento.get(metodo, 0) + 1
+
+    def finalizar(self, chave: Tuple[str, str], status: int, duracao: float, estado: EstadoRequisicao) -> None:
+        with self._lock:
+            self.em_andamento[chave[0]] -= 1
+            chave_status = (*chave, str(status))
+            self.requisicoes[chave_status] = self.requisicoes.get(chave_status, 0) + 1
+            self.latencia.setdefault(chave, Histograma(BUCKETS_LATENCIA)).observar(duracao)
+            self.queries.setdefault(chave, Histograma(BUCKETS_QUERIES)).observar(estado.queries)
+            self.tempo_db[chave] = self.tempo_db.get(chave, 0.0) + estado.tempo_db
+
+    def renderizar(self) -> str:
+        with self._lock:
+            linhas = [
+                "# HELP deumatch_http_requests_total Requisições HTTP por rota e status.",
+                "# TYPE deumatch_http_requests_total counter",
+            ]
+            for (metodo, rota, status), total in sorted(self.requisicoes.items()):
+                linhas.append(
+                    f'deumatch_http_requests_total{{method="{metodo}",route="{rota}",status="{status}"}} {total}'
+                )
+            linhas += [
+                "# HELP deumatch_http_requests_in_flight Requisições em andamento.",
+                "# TYPE deumatch_http_requests_in_flight gauge",
+            ]
+            for metodo, total in sorted(self.em_andamento.items()):
+                linhas.append(f'deumatch_http_requests_in_flight{{method="{metodo}"}} {total}')
+            linhas += [
+                "# HELP deumatch_http_request_duration_seconds Latência das requisições por rota.",
+                "# TYPE deumatch_http_request_duration_seconds histogram",
+            ]
+            for (metodo, rota), hist in sorted(self.latencia.items()):
+                linhas += hist.linhas("deumatch_http_request_duration_seconds", f'method="{metodo}",route="{rota}"')
+            linhas += [
+                "# HELP deumatch_db_queries_per_request Queries SQL por requisição.",
+                "# TYPE deumatch_db_queries_per_request histogram",
+            ]
+            for (metodo, rota), hist in sorted(self.queries.items()):
+                linhas += hist.linhas("deumatch_db_queries_per_request", f'method="{metodo}",route="{rota}"')
+            linhas += [
+                "# HELP deumatch_db_duration_seconds_total Tempo gasto no banco por rota.",
+                "# TYPE deumatch_db_duration_seconds_total counter",
+            ]
+            for (metodo, rota), total in sorted(self.tempo_db.items()):
+                linhas.append(f'deumatch_db_duration_seconds_total{{method="{metodo}",route="{rota}"}} {total:.6f}')
+            coletores = list(self.coletores)
+        for coletor in coletores:
+            try:
+                linhas += coletor()
+            except Exception:
+                logger.exception("Falha no coletor de métricas %s", coletor)
+        return "\n".join(linhas) + "\n"
+
+
+registro = Registro()
+
+
+def registrar_coletor(func: Callable[[], List[str]]):
+    """Registra uma função que devolve linhas extras no formato do Prometheus."""
+    registro.coletores.append(func)
+    return func
+
+
+# === LOG DE REQUISIÇÕES LENTAS ===
+def _log_lenta(metodo: str, rota: str, status: int, duracao: float, estado: EstadoRequisicao) -> None:
+    repetidas: Dict[str, int] = {}
+    for statement, _ in estado.statements:
+        repetidas[statement] = repetidas.get(statement, 0) + 1
+    mais_lentas = sorted(estado.statements, key=lambda s: s[1], reverse=True)[:5]
+    detalhes = [f"  {d * 1000:.1f} ms  {' '.join(s.split())[:500]}" for s, d in mais_lentas]
+    detalhes += [
+        f"  repetida {n}x  {' '.join(s.split())[:500]}"
+        for s, n in sorted(repetidas.items(), key=lambda r: -r[1]) if n > 1
+    ][:3]
+    logger.warning(
+        "Requisição lenta: %s %s -> %s em %.1f ms (%s queries, %.1f ms no banco)\n%s",
+        metodo, rota, status, duracao * 1000, estado.queries, estado.tempo_db * 1000, "\n".join(detalhes),
+    )
+
+
+# === MIDDLEWARE ===
+class MetricsMiddleware:
+    """ASGI puro: mede até o fim do corpo, inclusive em respostas em streaming."""
+
+    def __init__(self, app, ignorar=("/metrics",)):
+        self.app = app
+        self.ignorar = set(ignorar)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.ignorar:
+            await self.app(scope, receive, send)
+            return
+
+        metodo = scope["method"]
+        estado = EstadoRequisicao()
+        token = _requisicao.set(estado)
+        status = 500
+        registro.iniciar(metodo)
+        inicio = time.perf_counter()
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracao = time.perf_counter() - inicio
+            _requisicao.reset(token)
+            # O roteador grava a rota no scope: usa o caminho declarado
+            # (/users/{user_id}) e não o recebido, para manter poucas séries
+            rota = scope.get("route")
+            chave = (metodo, getattr(rota, "path", "desconhecida"))
+            registro.finalizar(chave, status, duracao, estado)
+            if duracao * 1000 >= SLOW_REQUEST_MS:
+                _log_lenta(*chave, status, duracao, estado)
@@ -0,0 +1,51 @@
+# midias.py
+# Escrita na tabela user_media.
+#
+# Incluir ou remover uma mídia é um INSERT/DELETE pontual: edições simultâneas
+# do mesmo perfil não se sobrescrevem como acontecia com as listas separadas
+# por vírgula.
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import delete, func, insert, select, update
+
+from models import User, UserMedia
+
+
+def public_id_da_url(url: str, folder: str = "usuarios") -> str:
+    """public_id do Cloudinary a partir da URL (mídias antigas não o guardavam)."""
+    nome = url.split('/')[-1].split('.')[0]
+    return f"{folder}/{nome}"
+
+
+def adicionar_midias(user_id: int, tipo: str, enviados: List[dict]):
+    """INSERT único das mídias no fim da lista do tipo."""
+    linhas = []
+    for i, enviado in enumerate(enviados):
+        proxima = (
+            select(func.coalesce(func.max(UserMedia.posicao), -1) + 1 + i)
+            .where(UserMedia.user_id == user_id, UserMedia.tipo == tipo)
+            .scalar_subquery()
+        )
+        linhas.append({
+            "user_id": user_id,
+            "tipo": tipo,
+            "posicao": proxima,
+            "url": enviado["url"],
+            "public_id": enviado.get("public_id"),
+            "criado_em": datetime.utcnow(),
+        })
+    return insert(UserMedia).values(linhas)
+
+
+def remover_midia(user_id: int, tipo: str, url: str):
+    return delete(UserMedia).where(
+        UserMedia.user_id == user_id,
+        UserMedia.tipo == tipo,
+        UserMedia.url == url,
+    )
+
+
+def marcar_perfil_alterado(user_id: int):
+    """Mídia mudou: avança atualizado_em para invalidar o ETag do feed."""
+    return update(User).where(User.id == user_id).values(atualizado_em=datetime.utcnow())
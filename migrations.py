@@ -0,0 +1,324 @@
+# migrations.py
+# Migrações versionadas do schema.
+#
+# create_all só cria tabelas que ainda não existem; colunas e índices novos em
+# tabelas já existentes (e o preenchimento dos dados antigos) ficam aqui. Cada
+# passo roda uma única vez e fica registrado na tabela schema_version.
+#
+# Roda uma vez por deploy, antes de subir a API:  python migrations.py
+# (AUTO_MIGRATE=true faz a API aplicar as pendentes ao iniciar.)
+from datetime import datetime
+
+from sqlalchemy import func, inspect, insert, select, text
+
+from database import Base
+from models import ConversaResumo, Message, User, UserMedia, A_REPASSAR, TIMESTAMP_LISTAGEM
+from conversas import linhas_resumo
+from midias import public_id_da_url
+import rollups
+import arquivo_mensagens
+
+MIGRACOES = []
+
+
+def migracao(versao: int, descricao: str):
+    def registrar(func):
+        MIGRACOES.append((versao, descricao, func))
+        return func
+    return registrar
+
+
+def _colunas(conn, tabela):
+    return {c["name"] for c in inspect(conn).get_columns(tabela)}
+
+
+# === MIGRAÇÕES ===
+
+@migracao(1, "messages.conversa (chave canônica do par) + índice (conversa, id)")
+def _conversa_messages(conn):
+    if "conversa" not in _colunas(conn, "messages"):
+        conn.execute(text("ALTER TABLE messages ADD COLUMN conversa VARCHAR(41)"))
+    conn.execute(text("""
+        UPDATE messages SET conversa = CASE
+            WHEN sender_id < receiver_id
+                THEN CAST(sender_id AS VARCHAR) || ':' || CAST(receiver_id AS VARCHAR)
+            ELSE CAST(receiver_id AS VARCHAR) || ':' || CAST(sender_id AS VARCHAR)
+        END
+        WHERE conversa IS NULL
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_conversa_id ON messages (conversa, id)"))
+
+
+@migracao(2, "conversas_resumo preenchida a partir do histórico de mensagens")
+def _resumo_conversas(conn):
+    if conn.execute(select(func.count()).select_from(ConversaResumo.__table__)).scalar():
+        return
+    resultado = conn.execution_options(yield_per=5000).execute(
+        select(Message.id, Message.sender_id, Message.receiver_id, Message.content, Message.timestamp)
+        .order_by(Message.id)
+    )
+    linhas = linhas_resumo(r._mapping for r in resultado)
+    if not linhas:
+        return
+    nomes = dict(conn.execute(select(User.id, User.name)).all())
+    for linha in linhas:
+        linha["contraparte_nome"] = nomes.get(linha["contraparte_id"])
+        linha["nao_lidas"] = 0  # histórico antigo conta como lido
+    for i in range(0, len(linhas), 1000):
+        conn.execute(insert(ConversaResumo.__table__), linhas[i:i + 1000])
+
+
+@migracao(3, "user_media preenchida a partir de foto1/foto2/galeria/video")
+def _midias_usuarios(conn):
+    usuarios = User.__table__
+    ja_migrados = select(UserMedia.user_id).distinct()
+    resultado = conn.execute(
+        select(usuarios.c.id, usuarios.c.foto1, usuarios.c.foto2, usuarios.c.galeria, usuarios.c.video)
+        .where(usuarios.c.id.not_in(ja_migrados))
+    ).all()
+    linhas = []
+    agora = datetime.utcnow()
+    for user_id, foto1, foto2, galeria, video in resultado:
+        fotos = [foto1, foto2] + (galeria.split(',') if galeria else [])
+        videos = video.split(',') if video else []
+        for tipo, urls in (("foto", fotos), ("video", videos)):
+            for posicao, url in enumerate(u for u in urls if u):
+                linhas.append({
+                    "user_id": user_id,
+                    "tipo": tipo,
+                    "posicao": posicao,
+                    "url": url,
+                    "public_id": public_id_da_url(url),
+                    "criado_em": agora,
+                })
+    for i in range(0, len(linhas), 1000):
+        conn.execute(insert(UserMedia.__table__), linhas[i:i + 1000])
+
+
+@migracao(4, "movimentos: índice de consulta e unicidade do pedido aguardando")
+def _indices_movimentos(conn):
+    # Duplicados antigos impediriam o índice único: mantém o pedido mais antigo
+    conn.execute(text("""
+        UPDATE movimentos SET status = 'cancelado'
+        WHERE status = 'aguardando' AND id NOT IN (
+            SELECT MIN(id) FROM movimentos WHERE status = 'aguardando'
+            GROUP BY cliente_id, participante_id, tipo
+        )
+    """))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_movimentos_cliente_participante "
+        "ON movimentos (cliente_id, participante_id, tipo, status)"
+    ))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_movimentos_aguardando "
+        "ON movimentos (cliente_id, participante_id, tipo) WHERE status = 'aguardando'"
+    ))
+
+
+@migracao(5, "movimentos: índices da listagem paginada do admin")
+def _indices_listagem_movimentos(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_movimentos_timestamp_id ON movimentos (timestamp, id)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_movimentos_participante_timestamp "
+        "ON movimentos (participante_id, timestamp, id)"
+    ))
+
+
+@migracao(6, "movimentos: índice parcial das liberações ativas por expiração")
+def _indice_expiracao(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_movimentos_liberado_expiracao "
+        "ON movimentos (expiracao) WHERE status = 'liberado'"
+    ))
+
+
+@migracao(7, "usuarios.atualizado_em + índices do feed")
+def _feed_usuarios(conn):
+    if "atualizado_em" not in _colunas(conn, "usuarios"):
+        conn.execute(text("ALTER TABLE usuarios ADD COLUMN atualizado_em TIMESTAMP"))
+        conn.execute(text("UPDATE usuarios SET atualizado_em = :agora"), {"agora": datetime.utcnow()})
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_usuarios_role_id ON usuarios (role, id)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_valor_acompanhante ON usuarios (valor_acompanhante)"
+    ))
+
+
+@migracao(8, "usuarios: índices de busca textual (tsvector + trigramas) no PostgreSQL")
+def _indices_busca(conn):
+    # Em outros bancos a busca usa o índice invertido em memória (search.py)
+    if conn.dialect.name != "postgresql":
+        return
+    from search import DOCUMENTO_PG
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_usuarios_busca ON usuarios USING GIN ({DOCUMENTO_PG})"))
+    # pg_trgm pode não estar disponível para o usuário do banco; sem ela a busca
+    # continua funcionando, só sem tolerância a erros de digitação
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_usuarios_nome_trgm ON usuarios USING GIN (name gin_trgm_ops)"
+            ))
+    except Exception:
+        pass
+
+
+@migracao(9, "movimentos.repasse_lote + índices do repasse em lote; saldo recalculado")
+def _repasses(conn):
+    if "repasse_lote" not in _colunas(conn, "movimentos"):
+        conn.execute(text("ALTER TABLE movimentos ADD COLUMN repasse_lote VARCHAR(32)"))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_movimentos_a_repassar ON movimentos (participante_id, id) WHERE {A_REPASSAR}"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_movimentos_repasse_lote ON movimentos (repasse_lote)"))
+    # saldo nunca foi mantido: passa a ser o total pago e ainda não repassado
+    conn.execute(text(f"""
+        UPDATE usuarios SET saldo = COALESCE((
+            SELECT SUM(valor) FROM movimentos
+            WHERE movimentos.participante_id = usuarios.id AND {A_REPASSAR}
+        ), 0)
+        WHERE role = 'participante'
+    """))
+
+
+@migracao(10, "movimentos.liberado_em + contadores diários do painel (movimentos_diario)")
+def _movimentos_diario(conn):
+    if "liberado_em" not in _colunas(conn, "movimentos"):
+        conn.execute(text("ALTER TABLE movimentos ADD COLUMN liberado_em TIMESTAMP"))
+    # Liberações antigas: a expiração sempre foi a liberação + 1 hora
+    if conn.dialect.name == "postgresql":
+        uma_hora_antes = "expiracao - INTERVAL '1 hour'"
+    else:
+        uma_hora_antes = "datetime(expiracao, '-1 hour')"
+    conn.execute(text(f"""
+        UPDATE movimentos SET liberado_em = {uma_hora_antes}
+        WHERE liberado_em IS NULL AND expiracao IS NOT NULL AND status IN ('liberado', 'expirado')
+    """))
+    rollups.reconstruir(conn)
+
+
+@migracao(11, "messages particionada por mês (só PostgreSQL)")
+def _particionar_mensagens(conn):
+    if conn.dialect.name != "postgresql" or arquivo_mensagens.particionada(conn):
+        return
+    # A chave primária de uma tabela particionada precisa conter a coluna de
+    # partição: vira (id, timestamp). A sequência dos ids continua a mesma.
+    conn.execute(text("ALTER TABLE messages RENAME TO messages_legado"))
+    for indice in ("messages_pkey", "ix_messages_id", "ix_messages_conversa_id"):
+        conn.execute(text(f"ALTER INDEX IF EXISTS {indice} RENAME TO {indice.replace('messages', 'messages_legado')}"))
+    conn.execute(text("""
+        CREATE TABLE messages (
+            id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+            sender_id INTEGER NOT NULL,
+            receiver_id INTEGER NOT NULL,
+            content VARCHAR NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            conversa VARCHAR(41) NOT NULL,
+            CONSTRAINT messages_pkey PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """))
+    conn.execute(text("CREATE INDEX ix_messages_id ON messages (id)"))
+    conn.execute(text("CREATE INDEX ix_messages_conversa_id ON messages (conversa, id)"))
+    mais_velha = conn.execute(text("SELECT MIN(timestamp) FROM messages_legado")).scalar()
+    arquivo_mensagens.garantir_particoes(conn, desde=mais_velha)
+    conn.execute(text("""
+        INSERT INTO messages (id, sender_id, receiver_id, content, timestamp, conversa)
+        SELECT id, sender_id, receiver_id, content, COALESCE(timestamp, now() AT TIME ZONE 'utc'), conversa
+        FROM messages_legado
+    """))
+    conn.execute(text("ALTER SEQUENCE messages_id_seq OWNED BY messages.id"))
+    conn.execute(text("DROP TABLE messages_legado"))
+
+
+@migracao(12, "usuarios: busca textual sem acentos (unaccent) no PostgreSQL")
+def _busca_sem_acento(conn):
+    if conn.dialect.name != "postgresql":
+        return
+    from search import DOCUMENTO_PG_SEM_ACENTO
+    # unaccent() não é IMMUTABLE e não entra em índice: o wrapper fixa o dicionário.
+    # Sem a extensão, a busca segue com o índice da migração 8 e termos com acento.
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+            esquema = conn.execute(text(
+                "SELECT n.nspname FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace "
+                "WHERE e.extname = 'unaccent'"
+            )).scalar()
+            conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+                $$ SELECT {esquema}.unaccent('{esquema}.unaccent'::regdictionary, $1) $$
+                LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+            """))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_usuarios_busca_sem_acento ON usuarios USING GIN ({DOCUMENTO_PG_SEM_ACENTO})"
+            ))
+            conn.execute(text("DROP INDEX IF EXISTS ix_usuarios_busca"))
+    except Exception:
+        pass
+
+
+@migracao(13, "idempotency_keys.em_andamento_ate (prazo da reserva em andamento)")
+def _reserva_idempotencia(conn):
+    if "em_andamento_ate" not in _colunas(conn, "idempotency_keys"):
+        conn.execute(text("ALTER TABLE idempotency_keys ADD COLUMN em_andamento_ate TIMESTAMP"))
+
+
+@migracao(14, "media_jobs.instancia (só a instância que tem o spool retoma o job)")
+def _instancia_media_jobs(conn):
+    if "instancia" not in _colunas(conn, "media_jobs"):
+        conn.execute(text("ALTER TABLE media_jobs ADD COLUMN instancia VARCHAR(100)"))
+
+
+@migracao(15, "movimentos: índices da listagem do admin com timestamp nulo")
+def _indices_listagem_sem_timestamp(conn):
+    # A listagem ordena por TIMESTAMP_LISTAGEM; os índices precisam da mesma expressão
+    conn.execute(text("DROP INDEX IF EXISTS ix_movimentos_timestamp_id"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_movimentos_participante_timestamp"))
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_movimentos_listagem ON movimentos (({TIMESTAMP_LISTAGEM}), id)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_movimentos_participante_listagem "
+        f"ON movimentos (participante_id, ({TIMESTAMP_LISTAGEM}), id)"
+    ))
+
+
+# === EXECUÇÃO ===
+
+def upgrade(engine):
+    """Cria as tabelas novas e aplica as migrações pendentes, em ordem."""
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Vários workers sobem juntos: só um aplica as migrações por vez
+            conn.execute(text("SELECT pg_advisory_xact_lock(724001)"))
+        Base.metadata.create_all(bind=conn)
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "versao INTEGER PRIMARY KEY, descricao VARCHAR(200), aplicada_em TIMESTAMP)"
+        ))
+        aplicadas = {row[0] for row in conn.execute(text("SELECT versao FROM schema_version"))}
+        for versao, descricao, func in sorted(MIGRACOES, key=lambda m: m[0]):
+            if versao in aplicadas:
+                continue
+            func(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (versao, descricao, aplicada_em) VALUES (:v, :d, :t)"),
+                {"v": versao, "d": descricao, "t": datetime.utcnow()},
+            )
+        # A cada deploy: partições dos próximos meses de messages (e a DEFAULT)
+        arquivo_mensagens.garantir_particoes(conn)
+
+
+def pendentes(engine) -> list:
+    """Versões ainda não aplicadas (uma consulta só; usada na subida da API)."""
+    with engine.connect() as conn:
+        try:
+            aplicadas = {row[0] for row in conn.execute(text("SELECT versao FROM schema_version"))}
+        except Exception:
+            return sorted(m[0] for m in MIGRACOES)
+    return sorted(m[0] for m in MIGRACOES if m[0] not in aplicadas)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    faltando = pendentes(engine)
+    upgrade(engine)
+    print(f"Migrações aplicadas: {faltando}" if faltando else "Schema já está atualizado.")
@@ -1,12 +1,26 @@
-from sqlalchemy import Column, String, Text, BigInteger, Integer, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, String, Text, BigInteger, Integer, Date, DateTime, Boolean, Float, LargeBinary, ForeignKey, Index, UniqueConstraint, text
+from sqlalchemy.orm import deferred, relationship
 from database import Base
 from datetime import datetime
 
+
+# Chave canônica da conversa entre dois usuários ("menor:maior")
+def chave_conversa(user_a: int, user_b: int) -> str:
+    a, b = sorted((int(user_a), int(user_b)))
+    return f"{a}:{b}"
+
+
+def _conversa_default(context):
+    params = context.get_current_parameters()
+    return chave_conversa(params["sender_id"], params["receiver_id"])
+
+
 # Tabela de usuários
 class User(Base):
     __tablename__ = "usuarios"
 
-    id = Column(BigInteger, primary_key=True, index=True, autoincrement=True)
+    # BIGINT no PostgreSQL; INTEGER no SQLite para o autoincremento funcionar localmente
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True, autoincrement=True)
     name = Column(String(100), nullable=False)
     email = Column(String(100), unique=True, index=True, nullable=False)
     senha = Column(String(100), nullable=False)
@@ -14,10 +28,11 @@ class User(Base):
     bio = Column(Text, nullable=True)
     status = Column(String(50), nullable=True)
     whatsapp = Column(String(20), nullable=True)
-    foto1 = Column(String, nullable=True)
-    foto2 = Column(String, nullable=True)
-    galeria = Column(Text, nullable=True)
-    video = Column(Text, nullable=True)
+    # Colunas antigas (URLs separadas por vírgula); só lidas pela migração para user_media
+    foto1_legado = deferred(Column("foto1", String, nullable=True))
+    foto2_legado = deferred(Column("foto2", String, nullable=True))
+    galeria_legado = deferred(Column("galeria", Text, nullable=True))
+    video_legado = deferred(Column("video", Text, nullable=True))
     exclusao_pendente = Column(Boolean, default=False)
     maior_idade = Column(Boolean, default=False)
 
@@ -26,12 +41,78 @@ class User(Base):
     forma_recebimento = Column(String(50), nullable=True)     # Participantes
     chave_pix = Column(String(100), nullable=True)            # Participantes
     tipo_chave_pix = Column(String(50), nullable=True)        # CPF, celular, etc.
-    saldo = Column(Integer, default=0)                        # Em centavos
+    saldo = Column(Integer, default=0)                        # Em centavos, pago e ainda não repassado
     valor_acompanhante = Column(Integer, default=0)           # Valor fixo do serviço (centavos)
 
     # Termos de uso
     aceitou_termos = Column(Boolean, default=False)
 
+    # Última alteração do perfil (ETag do feed); mídias atualizam explicitamente
+    atualizado_em = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Feed paginado por id com filtros de perfil e preço
+        Index("ix_usuarios_role_id", "role", "id"),
+        Index("ix_usuarios_valor_acompanhante", "valor_acompanhante"),
+    )
+
+    # Mídias do perfil; "selectin" carrega as de uma lista inteira de usuários numa query só
+    midias = relationship(
+        "UserMedia",
+        order_by="(UserMedia.posicao, UserMedia.id)",
+        lazy="selectin",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    # Formato exposto pela API: duas fotos de capa + galeria e vídeos
+    @property
+    def fotos(self):
+        return [m.url for m in self.midias if m.tipo == "foto"]
+
+    @property
+    def videos(self):
+        return [m.url for m in self.midias if m.tipo == "video"]
+
+    @property
+    def foto1(self):
+        fotos = self.fotos
+        return fotos[0] if len(fotos) > 0 else None
+
+    @property
+    def foto2(self):
+        fotos = self.fotos
+        return fotos[1] if len(fotos) > 1 else None
+
+    @property
+    def galeria(self):
+        return self.fotos[2:]
+
+    @property
+    def video(self):
+        return ",".join(self.videos) or None
+
+
+# Mídias do usuário (uma linha por foto/vídeo)
+class UserMedia(Base):
+    __tablename__ = "user_media"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        ForeignKey("usuarios.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    tipo = Column(String(10), nullable=False)                 # foto ou video
+    posicao = Column(Integer, nullable=False, default=0)      # ordem de exibição dentro do tipo
+    url = Column(String, nullable=False)
+    public_id = Column(String, nullable=True)                 # id no Cloudinary (para excluir)
+    criado_em = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_user_media_user_tipo_pos", "user_id", "tipo", "posicao"),
+    )
+
 
 # Tabela de mensagens do chat
 class Message(Base):
@@ -42,6 +123,84 @@ class Message(Base):
     receiver_id = Column(Integer, nullable=False)
     content = Column(String, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    conversa = Column(String(41), nullable=False, default=_conversa_default)
+
+    __table_args__ = (
+        # Paginação por cursor: WHERE conversa = ? AND id < ? ORDER BY id DESC LIMIT n
+        Index("ix_messages_conversa_id", "conversa", "id"),
+    )
+
+
+# Mensagens antigas, fora da tabela quente (ver arquivo_mensagens.py): cada linha
+# é um bloco comprimido de mensagens consecutivas de uma conversa
+class MensagemArquivo(Base):
+    __tablename__ = "messages_arquivo"
+
+    id = Column(Integer, primary_key=True, index=True)
+    conversa = Column(String(41), nullable=False)
+    primeiro_id = Column(Integer, nullable=False)             # menor id de mensagem do bloco
+    ultimo_id = Column(Integer, nullable=False)               # maior id de mensagem do bloco
+    quantidade = Column(Integer, nullable=False)
+    inicio = Column(DateTime, nullable=False)
+    fim = Column(DateTime, nullable=False)
+    dados = Column(LargeBinary, nullable=False)               # JSON das mensagens, comprimido (zlib)
+
+    __table_args__ = (
+        # Rolagem para trás: blocos da conversa com ultimo_id < cursor, do mais novo ao mais velho
+        Index("ix_messages_arquivo_conversa_ultimo", "conversa", "ultimo_id"),
+    )
+
+
+# Resumo das conversas de cada usuário (caixa de entrada), mantido a cada mensagem
+class ConversaResumo(Base):
+    __tablename__ = "conversas_resumo"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)                 # dono da caixa de entrada
+    contraparte_id = Column(Integer, nullable=False)
+    contraparte_nome = Column(String(100), nullable=True)
+    ultima_mensagem_id = Column(Integer, nullable=True)
+    ultima_mensagem = Column(String, nullable=True)
+    ultimo_remetente_id = Column(Integer, nullable=True)
+    ultimo_timestamp = Column(DateTime, nullable=True)
+    nao_lidas = Column(Integer, default=0, nullable=False)
+    recebeu = Column(Boolean, default=False, nullable=False)  # já recebeu mensagem da contraparte
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "contraparte_id", name="uq_conversas_resumo_par"),
+        Index("ix_conversas_resumo_user_ts", "user_id", "ultimo_timestamp"),
+    )
+
+
+# Fila de processamento de mídia (uploads em segundo plano)
+class MediaJob(Base):
+    __tablename__ = "media_jobs"
+
+    id = Column(String(32), primary_key=True)                  # uuid4 hex
+    user_id = Column(Integer, nullable=False)
+    status = Column(String(20), default="pendente")            # pendente, processando, concluido, falhou
+    arquivos = Column(Text, nullable=False)                    # JSON: arquivos salvos no spool local
+    instancia = Column(String(100), nullable=True)             # instância dona do spool (media_jobs.INSTANCIA)
+    resultado = Column(Text, nullable=True)                    # JSON: enviados e erros por arquivo
+    criado_em = Column(DateTime, default=datetime.utcnow)
+    atualizado_em = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_media_jobs_status", "status", "criado_em"),
+    )
+
+
+# Movimentos já pagos pelo cliente (liberados, vigentes ou vencidos) que ainda
+# não foram repassados ao participante: entram no saldo e no próximo repasse
+STATUS_PAGOS = ("liberado", "expirado")
+A_REPASSAR = "repassado = false AND status IN ('liberado', 'expirado')"
+
+
+# Ordem da listagem do admin. Movimentos antigos podem não ter timestamp: entram
+# como de 1970 (no formato em que o SQLite grava DateTime), depois dos demais,
+# e o cursor continua avançando por eles
+TIMESTAMP_LISTAGEM = "coalesce(\"timestamp\", '1970-01-01 00:00:00.000000')"
+EPOCA_LISTAGEM = datetime(1970, 1, 1)
 
 
 # Tabela de movimentações financeiras
@@ -54,7 +213,145 @@ class Movimento(Base):
     tipo = Column(String(20), nullable=False)                 # fotos, videos, acompanhante
     valor = Column(Integer, nullable=False)                   # valor em centavos
     metodo = Column(String(20), nullable=False)               # "pix" ou "cartao"
-    status = Column(String(20), default="aguardando")         # aguardando ou liberado
+    status = Column(String(20), default="aguardando")         # aguardando, liberado ou expirado
     timestamp = Column(DateTime, default=datetime.utcnow)
     repassado = Column(Boolean, default=False)
     expiracao = Column(DateTime, nullable=True)               # hora de expiração do desbloqueio
+    repasse_lote = Column(String(32), nullable=True)          # lote do repasse que pagou este movimento
+    liberado_em = Column(DateTime, nullable=True)             # primeira liberação (pagamento confirmado)
+
+    __table_args__ = (
+        Index("ix_movimentos_cliente_participante", "cliente_id", "participante_id", "tipo", "status"),
+        # Listagem do admin: ORDER BY TIMESTAMP_LISTAGEM DESC, id DESC com cursor
+        Index("ix_movimentos_listagem", text(TIMESTAMP_LISTAGEM), "id"),
+        Index("ix_movimentos_participante_listagem", "participante_id", text(TIMESTAMP_LISTAGEM), "id"),
+        # Varredura de expiração: só as liberações ativas, em ordem de vencimento
+        Index(
+            "ix_movimentos_liberado_expiracao", "expiracao",
+            postgresql_where=text("status = 'liberado'"),
+            sqlite_where=text("status = 'liberado'"),
+        ),
+        # No máximo um pedido "aguardando" por cliente/participante/tipo (evita pedidos duplicados)
+        Index(
+            "uq_movimentos_aguardando", "cliente_id", "participante_id", "tipo",
+            unique=True,
+            postgresql_where=text("status = 'aguardando'"),
+            sqlite_where=text("status = 'aguardando'"),
+        ),
+        # Repasse em lote: só os movimentos pagos pelo cliente e ainda não repassados
+        Index(
+            "ix_movimentos_a_repassar", "participante_id", "id",
+            postgresql_where=text(A_REPASSAR),
+            sqlite_where=text(A_REPASSAR),
+        ),
+        Index("ix_movimentos_repasse_lote", "repasse_lote"),
+    )
+
+
+# Repasses feitos aos participantes (um registro por participante em cada lote)
+class Repasse(Base):
+    __tablename__ = "repasses"
+
+    id = Column(Integer, primary_key=True, index=True)
+    lote = Column(String(32), nullable=False)                 # uuid4 hex da execução
+    participante_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    valor_total = Column(Integer, nullable=False)             # soma dos movimentos, em centavos
+    quantidade = Column(Integer, nullable=False)              # movimentos incluídos
+    criado_em = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("lote", "participante_id", name="uq_repasses_lote_participante"),
+        Index("ix_repasses_participante_criado", "participante_id", "criado_em"),
+    )
+
+
+# Contadores diários dos movimentos por participante, tipo e método, mantidos
+# por upsert nas próprias transações (ver rollups.py) para o painel do admin
+class MovimentoDiario(Base):
+    __tablename__ = "movimentos_diario"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dia = Column(Date, nullable=False)
+    participante_id = Column(Integer, nullable=False)
+    tipo = Column(String(20), nullable=False)
+    metodo = Column(String(20), nullable=False)
+    pedidos = Column(Integer, default=0, nullable=False)              # pedidos criados no dia
+    pedidos_valor = Column(BigInteger, default=0, nullable=False)
+    liberados = Column(Integer, default=0, nullable=False)            # pagamentos confirmados no dia
+    liberados_valor = Column(BigInteger, default=0, nullable=False)   # receita, em centavos
+    repassados = Column(Integer, default=0, nullable=False)           # movimentos repassados no dia
+    repassados_valor = Column(BigInteger, default=0, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("dia", "participante_id", "tipo", "metodo", name="uq_movimentos_diario_chave"),
+        Index("ix_movimentos_diario_participante_dia", "participante_id", "dia"),
+    )
+
+
+# Respostas guardadas por Idempotency-Key (backend "database" de idempotency.py)
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    chave = Column(String(320), primary_key=True)             # escopo + ":" + Idempotency-Key
+    impressao = Column(String(64), nullable=False)            # sha256 do corpo da requisição
+    status_code = Column(Integer, nullable=True)               # nulo enquanto a requisição está em andamento
+    resposta = Column(Text, nullable=True)                    # JSON da resposta
+    criado_em = Column(DateTime, default=datetime.utcnow)
+    expira_em = Column(DateTime, nullable=False)
+    em_andamento_ate = Column(DateTime, nullable=True)        # reserva: depois disso outra tentativa assume
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_expira", "expira_em"),
+    )
+
+
+# Baldes do limite de requisições (backend "database" de rate_limit.py)
+class RateLimitBalde(Base):
+    __tablename__ = "rate_limit_baldes"
+
+    chave = Column(String(200), primary_key=True)             # regra + ":" + usuário ou IP
+    fichas = Column(Float, nullable=False)
+    atualizado_em = Column(Float, nullable=False)             # epoch em segundos (conta igual em todo banco)
+
+    __table_args__ = (
+        Index("ix_rate_limit_baldes_atualizado", "atualizado_em"),
+    )
+
+
+# Sessões de upload em partes (uploads_resumiveis.py)
+class UploadSessao(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(32), primary_key=True)                  # uuid4 hex; vira o id do MediaJob
+    user_id = Column(Integer, nullable=False)
+    nome = Column(String(255), nullable=False)
+    tipo = Column(String(10), nullable=False)                  # foto ou video
+    tamanho = Column(BigInteger, nullable=False)               # bytes do arquivo inteiro
+    tamanho_parte = Column(Integer, nullable=False)
+    total_partes = Column(Integer, nullable=False)
+    status = Column(String(20), default="aberta")              # aberta, concluida
+    criado_em = Column(DateTime, default=datetime.utcnow)
+    expira_em = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_upload_sessions_expira", "status", "expira_em"),
+    )
+
+
+# Partes já recebidas e conferidas de cada sessão
+class UploadParte(Base):
+    __tablename__ = "upload_chunks"
+
+    upload_id = Column(String(32), primary_key=True)
+    indice = Column(Integer, primary_key=True)
+    tamanho = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    recebido_em = Column(DateTime, default=datetime.utcnow)
+
+
+# Revogações de tokens (security.py), compartilhadas entre os processos
+class TokenRevogado(Base):
+    __tablename__ = "tokens_revogados"
+
+    user_id = Column(Integer, primary_key=True)
+    revogado_em = Column(Float, nullable=False)                # epoch; tokens emitidos até aqui são recusados
@@ -0,0 +1,34 @@
+# pagination.py
+# Cursores opacos para paginação por keyset.
+#
+# O cursor carrega os valores da chave de ordenação da última linha entregue
+# (ex.: timestamp e id); a próxima página continua a partir deles com um
+# WHERE indexado, sem OFFSET.
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+
+
+def codificar_cursor(*valores) -> str:
+    dados = [v.isoformat() if isinstance(v, datetime) else v for v in valores]
+    return base64.urlsafe_b64encode(json.dumps(dados).encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str, quantidade: int) -> list:
+    try:
+        preenchido = cursor + "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(preenchido.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    if not isinstance(valores, list) or len(valores) != quantidade:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    return valores
+
+
+def cursor_data(valor) -> datetime:
+    try:
+        return datetime.fromisoformat(valor)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
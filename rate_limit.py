@@ -0,0 +1,261 @@
+# rate_limit.py
+# Limite de requisições por usuário e rota (token bucket) e teto global de
+# uploads simultâneos, aplicados antes de a rota ler o corpo da requisição.
+#
+# Cada regra tem um balde por usuário (id do token; sem token, o IP): comporta
+# N requisições e reabastece N a cada S segundos (RATE_LIMIT_<REGRA>="N/S";
+# "0" desliga a regra). Sem ficha, a resposta é 429 com Retry-After. Nas rotas
+# de upload, além do balde, no máximo UPLOAD_MAX_CONCORRENTES requisições são
+# atendidas ao mesmo tempo neste processo; as excedentes recebem 503 com
+# Retry-After na hora, em vez de ocupar workers esperando.
+#
+# Backends dos baldes (RATE_LIMIT_BACKEND):
+#   memory    por processo (padrão). Com W workers o limite efetivo é até W vezes maior.
+#   database  tabela rate_limit_baldes, compartilhada (um upsert por requisição limitada).
+# Atrás de proxy, rode o uvicorn com --proxy-headers para o IP do cliente ser o real.
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import case, delete, select
+
+from database import SessionLocal, upsert_insert
+from models import RateLimitBalde
+from security import decodificar_token
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "sim")
+UPLOAD_MAX_CONCORRENTES = int(os.getenv("UPLOAD_MAX_CONCORRENTES", "8"))
+UPLOAD_RETRY_AFTER = int(os.getenv("UPLOAD_RETRY_AFTER", "2"))
+RATE_LIMIT_MAX_BALDES = 100000   # baldes em memória antes de descartar os já cheios
+
+
+def _limite(nome: str, padrao: str) -> Optional[Tuple[float, float]]:
+    """RATE_LIMIT_<NOME>="N/S" -> (capacidade N, fichas por segundo N/S); "0" desliga."""
+    valor = os.getenv(f"RATE_LIMIT_{nome.upper()}", padrao)
+    if valor in ("0", ""):
+        return None
+    quantidade, segundos = valor.split("/")
+    return float(quantidade), float(quantidade) / float(segundos)
+
+
+class Regra(NamedTuple):
+    nome: str
+    metodo: str
+    padrao: "re.Pattern"
+    path: str              # caminho declarado da rota (rótulo das métricas)
+    upload: bool = False
+
+
+REGRAS = [
+    Regra("mensagens", "POST", re.compile(r"^/messages/send$"), "/messages/send"),
+    Regra("movimentos", "POST", re.compile(r"^/movimentos$"), "/movimentos"),
+    Regra("uploads", "POST", re.compile(r"^/users/register$"), "/users/register", upload=True),
+    Regra("uploads", "PUT", re.compile(r"^/users/update/\d+$"), "/users/update/{user_id}", upload=True),
+    Regra("uploads", "POST", re.compile(r"^/uploads$"), "/uploads"),
+    # Partes do upload resumível: contam no teto de uploads simultâneos; balde próprio (desligado por padrão)
+    Regra("partes", "PUT", re.compile(r"^/uploads/[0-9a-f]{32}/partes/\d+$"), "/uploads/{upload_id}/partes/{indice}",
+          upload=True),
+]
+LIMITES = {
+    "mensagens": _limite("mensagens", "60/60"),
+    "movimentos": _limite("movimentos", "20/60"),
+    "uploads": _limite("uploads", "10/60"),
+    "partes": _limite("partes", "0"),
+}
+
+
+# === BALDES ===
+class RateLimitStore:
+    """consumir() tira uma ficha do balde: (permitido, segundos até haver ficha)."""
+
+    bloqueante = False
+
+    def consumir(self, chave: str, capacidade: float, taxa: float) -> Tuple[bool, float]:
+        raise NotImplementedError
+
+
+class InMemoryStore(RateLimitStore):
+    def __init__(self, max_baldes: int = RATE_LIMIT_MAX_BALDES):
+        self.max_baldes = max_baldes
+        # chave -> [fichas, atualizado_em, cheio_em]
+        self._baldes: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def consumir(self, chave, capacidade, taxa):
+        agora = time.monotonic()
+        with self._lock:
+            balde = self._baldes.get(chave)
+            fichas = capacidade if balde is None else min(capacidade, balde[0] + (agora - balde[1]) * taxa)
+            if fichas < 1:
+                return False, (1 - fichas) / taxa
+            fichas -= 1
+            if balde is None and len(self._baldes) >= self.max_baldes:
+                # Balde que já encheu de novo equivale a um balde novo: pode sair
+                self._baldes = {k: b for k, b in self._baldes.items() if b[2] > agora}
+            self._baldes[chave] = [fichas, agora, agora + (capacidade - fichas) / taxa]
+            return True, 0.0
+
+
+class DatabaseStore(RateLimitStore):
+    bloqueante = True
+    LIMPAR_A_CADA = 5000
+    # Baldes parados há mais que isso já encheram em qualquer regra
+    RETENCAO = 3600
+
+    def __init__(self):
+        self._consumos = 0
+
+    def consumir(self, chave, capacidade, taxa):
+        agora = time.time()
+        db = SessionLocal()
+        try:
+            self._consumos += 1
+            if self._consumos % self.LIMPAR_A_CADA == 0:
+                db.execute(delete(RateLimitBalde).where(RateLimitBalde.atualizado_em < agora - self.RETENCAO))
+            repostas = RateLimitBalde.fichas + (agora - RateLimitBalde.atualizado_em) * taxa
+            fichas = case((repostas > capacidade, capacidade), else_=repostas)
+            # Um statement: reabastece, consome e grava só se havia ficha
+            insert_ = upsert_insert(db.get_bind().dialect.name)
+            stmt = insert_(RateLimitBalde).values(chave=chave, fichas=capacidade - 1, atualizado_em=agora)
+            consumido = db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["chave"],
+                    set_={"fichas": fichas - 1, "atualizado_em": agora},
+                    where=fichas >= 1,
+                ).returning(RateLimitBalde.fichas)
+            ).first()
+            if consumido:
+                db.commit()
+                return True, 0.0
+            atual = db.execute(select(fichas).where(RateLimitBalde.chave == chave)).scalar() or 0
+            db.commit()
+            return False, (1 - atual) / taxa
+        finally:
+            db.close()
+
+
+_store: Optional[RateLimitStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> RateLimitStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                tipo = os.getenv("RATE_LIMIT_BACKEND", "memory")
+                if tipo == "memory":
+                    _store = InMemoryStore()
+                elif tipo == "database":
+                    _store = DatabaseStore()
+                else:
+                    raise EnvironmentError(f"RATE_LIMIT_BACKEND inválido: {tipo}")
+    return _store
+
+
+def set_store(store: RateLimitStore) -> None:
+    """Troca o backend do processo (testes)."""
+    global _store
+    _store = store
+
+
+# === CONTADORES (expostos em /metrics) ===
+stats = {
+    "permitidas": {},       # regra -> total
+    "limitadas": {},        # regra -> total de 429
+    "uploads_recusados": 0,  # 503 por falta de vaga
+    "uploads_em_andamento": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _contar(campo: str, regra: str) -> None:
+    with _stats_lock:
+        stats[campo][regra] = stats[campo].get(regra, 0) + 1
+
+
+# === MIDDLEWARE ===
+def _identidade(scope) -> str:
+    for nome, valor in scope.get("headers", []):
+        if nome == b"authorization":
+            esquema, _, token = valor.decode("latin-1").partition(" ")
+            if esquema.lower() == "bearer" and token:
+                try:
+                    return f"u{decodificar_token(token)['sub']}"
+                except HTTPException:
+                    break   # token inválido: a rota responde 401; aqui conta pelo IP
+    cliente = scope.get("client")
+    return f"ip{cliente[0] if cliente else '?'}"
+
+
+async def _recusar(send, status: int, detalhe: str, retry_after: float) -> None:
+    corpo = json.dumps({"detail": detalhe}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(corpo)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": corpo})
+
+
+class RateLimitMiddleware:
+    """ASGI puro: recusa antes de o corpo (e os arquivos) ser lido."""
+
+    def __init__(self, app, regras=REGRAS, limites=LIMITES, max_uploads: int = UPLOAD_MAX_CONCORRENTES):
+        self.app = app
+        self.regras = regras
+        self.limites = limites
+        self.max_uploads = max_uploads
+        self._uploads = 0   # só alterado dentro do event loop
+
+    async def __call__(self, scope, receive, send):
+        regra = None
+        if scope["type"] == "http" and RATE_LIMIT_ENABLED:
+            regra = next(
+                (r for r in self.regras if r.metodo == scope["method"] and r.padrao.match(scope["path"])), None
+            )
+        if regra is None:
+            await self.app(scope, receive, send)
+            return
+
+        limite = self.limites.get(regra.nome)
+        if limite:
+            store = get_store()
+            chave = f"{regra.nome}:{_identidade(scope)}"
+            if store.bloqueante:
+                permitido, espera = await asyncio.to_thread(store.consumir, chave, *limite)
+            else:
+                permitido, espera = store.consumir(chave, *limite)
+            if not permitido:
+                _contar("limitadas", regra.nome)
+                scope["route"] = regra   # rótulo da rota nas métricas por rota
+                await _recusar(send, 429, "Muitas requisições. Tente novamente em instantes.", espera)
+                return
+            _contar("permitidas", regra.nome)
+
+        if not regra.upload:
+            await self.app(scope, receive, send)
+            return
+
+        if self._uploads >= self.max_uploads:
+            stats["uploads_recusados"] += 1
+            scope["route"] = regra
+            await _recusar(send, 503, "Servidor ocupado com uploads. Tente novamente em instantes.", UPLOAD_RETRY_AFTER)
+            return
+        self._uploads += 1
+        stats["uploads_em_andamento"] = self._uploads
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._uploads -= 1
+            stats["uploads_em_andamento"] = self._uploads
@@ -0,0 +1,86 @@
+# repasses.py
+# Repasse em lote dos valores pagos aos participantes.
+#
+# Uma execução é uma transação com poucos statements, qualquer que seja o
+# número de movimentos: marca os elegíveis com o id do lote (travando as
+# linhas; no PostgreSQL com SKIP LOCKED, para execuções simultâneas não se
+# sobreporem), grava um Repasse por participante com INSERT ... SELECT
+# agregado, desconta os totais de User.saldo e soma nos contadores do painel
+# (rollups.py). O saldo é creditado quando o movimento é liberado (ver
+# routes/movimento.liberar_movimento).
+import os
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, String, func, insert, literal, select, update
+
+import rollups
+from models import Movimento, Repasse, User, STATUS_PAGOS
+
+REPASSE_MAX_MOVIMENTOS = int(os.getenv("REPASSE_MAX_MOVIMENTOS", "100000"))
+
+
+def creditar_saldo(participante_id: int, valor: int):
+    """Incremento atômico (sem ler o saldo antes)."""
+    return update(User).where(User.id == participante_id).values(saldo=func.coalesce(User.saldo, 0) + valor)
+
+
+def repassar_lote(db, participante_id: Optional[int] = None, limite: int = REPASSE_MAX_MOVIMENTOS) -> dict:
+    """Repassa os movimentos pagos e não repassados. O commit fica com quem chama."""
+    lote = uuid.uuid4().hex
+    agora = datetime.utcnow()
+
+    # 1) Marca os elegíveis (um UPDATE, linhas travadas até o commit)
+    elegiveis = select(Movimento.id).where(
+        Movimento.status.in_(STATUS_PAGOS), Movimento.repassado == False
+    )
+    if participante_id is not None:
+        elegiveis = elegiveis.where(Movimento.participante_id == participante_id)
+    elegiveis = elegiveis.order_by(Movimento.id).limit(limite)
+    if db.get_bind().dialect.name == "postgresql":
+        elegiveis = elegiveis.with_for_update(skip_locked=True)
+    marcados = db.execute(
+        update(Movimento)
+        .where(Movimento.id.in_(elegiveis), Movimento.repassado == False)
+        .values(repassado=True, repasse_lote=lote)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not marcados:
+        return {"lote": None, "movimentos": 0, "repasses": []}
+
+    # 2) Um Repasse por participante, agregado no próprio banco
+    agregado = (
+        select(
+            literal(lote, String), Movimento.participante_id, func.sum(Movimento.valor), func.count(),
+            literal(agora, DateTime),
+        )
+        .where(Movimento.repasse_lote == lote)
+        .group_by(Movimento.participante_id)
+    )
+    repasses = db.execute(
+        insert(Repasse)
+        .from_select(["lote", "participante_id", "valor_total", "quantidade", "criado_em"], agregado)
+        .returning(Repasse.id, Repasse.participante_id, Repasse.valor_total, Repasse.quantidade)
+    ).all()
+
+    # 3) Desconta do saldo de cada participante o total repassado
+    total_do_participante = (
+        select(Repasse.valor_total)
+        .where(Repasse.lote == lote, Repasse.participante_id == User.id)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(User)
+        .where(User.id.in_(select(Repasse.participante_id).where(Repasse.lote == lote)))
+        .values(saldo=func.coalesce(User.saldo, 0) - total_do_participante)
+        .execution_options(synchronize_session=False)
+    )
+
+    # 4) Contadores do painel (repassados no dia)
+    rollups.registrar_lote(db, lote, agora)
+    return {
+        "lote": lote,
+        "movimentos": marcados,
+        "repasses": [dict(r._mapping) for r in repasses],
+    }
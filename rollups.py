@@ -0,0 +1,123 @@
+# rollups.py
+# Contadores diários dos movimentos (tabela movimentos_diario) para o painel.
+#
+# Cada evento soma na linha (dia, participante, tipo, método) com um upsert na
+# mesma transação que altera o movimento: pedido criado (criar_movimento),
+# pagamento confirmado (liberar_movimento) e repasse (repassar_pagamento e
+# repasses.repassar_lote). O painel (routes/dashboard.py) lê só essas linhas,
+# sem varrer "movimentos".
+#
+# reconstruir() recalcula a tabela inteira a partir de "movimentos" (backfill
+# da migração 10 ou correção manual, de preferência sem escritas em curso):
+#   python rollups.py
+from collections import defaultdict
+from datetime import date, datetime
+from typing import List, Optional
+
+from sqlalchemy import and_, delete, func, insert, select
+
+from database import upsert_insert
+from models import Movimento, MovimentoDiario, Repasse, STATUS_PAGOS
+
+CONTADORES = ("pedidos", "pedidos_valor", "liberados", "liberados_valor", "repassados", "repassados_valor")
+CHAVE = ["dia", "participante_id", "tipo", "metodo"]
+# Linhas por statement (10 parâmetros cada; abaixo do limite do SQLite)
+LOTE_LINHAS = 1000
+
+
+def _linha(dia: date, participante_id: int, tipo: str, metodo: str, **valores) -> dict:
+    linha = {"dia": dia, "participante_id": participante_id, "tipo": tipo, "metodo": metodo}
+    linha.update({c: valores.get(c, 0) for c in CONTADORES})
+    return linha
+
+
+def somar(dialect_name: str, linhas: List[dict]):
+    """Upsert que soma os contadores das linhas aos já gravados."""
+    insert_ = upsert_insert(dialect_name)
+    stmt = insert_(MovimentoDiario).values(linhas)
+    novo = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=CHAVE,
+        set_={c: getattr(MovimentoDiario, c) + getattr(novo, c) for c in CONTADORES},
+    )
+
+
+def _aplicar(db, linhas: List[dict]) -> None:
+    # Sempre na mesma ordem: transações simultâneas travam as linhas sem deadlock
+    linhas = sorted(linhas, key=lambda l: (l["dia"], l["participante_id"], l["tipo"], l["metodo"]))
+    dialeto = db.get_bind().dialect.name
+    for i in range(0, len(linhas), LOTE_LINHAS):
+        db.execute(somar(dialeto, linhas[i:i + LOTE_LINHAS]))
+
+
+def registrar(db, evento: str, participante_id: int, tipo: str, metodo: str, valor: int,
+              quando: Optional[datetime] = None) -> None:
+    """Soma um evento ('pedidos', 'liberados' ou 'repassados') no dia de `quando`."""
+    dia = (quando or datetime.utcnow()).date()
+    _aplicar(db, [_linha(dia, participante_id, tipo, metodo, **{evento: 1, f"{evento}_valor": valor})])
+
+
+def registrar_lote(db, lote: str, quando: datetime) -> None:
+    """Soma os movimentos de um lote de repasse, agregados por participante/tipo/método."""
+    agregado = db.execute(
+        select(Movimento.participante_id, Movimento.tipo, Movimento.metodo, func.count(), func.sum(Movimento.valor))
+        .where(Movimento.repasse_lote == lote)
+        .group_by(Movimento.participante_id, Movimento.tipo, Movimento.metodo)
+    ).all()
+    _aplicar(db, [
+        _linha(quando.date(), p, tipo, metodo, repassados=n, repassados_valor=total)
+        for p, tipo, metodo, n, total in agregado
+    ])
+
+
+# === BACKFILL ===
+def _dia(valor) -> date:
+    # date() devolve texto no SQLite e date no PostgreSQL
+    return valor if isinstance(valor, date) else date.fromisoformat(str(valor)[:10])
+
+
+def reconstruir(conn) -> int:
+    """Apaga e recalcula movimentos_diario inteira. Retorna o número de linhas."""
+    pagos = Movimento.status.in_(STATUS_PAGOS)
+    origens = {
+        "pedidos": (func.date(Movimento.timestamp), None, None),
+        # Pagamentos: no dia da primeira liberação
+        "liberados": (func.date(func.coalesce(Movimento.liberado_em, Movimento.timestamp)), pagos, None),
+        # Repasses: no dia do lote (repassados antes dos lotes ficam no dia do pedido)
+        "repassados": (
+            func.date(func.coalesce(Repasse.criado_em, Movimento.timestamp)),
+            and_(pagos, Movimento.repassado == True),
+            and_(Repasse.lote == Movimento.repasse_lote, Repasse.participante_id == Movimento.participante_id),
+        ),
+    }
+
+    acumulado = defaultdict(lambda: dict.fromkeys(CONTADORES, 0))
+    for evento, (dia, filtro, juncao) in origens.items():
+        stmt = select(
+            dia, Movimento.participante_id, Movimento.tipo, Movimento.metodo,
+            func.count(), func.sum(Movimento.valor),
+        ).select_from(Movimento)
+        if juncao is not None:
+            stmt = stmt.outerjoin(Repasse, juncao)
+        if filtro is not None:
+            stmt = stmt.where(filtro)
+        stmt = stmt.group_by(dia, Movimento.participante_id, Movimento.tipo, Movimento.metodo)
+        for d, participante_id, tipo, metodo, quantidade, total in conn.execute(stmt):
+            linha = acumulado[(_dia(d), participante_id, tipo, metodo)]
+            linha[evento] += quantidade
+            linha[f"{evento}_valor"] += total or 0
+
+    linhas = [
+        {**dict(zip(CHAVE, chave)), **contadores} for chave, contadores in sorted(acumulado.items())
+    ]
+    conn.execute(delete(MovimentoDiario))
+    for i in range(0, len(linhas), LOTE_LINHAS):
+        conn.execute(insert(MovimentoDiario), linhas[i:i + LOTE_LINHAS])
+    return len(linhas)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    with engine.begin() as conn:
+        print(f"movimentos_diario reconstruída: {reconstruir(conn)} linhas")
@@ -1,7 +1,30 @@
-from fastapi import APIRouter
+# routes/auth.py
+from fastapi import APIRouter, Depends, Form, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
+from models import User
+import security
+from security import UsuarioToken, usuario_atual
 
 router = APIRouter()
 
-@router.post("/login")
-async def login():
-    return {"message": "Login fictício (ainda não implementado)"}
+# === RENOVAR TOKENS ===
+# Única etapa que consulta o banco: role e suspensão são relidos aqui
+@router.post("/auth/refresh")
+async def renovar_token(refresh_token: str = Form(...), db: AsyncSession = Depends(get_async_db)):
+    payload = security.decodificar_token(refresh_token, tipo="refresh")
+    user = (await db.execute(
+        select(User.id, User.role, User.status).where(User.id == payload["sub"])
+    )).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="Usuário não encontrado.")
+    if user.status == "suspenso":
+        raise HTTPException(status_code=403, detail="Usuário suspenso")
+    return security.emitir_tokens(user)
+
+# === USUÁRIO DO TOKEN (sem consulta ao banco) ===
+@router.get("/auth/me", response_model=UsuarioToken)
+def quem_sou_eu(usuario: UsuarioToken = Depends(usuario_atual)):
+    return usuario
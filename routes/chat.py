@@ -1,15 +1,26 @@
 # routes/chat.py
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from database import get_db
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_async_read_db
 from models import Message
 from datetime import datetime
-from pydantic import BaseModel
-from typing import List
-from models import User
+from pydantic import BaseModel, ConfigDict
+from typing import List, Optional
+from models import ConversaResumo, chave_conversa
+from chat_broker import get_broker
+from conversas import upsert_resumo, marcar_lida
+import chat_writer
+import arquivo_mensagens
+from idempotency import Idempotencia
+from security import UsuarioToken, usuario_da_requisicao, garantir_dono, usuario_do_token
 
 router = APIRouter()
 
+WS_AUTH_TIMEOUT = 10   # segundos para o cliente mandar o token na primeira mensagem
+
 class MessageCreate(BaseModel):
     sender_id: int
     receiver_id: int
@@ -22,44 +33,189 @@ class MessageOut(BaseModel):
     content: str
     timestamp: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
+# Rotas mais chamadas do app: usam a sessão assíncrona para não bloquear o event loop
 @router.post("/messages/send", response_model=MessageOut)
-def send_message(message: MessageCreate, db: Session = Depends(get_db)):
-    new_message = Message(
-        sender_id=message.sender_id,
-        receiver_id=message.receiver_id,
-        content=message.content,
-        timestamp=datetime.utcnow()
-    )
-    db.add(new_message)
-    db.commit()
-    db.refresh(new_message)
-    return new_message
+async def send_message(
+    message: MessageCreate,
+    db: AsyncSession = Depends(get_async_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    garantir_dono(usuario, message.sender_id)
+    # Reenvio com a mesma Idempotency-Key: devolve a mensagem já gravada
+    async with Idempotencia(idempotency_key, f"messages:{message.sender_id}", message.model_dump()) as idem:
+        if idem.resposta:
+            return idem.resposta
+
+        if chat_writer.CHAT_GROUP_COMMIT:
+            # Gravada junto com as mensagens que chegarem na mesma janela de alguns ms
+            linha = await chat_writer.escritor.gravar({
+                "sender_id": message.sender_id,
+                "receiver_id": message.receiver_id,
+                "content": message.content,
+                "timestamp": datetime.utcnow(),
+                "conversa": chave_conversa(message.sender_id, message.receiver_id),
+            })
+            saida = MessageOut(**linha)
+        else:
+            new_message = Message(
+                sender_id=message.sender_id,
+                receiver_id=message.receiver_id,
+                content=message.content,
+                timestamp=datetime.utcnow()
+            )
+            db.add(new_message)
+            await db.flush()
+
+            # Caixa de entrada do remetente e do destinatário, na mesma transação
+            await db.execute(upsert_resumo(db.get_bind().dialect.name, [{
+                "id": new_message.id,
+                "sender_id": new_message.sender_id,
+                "receiver_id": new_message.receiver_id,
+                "content": new_message.content,
+                "timestamp": new_message.timestamp,
+            }]))
+            await db.commit()
+            await db.refresh(new_message)
+            saida = MessageOut.model_validate(new_message)
+
+        # Entrega em tempo real para quem estiver conectado via WebSocket. Em
+        # thread: o broker postgres faz NOTIFY (e reconecta) de forma síncrona
+        await asyncio.to_thread(
+            get_broker().publish, saida.receiver_id, {"evento": "mensagem", "dados": jsonable_encoder(saida)}
+        )
+        return await idem.guardar_async(saida)
 
 @router.get("/messages/conversation", response_model=List[MessageOut])
-def get_conversation(user1: int, user2: int, db: Session = Depends(get_db)):
-    messages = db.query(Message).filter(
-        ((Message.sender_id == user1) & (Message.receiver_id == user2)) |
-        ((Message.sender_id == user2) & (Message.receiver_id == user1))
-    ).order_by(Message.timestamp.asc()).all()
-    
+async def get_conversation(
+    user1: int,
+    user2: int,
+    before: Optional[int] = None,   # página anterior: mensagens com id < before
+    after: Optional[int] = None,    # novidades: mensagens com id > after
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_read_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    garantir_dono(usuario, user1, user2)
+    # Sempre em ordem cronológica; sem cursor retorna a página mais recente
+    conversa = chave_conversa(user1, user2)
+    query = select(Message).where(Message.conversa == conversa)
+
+    if after is not None:
+        query = query.where(Message.id > after).order_by(Message.id.asc()).limit(limit)
+        return (await db.execute(query)).scalars().all()
+
+    if before is not None:
+        query = query.where(Message.id < before)
+    messages = list((await db.execute(query.order_by(Message.id.desc()).limit(limit))).scalars().all())
+    if len(messages) < limit:
+        # Rolagem passou das mensagens quentes: completa a página com o arquivo
+        antes_de = messages[-1].id if messages else before
+        messages += await arquivo_mensagens.anteriores(db, conversa, antes_de, limit - len(messages))
+    messages.reverse()
     return messages
+
 class SenderInfo(BaseModel):
     id: int
     name: str
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 @router.get("/messages/received_full/{user_id}", response_model=List[SenderInfo])
-def get_message_senders_with_names(user_id: int, db: Session = Depends(get_db)):
-    remetentes_ids = db.query(Message.sender_id).filter(
-        Message.receiver_id == user_id
-    ).distinct().all()
+async def get_message_senders_with_names(
+    user_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    garantir_dono(usuario, user_id)
+    resumos = (await db.execute(
+        select(ConversaResumo.contraparte_id, ConversaResumo.contraparte_nome).where(
+            ConversaResumo.user_id == user_id,
+            ConversaResumo.recebeu == True,
+            ConversaResumo.contraparte_nome != None
+        )
+    )).all()
+    return [{"id": r.contraparte_id, "name": r.contraparte_nome} for r in resumos]
+
+# === CAIXA DE ENTRADA (resumo por conversa) ===
+class ConversaOut(BaseModel):
+    contraparte_id: int
+    contraparte_nome: Optional[str] = None
+    ultima_mensagem: Optional[str] = None
+    ultimo_remetente_id: Optional[int] = None
+    ultimo_timestamp: Optional[datetime] = None
+    nao_lidas: int = 0
+
+    model_config = ConfigDict(from_attributes=True)
+
+@router.get("/messages/inbox/{user_id}", response_model=List[ConversaOut])
+async def get_inbox(
+    user_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_read_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    garantir_dono(usuario, user_id)
+    return (await db.execute(
+        select(ConversaResumo).where(
+            ConversaResumo.user_id == user_id
+        ).order_by(ConversaResumo.ultimo_timestamp.desc()).limit(limit)
+    )).scalars().all()
+
+@router.put("/messages/read/{user_id}/{contraparte_id}")
+async def mark_conversation_read(
+    user_id: int,
+    contraparte_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    garantir_dono(usuario, user_id)
+    await db.execute(marcar_lida(user_id, contraparte_id))
+    await db.commit()
+    return {"message": "Conversa marcada como lida"}
+
+# === WEBSOCKET (entrega em tempo real, substitui o polling) ===
+# Navegadores não mandam Authorization no WebSocket: o access token vem em
+# ?token=... ou como primeira mensagem de texto. Só o próprio usuário assina o canal.
+@router.websocket("/ws/chat/{user_id}")
+async def chat_websocket(websocket: WebSocket, user_id: int, token: Optional[str] = Query(None)):
+    await websocket.accept()
+    try:
+        if token is None:
+            token = await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT)
+        usuario = usuario_do_token(token.removeprefix("Bearer ").strip())
+    except WebSocketDisconnect:
+        return
+    except (asyncio.TimeoutError, HTTPException):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    if usuario.id != user_id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    broker = get_broker()
+    fila = broker.subscribe(user_id)
+
+    async def enviar():
+        while True:
+            evento = await fila.get()
+            await websocket.send_json(evento)
 
-    remetente_ids = [r[0] for r in remetentes_ids]
+    async def receber():
+        # Mantém a conexão viva e detecta o fechamento pelo cliente
+        while True:
+            texto = await websocket.receive_text()
+            if texto == "ping":
+                await websocket.send_text("pong")
 
-    remetentes = db.query(User).filter(User.id.in_(remetente_ids)).all()
-    return remetentes
\ No newline at end of file
+    tarefas = [asyncio.create_task(enviar()), asyncio.create_task(receber())]
+    try:
+        await asyncio.wait(tarefas, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for tarefa in tarefas:
+            tarefa.cancel()
+        # Recolhe WebSocketDisconnect/cancelamentos das tarefas encerradas
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        broker.unsubscribe(user_id, fila)
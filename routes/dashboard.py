@@ -0,0 +1,101 @@
+# routes/dashboard.py
+# Painel do admin: lê só os contadores diários de movimentos_diario (ver
+# rollups.py), então o custo depende do período pedido e não do volume de
+# "movimentos".
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from database import get_read_db
+from models import MovimentoDiario
+from rollups import CONTADORES
+from security import exigir_admin
+
+router = APIRouter(dependencies=[Depends(exigir_admin)])
+
+PERIODO_PADRAO_DIAS = 30
+PERIODO_MAX_DIAS = 366
+
+SOMAS = [func.coalesce(func.sum(getattr(MovimentoDiario, c)), 0).label(c) for c in CONTADORES]
+
+
+def _filtros(desde: Optional[date], ate: Optional[date], participante_id=None, tipo=None, metodo=None):
+    ate = ate or datetime.utcnow().date()   # contadores gravados em UTC
+    desde = desde or ate - timedelta(days=PERIODO_PADRAO_DIAS - 1)
+    if desde > ate:
+        raise HTTPException(status_code=400, detail="'desde' deve ser anterior a 'ate'.")
+    if (ate - desde).days >= PERIODO_MAX_DIAS:
+        raise HTTPException(status_code=400, detail=f"Período máximo de {PERIODO_MAX_DIAS} dias.")
+    filtros = [MovimentoDiario.dia >= desde, MovimentoDiario.dia <= ate]
+    if participante_id is not None:
+        filtros.append(MovimentoDiario.participante_id == participante_id)
+    if tipo:
+        filtros.append(MovimentoDiario.tipo == tipo)
+    if metodo:
+        filtros.append(MovimentoDiario.metodo == metodo)
+    return {"desde": desde, "ate": ate}, filtros
+
+
+# === RESUMO DO PERÍODO (totais, por tipo e por método) ===
+@router.get("/dashboard/resumo")
+def resumo_periodo(
+    desde: Optional[date] = None,
+    ate: Optional[date] = None,
+    participante_id: Optional[int] = None,
+    db: Session = Depends(get_read_db)
+):
+    periodo, filtros = _filtros(desde, ate, participante_id)
+    totais = db.execute(select(*SOMAS).where(*filtros)).one()
+    por_tipo = db.execute(
+        select(MovimentoDiario.tipo, *SOMAS).where(*filtros).group_by(MovimentoDiario.tipo)
+    ).all()
+    por_metodo = db.execute(
+        select(MovimentoDiario.metodo, *SOMAS).where(*filtros).group_by(MovimentoDiario.metodo)
+    ).all()
+    return {
+        **periodo,
+        "totais": dict(totais._mapping),
+        "por_tipo": {linha.tipo: dict(linha._mapping) for linha in por_tipo},
+        "por_metodo": {linha.metodo: dict(linha._mapping) for linha in por_metodo},
+    }
+
+
+# === SÉRIE DIÁRIA ===
+@router.get("/dashboard/diario")
+def serie_diaria(
+    desde: Optional[date] = None,
+    ate: Optional[date] = None,
+    participante_id: Optional[int] = None,
+    tipo: Optional[str] = None,
+    metodo: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    periodo, filtros = _filtros(desde, ate, participante_id, tipo, metodo)
+    linhas = db.execute(
+        select(MovimentoDiario.dia, *SOMAS).where(*filtros)
+        .group_by(MovimentoDiario.dia).order_by(MovimentoDiario.dia)
+    ).all()
+    return {**periodo, "dias": [dict(linha._mapping) for linha in linhas]}
+
+
+# === PARTICIPANTES COM MAIOR RECEITA ===
+@router.get("/dashboard/participantes")
+def ranking_participantes(
+    desde: Optional[date] = None,
+    ate: Optional[date] = None,
+    tipo: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    periodo, filtros = _filtros(desde, ate, tipo=tipo)
+    receita = func.sum(MovimentoDiario.liberados_valor)
+    linhas = db.execute(
+        select(MovimentoDiario.participante_id, *SOMAS).where(*filtros)
+        .group_by(MovimentoDiario.participante_id)
+        .order_by(receita.desc(), MovimentoDiario.participante_id)
+        .limit(limit)
+    ).all()
+    return {**periodo, "participantes": [dict(linha._mapping) for linha in linhas]}
@@ -0,0 +1,23 @@
+# routes/media.py
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy.orm import Session
+from database import get_db
+from models import MediaJob
+from media_jobs import job_para_dict
+from typing import Optional
+from security import UsuarioToken, usuario_da_requisicao, garantir_dono
+
+router = APIRouter()
+
+# === STATUS DO PROCESSAMENTO DE MÍDIA ===
+@router.get("/media/jobs/{job_id}")
+def status_media_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    job = db.query(MediaJob).filter(MediaJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job de mídia não encontrado.")
+    garantir_dono(usuario, job.user_id)
+    return job_para_dict(job)
@@ -0,0 +1,86 @@
+# routes/monitoramento.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import chat_writer
+import idempotency
+import rate_limit
+import media_jobs
+from database import engine
+from entitlements import cache as entitlement_cache
+from metrics import registro, registrar_coletor
+
+router = APIRouter()
+
+# === COLETORES ===
+@registrar_coletor
+def _cache_liberacoes():
+    stats = entitlement_cache.stats()
+    return [
+        "# TYPE deumatch_entitlement_cache_hits_total counter",
+        f"deumatch_entitlement_cache_hits_total {stats['hits']}",
+        "# TYPE deumatch_entitlement_cache_misses_total counter",
+        f"deumatch_entitlement_cache_misses_total {stats['misses']}",
+        "# TYPE deumatch_entitlement_cache_invalidations_total counter",
+        f"deumatch_entitlement_cache_invalidations_total {stats['invalidacoes']}",
+        "# TYPE deumatch_entitlement_cache_entries gauge",
+        f"deumatch_entitlement_cache_entries {stats['entradas'] + stats['clientes']}",
+    ]
+
+@registrar_coletor
+def _pool_conexoes():
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return []
+    return [
+        "# TYPE deumatch_db_pool_checked_out gauge",
+        f"deumatch_db_pool_checked_out {pool.checkedout()}",
+    ]
+
+@registrar_coletor
+def _fila_midia():
+    fila = media_jobs.fila._fila
+    return [
+        "# TYPE deumatch_media_jobs_queued gauge",
+        f"deumatch_media_jobs_queued {fila.qsize() if fila is not None else 0}",
+    ]
+
+@registrar_coletor
+def _group_commit_chat():
+    escritor = chat_writer.escritor
+    return [
+        "# TYPE deumatch_chat_group_commit_batches_total counter",
+        f"deumatch_chat_group_commit_batches_total {escritor.lotes}",
+        "# TYPE deumatch_chat_group_commit_messages_total counter",
+        f"deumatch_chat_group_commit_messages_total {escritor.mensagens}",
+    ]
+
+@registrar_coletor
+def _idempotencia():
+    return [
+        "# TYPE deumatch_idempotency_replays_total counter",
+        f"deumatch_idempotency_replays_total {idempotency.stats['repetidas']}",
+        "# TYPE deumatch_idempotency_in_progress_total counter",
+        f"deumatch_idempotency_in_progress_total {idempotency.stats['em_andamento']}",
+        "# TYPE deumatch_idempotency_conflicts_total counter",
+        f"deumatch_idempotency_conflicts_total {idempotency.stats['conflitos']}",
+    ]
+
+@registrar_coletor
+def _limites():
+    stats = rate_limit.stats
+    linhas = ["# TYPE deumatch_rate_limit_allowed_total counter"]
+    linhas += [f'deumatch_rate_limit_allowed_total{{rule="{r}"}} {n}' for r, n in sorted(stats["permitidas"].items())]
+    linhas.append("# TYPE deumatch_rate_limit_limited_total counter")
+    linhas += [f'deumatch_rate_limit_limited_total{{rule="{r}"}} {n}' for r, n in sorted(stats["limitadas"].items())]
+    return linhas + [
+        "# TYPE deumatch_uploads_rejected_total counter",
+        f"deumatch_uploads_rejected_total {stats['uploads_recusados']}",
+        "# TYPE deumatch_uploads_in_progress gauge",
+        f"deumatch_uploads_in_progress {stats['uploads_em_andamento']}",
+    ]
+
+# === MÉTRICAS (formato de texto do Prometheus) ===
+@router.get("/metrics", response_class=PlainTextResponse)
+def exportar_metricas():
+    return PlainTextResponse(registro.renderizar(), media_type="text/plain; version=0.0.4")
@@ -1,12 +1,65 @@
-from fastapi import APIRouter, HTTPException, Depends, Form
+import csv
+import io
+import json
+import uuid
+from fastapi import APIRouter, HTTPException, Depends, Form, Header, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, literal_column, text, tuple_, or_, DateTime
 from datetime import datetime, timedelta
-from database import get_db
-from models import Movimento
+from typing import Optional
+from database import get_db, get_async_read_db, lendo_replica, upsert_insert, engine, REPLICA_PIN_SECONDS
+from pagination import codificar_cursor, decodificar_cursor, cursor_data
+from models import Movimento, Repasse, STATUS_PAGOS, TIMESTAMP_LISTAGEM, EPOCA_LISTAGEM
+from repasses import creditar_saldo, repassar_lote, REPASSE_MAX_MOVIMENTOS
+from entitlements import cache as entitlement_cache
+import rollups
+from idempotency import Idempotencia
+from security import UsuarioToken, usuario_da_requisicao, garantir_dono, exigir_admin
 
 router = APIRouter()
 
+# Índice parcial que garante um único pedido "aguardando" (ver models.Movimento)
+AGUARDANDO = text("status = 'aguardando'")
+CHAVE_PEDIDO = ["cliente_id", "participante_id", "tipo"]
+
+
+def inserir_ou_existente(db: Session, dados: dict):
+    """Cria o pedido ou devolve o "aguardando" já existente: (id, criado)."""
+    dialeto = db.get_bind().dialect.name
+    insert = upsert_insert(dialeto)
+    stmt = insert(Movimento).values(**dados)
+
+    if dialeto == "postgresql":
+        # Um statement só: o DO UPDATE (sem alterar nada) faz o RETURNING trazer a
+        # linha existente; xmax = 0 indica que a linha acabou de ser inserida
+        stmt = stmt.on_conflict_do_update(
+            index_elements=CHAVE_PEDIDO,
+            index_where=AGUARDANDO,
+            set_={"status": Movimento.status},
+        ).returning(Movimento.id, literal_column("xmax = 0"))
+        movimento_id, criado = db.execute(stmt).one()
+        return movimento_id, bool(criado)
+
+    # SQLite serializa as escritas: INSERT ... DO NOTHING e, se não inseriu, busca o existente
+    inserido = db.execute(
+        stmt.on_conflict_do_nothing(index_elements=CHAVE_PEDIDO, index_where=AGUARDANDO)
+        .returning(Movimento.id)
+    ).first()
+    if inserido:
+        return inserido[0], True
+    existente = db.execute(
+        select(Movimento.id).where(
+            Movimento.cliente_id == dados["cliente_id"],
+            Movimento.participante_id == dados["participante_id"],
+            Movimento.tipo == dados["tipo"],
+            Movimento.status == "aguardando",
+        )
+    ).scalar_one()
+    return existente, False
+
 # === CRIAR MOVIMENTO (pedido de desbloqueio) ===
 @router.post("/movimentos")
 def criar_movimento(
@@ -15,63 +68,155 @@ def criar_movimento(
     tipo: str = Form(...),  # 'fotos', 'videos' ou 'acompanhante'
     valor: int = Form(1000),  # R$10,00 padrão
     metodo: str = Form("pix"),
-    db: Session = Depends(get_db)
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    db: Session = Depends(get_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
 ):
+    garantir_dono(usuario, cliente_id)
     if tipo not in ["fotos", "videos", "acompanhante"]:
         raise HTTPException(status_code=400, detail="Tipo inválido. Use 'fotos', 'videos' ou 'acompanhante'.")
 
-    # Verifica se já existe um pedido "aguardando" para este cliente/participante/tipo
-    existente = db.query(Movimento).filter(
-        Movimento.cliente_id == cliente_id,
-        Movimento.participante_id == participante_id,
-        Movimento.tipo == tipo,
-        Movimento.status == "aguardando"
-    ).first()
+    dados = {
+        "cliente_id": cliente_id,
+        "participante_id": participante_id,
+        "valor": valor,
+        "metodo": metodo,
+        "tipo": tipo,
+    }
+    # Reenvio com a mesma Idempotency-Key: devolve a primeira resposta sem ir ao banco
+    with Idempotencia(idempotency_key, f"movimentos:{cliente_id}", dados) as idem:
+        if idem.resposta:
+            return idem.resposta
 
-    if existente:
-        return {"message": "Pedido já existe", "movimento": existente.id}
-
-    # Cria um novo movimento
-    movimento = Movimento(
-        cliente_id=cliente_id,
-        participante_id=participante_id,
-        valor=valor,
-        metodo=metodo,
-        tipo=tipo,
-        status="aguardando",
-        expiracao=None  # Definida após liberação
-    )
-    db.add(movimento)
-    db.commit()
-    db.refresh(movimento)
-    return {"message": "Pedido registrado com sucesso", "movimento": movimento.id}
+        # Cria o pedido, ou devolve o "aguardando" existente, de forma atômica
+        movimento_id, criado = inserir_ou_existente(db, {
+            **dados,
+            "status": "aguardando",
+            "expiracao": None,  # Definida após liberação
+        })
+        if criado:
+            rollups.registrar(db, "pedidos", participante_id, tipo, metodo, valor)
+        db.commit()
+
+        if not criado:
+            return idem.guardar({"message": "Pedido já existe", "movimento": movimento_id})
+
+        entitlement_cache.invalidar(cliente_id, participante_id, tipo)
+        return idem.guardar({"message": "Pedido registrado com sucesso", "movimento": movimento_id})
 
 # === LISTAR TODOS MOVIMENTOS (ADMIN) ===
+COLUNAS_LISTAGEM = [
+    Movimento.id, Movimento.cliente_id, Movimento.participante_id, Movimento.tipo,
+    Movimento.valor, Movimento.metodo, Movimento.status, Movimento.repassado,
+    Movimento.timestamp, Movimento.expiracao,
+]
+NOMES_LISTAGEM = [c.key for c in COLUNAS_LISTAGEM]
+LOTE_EXPORTACAO = 1000
+
+
+def _exportar(query, formato: str):
+    """Gera as linhas a partir de um cursor do lado do servidor (memória constante)."""
+    with engine.connect() as conn:
+        resultado = conn.execution_options(stream_results=True, yield_per=LOTE_EXPORTACAO).execute(query)
+        if formato == "csv":
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            escritor.writerow(NOMES_LISTAGEM)
+            for lote in resultado.partitions():
+                escritor.writerows(lote)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for lote in resultado.partitions():
+                yield "".join(
+                    json.dumps(jsonable_encoder(dict(zip(NOMES_LISTAGEM, linha)))) + "\n" for linha in lote
+                )
+
+
+# JSON vem em páginas (100 por padrão, até 1000 com limit), mais recentes
+# primeiro. Enquanto houver mais, a resposta traz o header X-Next-Cursor: o
+# painel repete a chamada com ?cursor=<valor> até ele não vir. Para tudo de uma
+# vez, use formato=ndjson ou csv (streaming, sem limite)
 @router.get("/movimentos/list")
-def listar_todos_movimentos(db: Session = Depends(get_db)):
-    movimentos = db.query(Movimento).order_by(Movimento.timestamp.desc()).all()
-    return [
-        {
-            "id": m.id,
-            "cliente_id": m.cliente_id,
-            "participante_id": m.participante_id,
-            "tipo": m.tipo,
-            "valor": m.valor,
-            "metodo": m.metodo,
-            "status": m.status,
-            "repassado": m.repassado,
-            "timestamp": m.timestamp,
-            "expiracao": m.expiracao,
-        }
-        for m in movimentos
-    ]
+def listar_todos_movimentos(
+    response: Response,
+    status: Optional[str] = None,
+    tipo: Optional[str] = None,
+    repassado: Optional[bool] = None,
+    participante_id: Optional[int] = None,
+    desde: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    formato: str = Query("json", pattern="^(json|ndjson|csv)$"),
+    db: Session = Depends(get_db),
+    admin: UsuarioToken = Depends(exigir_admin),
+):
+    filtros = []
+    if status:
+        filtros.append(Movimento.status == status)
+    if tipo:
+        filtros.append(Movimento.tipo == tipo)
+    if repassado is not None:
+        filtros.append(Movimento.repassado == repassado)
+    if participante_id is not None:
+        filtros.append(Movimento.participante_id == participante_id)
+    if desde:
+        filtros.append(Movimento.timestamp >= desde)
+    if ate:
+        filtros.append(Movimento.timestamp < ate)
+
+    momento = literal_column(TIMESTAMP_LISTAGEM, DateTime)
+    query = select(*COLUNAS_LISTAGEM).where(*filtros).order_by(momento.desc(), Movimento.id.desc())
+
+    # Exportação: todos os registros filtrados, em streaming
+    if formato != "json":
+        media_type = "text/csv" if formato == "csv" else "application/x-ndjson"
+        return StreamingResponse(
+            _exportar(query, formato),
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename=movimentos.{formato}"},
+        )
+
+    # Página JSON; o cursor da próxima página vai no header X-Next-Cursor
+    if cursor:
+        ultimo_timestamp, ultimo_id = decodificar_cursor(cursor, 2)
+        query = query.where(
+            tuple_(momento, Movimento.id) < tuple_(cursor_data(ultimo_timestamp), ultimo_id)
+        )
+    linhas = db.execute(query.limit(limit + 1)).all()
+    if len(linhas) > limit:
+        linhas = linhas[:limit]
+        ultima = linhas[-1]
+        response.headers["X-Next-Cursor"] = codificar_cursor(ultima.timestamp or EPOCA_LISTAGEM, ultima.id)
+    return [dict(linha._mapping) for linha in linhas]
+
+# Leitura da réplica pode não ter a liberação mais recente: cacheia só pelo
+# tempo do lag esperado, para não prender um estado antigo até o TTL
+def _ttl_cache(db) -> Optional[timedelta]:
+    return timedelta(seconds=REPLICA_PIN_SECONDS) if lendo_replica(db) else None
 
 # === LISTAR MOVIMENTOS DE UM CLIENTE ===
 @router.get("/movimentos/cliente/{cliente_id}")
-def listar_movimentos_cliente(cliente_id: int, db: Session = Depends(get_db)):
-    movimentos = db.query(Movimento).filter(Movimento.cliente_id == cliente_id).all()
+async def listar_movimentos_cliente(
+    cliente_id: int,
+    db: AsyncSession = Depends(get_async_read_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    garantir_dono(usuario, cliente_id)
+    em_cache = entitlement_cache.get_cliente(cliente_id)
+    if em_cache is not None:
+        return em_cache
+
+    movimentos = (await db.execute(
+        select(Movimento.participante_id, Movimento.tipo, Movimento.status, Movimento.expiracao)
+        .where(Movimento.cliente_id == cliente_id)
+    )).all()
     resultado = {}
     agora = datetime.utcnow()
+    proxima_expiracao = None
 
     for mov in movimentos:
         # Garante que o participante_id seja int (chave de dicionário)
@@ -87,53 +232,121 @@ def listar_movimentos_cliente(cliente_id: int, db: Session = Depends(get_db)):
         # Atualiza status
         if mov.status == "liberado" and (not mov.expiracao or mov.expiracao > agora):
             resultado[participante_id][mov.tipo] = True
+            if mov.expiracao and (proxima_expiracao is None or mov.expiracao < proxima_expiracao):
+                proxima_expiracao = mov.expiracao
         elif mov.status == "aguardando":
             resultado[participante_id][mov.tipo] = "aguardando"
 
+    # Vale até a primeira liberação expirar (ou até um movimento ser criado/liberado)
+    entitlement_cache.put_cliente(cliente_id, resultado, proxima_expiracao, _ttl_cache(db))
     return resultado
 
 # === VERIFICAR SE CHAT ESTÁ LIBERADO ===
 @router.get("/chat/liberado/{cliente_id}/{participante_id}")
-def verificar_chat_liberado(
+async def verificar_chat_liberado(
     cliente_id: int,
     participante_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
 ):
-    movimento = db.query(Movimento).filter(
-        Movimento.cliente_id == cliente_id,
-        Movimento.participante_id == participante_id,
-        Movimento.tipo == "acompanhante",
-        Movimento.status == "liberado",
-        or_(
-            Movimento.expiracao == None,
-            Movimento.expiracao > datetime.utcnow()
-        )
-    ).first()
+    garantir_dono(usuario, cliente_id, participante_id)
+    em_cache = entitlement_cache.get(cliente_id, participante_id, "acompanhante")
+    if em_cache is not None:
+        liberado, expiracao = em_cache
+        return {"liberado": liberado, "expiracao": expiracao}
 
+    # Liberações vencidas viram "expirado" pelo expiry_sweeper; o filtro da
+    # expiracao cobre as que a varredura ainda não alcançou. A mais duradoura
+    # (sem expiração primeiro) é a que vale
+    agora = datetime.utcnow()
+    movimento = (await db.execute(
+        select(Movimento.expiracao).where(
+            Movimento.cliente_id == cliente_id,
+            Movimento.participante_id == participante_id,
+            Movimento.tipo == "acompanhante",
+            Movimento.status == "liberado",
+            or_(Movimento.expiracao.is_(None), Movimento.expiracao > agora),
+        ).order_by(Movimento.expiracao.desc().nulls_first()).limit(1)
+    )).first()
+
+    # Positivo vale até a expiração do movimento; negativo até criar/liberar invalidar
+    liberado = movimento is not None
+    expiracao = movimento.expiracao if movimento else None
+    entitlement_cache.put(cliente_id, participante_id, "acompanhante", liberado, expiracao, _ttl_cache(db))
     return {
-        "liberado": movimento is not None,
-        "expiracao": movimento.expiracao if movimento else None
+        "liberado": liberado,
+        "expiracao": expiracao
     }
 
 # === LIBERAR PEDIDO (ADMIN) ===
 @router.put("/movimentos/liberar/{movimento_id}")
-def liberar_movimento(movimento_id: int, db: Session = Depends(get_db)):
-    movimento = db.query(Movimento).filter(Movimento.id == movimento_id).first()
+def liberar_movimento(movimento_id: int, db: Session = Depends(get_db), admin: UsuarioToken = Depends(exigir_admin)):
+    movimento = db.query(Movimento).filter(Movimento.id == movimento_id).with_for_update().first()
     if not movimento:
         raise HTTPException(status_code=404, detail="Movimento não encontrado.")
+    agora = datetime.utcnow()
+    if movimento.status not in STATUS_PAGOS:
+        # Primeira liberação: pagamento confirmado (painel) e, se ainda não
+        # repassado, valor entra no saldo
+        movimento.liberado_em = agora
+        rollups.registrar(db, "liberados", movimento.participante_id, movimento.tipo, movimento.metodo, movimento.valor, agora)
+        if not movimento.repassado:
+            db.execute(creditar_saldo(movimento.participante_id, movimento.valor))
     movimento.status = "liberado"
-    movimento.expiracao = datetime.utcnow() + timedelta(hours=1)  # expira em 1 hora
+    movimento.expiracao = agora + timedelta(hours=1)  # expira em 1 hora
     db.commit()
+    entitlement_cache.invalidar(movimento.cliente_id, movimento.participante_id, movimento.tipo)
     return {"message": f"Movimento {movimento.id} liberado por 1 hora."}
 
 # === REPASSAR PAGAMENTO (ADMIN) ===
 @router.post("/movimentos/repassar/{movimento_id}")
-def repassar_pagamento(movimento_id: int, db: Session = Depends(get_db)):
-    movimento = db.query(Movimento).filter(Movimento.id == movimento_id).first()
+def repassar_pagamento(movimento_id: int, db: Session = Depends(get_db), admin: UsuarioToken = Depends(exigir_admin)):
+    movimento = db.query(Movimento).filter(Movimento.id == movimento_id).with_for_update().first()
     if not movimento:
         raise HTTPException(status_code=404, detail="Movimento não encontrado.")
     if movimento.repassado:
         raise HTTPException(status_code=400, detail="Pagamento já foi repassado.")
+    if movimento.status not in STATUS_PAGOS:
+        # Mesma regra do lote: só se repassa o que o cliente pagou
+        raise HTTPException(status_code=400, detail="Pagamento ainda não foi confirmado.")
+    # Mesmo caminho do lote, restrito a este movimento
+    lote = uuid.uuid4().hex
+    db.add(Repasse(lote=lote, participante_id=movimento.participante_id, valor_total=movimento.valor, quantidade=1))
+    movimento.repasse_lote = lote
+    db.execute(creditar_saldo(movimento.participante_id, -movimento.valor))
+    rollups.registrar(db, "repassados", movimento.participante_id, movimento.tipo, movimento.metodo, movimento.valor)
     movimento.repassado = True
     db.commit()
-    return {"message": "Pagamento repassado com sucesso"}
\ No newline at end of file
+    return {"message": "Pagamento repassado com sucesso"}
+
+# === REPASSE EM LOTE (ADMIN) ===
+@router.post("/movimentos/repassar_lote")
+def repassar_pagamentos_em_lote(
+    participante_id: Optional[int] = Form(None),   # sem ele, todos os participantes
+    limite: int = Form(REPASSE_MAX_MOVIMENTOS, ge=1, le=REPASSE_MAX_MOVIMENTOS),
+    db: Session = Depends(get_db),
+    admin: UsuarioToken = Depends(exigir_admin),
+):
+    resultado = repassar_lote(db, participante_id, limite)
+    db.commit()
+    if not resultado["lote"]:
+        return {"message": "Nenhum pagamento a repassar", **resultado}
+    return {"message": f"{resultado['movimentos']} pagamento(s) repassado(s)", **resultado}
+
+# === REPASSES DE UM PARTICIPANTE ===
+@router.get("/repasses/{participante_id}")
+def listar_repasses(
+    participante_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    garantir_dono(usuario, participante_id)
+    return db.query(Repasse).filter(Repasse.participante_id == participante_id).order_by(
+        Repasse.criado_em.desc(), Repasse.id.desc()
+    ).limit(limit).all()
+
+# === ESTATÍSTICAS DO CACHE DE LIBERAÇÕES (ADMIN) ===
+@router.get("/admin/cache/entitlements")
+def estatisticas_cache_liberacoes(admin: UsuarioToken = Depends(exigir_admin)):
+    return entitlement_cache.stats()
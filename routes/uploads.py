@@ -0,0 +1,182 @@
+# routes/uploads.py
+# Upload de fotos e vídeos em partes, com retomada (ver uploads_resumiveis.py)
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Form, Depends, Header, Request, Path
+from sqlalchemy import func, select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db, upsert_insert
+from models import UploadParte, UploadSessao
+from security import UsuarioToken, usuario_da_requisicao, garantir_dono
+import media_jobs
+import uploads_resumiveis as resumiveis
+
+router = APIRouter()
+
+
+async def _partes_recebidas(db: AsyncSession, upload_id: str):
+    return (await db.execute(
+        select(UploadParte.indice).where(UploadParte.upload_id == upload_id).order_by(UploadParte.indice)
+    )).scalars().all()
+
+
+def _sessao_para_dict(sessao: UploadSessao, recebidas) -> dict:
+    return {
+        "upload_id": sessao.id,
+        "nome": sessao.nome,
+        "tipo": sessao.tipo,
+        "tamanho": sessao.tamanho,
+        "tamanho_parte": sessao.tamanho_parte,
+        "total_partes": sessao.total_partes,
+        "status": sessao.status,
+        "expira_em": sessao.expira_em,
+        "recebidas": list(recebidas),
+        # Com a sessão concluída, o andamento segue em /media/jobs/{job_id}
+        "job_id": sessao.id if sessao.status == "concluida" else None,
+    }
+
+
+async def _sessao(db: AsyncSession, upload_id: str, usuario: Optional[UsuarioToken]) -> UploadSessao:
+    sessao = await db.get(UploadSessao, upload_id)
+    if not sessao:
+        raise HTTPException(status_code=404, detail="Upload não encontrado.")
+    garantir_dono(usuario, sessao.user_id)
+    return sessao
+
+
+def _aberta(sessao: UploadSessao) -> None:
+    if sessao.status != "aberta":
+        raise HTTPException(status_code=409, detail="Upload já concluído.")
+    if sessao.expira_em < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Upload expirado. Inicie um novo.")
+
+
+# === ABRIR SESSÃO ===
+@router.post("/uploads")
+async def abrir_upload(
+    user_id: int = Form(...),
+    nome: str = Form(..., max_length=255),
+    tipo: str = Form(...),
+    tamanho: int = Form(..., gt=0),
+    db: AsyncSession = Depends(get_async_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    garantir_dono(usuario, user_id)
+    if tipo not in resumiveis.UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=400, detail="Tipo inválido. Use 'foto' ou 'video'.")
+    maximo = resumiveis.UPLOAD_MAX_BYTES[tipo]
+    if tamanho > maximo:
+        # Recusado antes de qualquer parte ser enviada
+        raise HTTPException(status_code=413, detail=f"Arquivo acima do limite de {maximo // resumiveis.MB} MB.")
+
+    agora = datetime.utcnow()
+    sessao = UploadSessao(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        nome=nome,
+        tipo=tipo,
+        tamanho=tamanho,
+        tamanho_parte=resumiveis.UPLOAD_PARTE_BYTES,
+        total_partes=resumiveis.total_partes(tamanho, resumiveis.UPLOAD_PARTE_BYTES),
+        status="aberta",
+        criado_em=agora,
+        expira_em=agora + resumiveis.UPLOAD_SESSAO_TTL,
+    )
+    resumiveis.preparar_arquivo(sessao.id)
+    db.add(sessao)
+    await db.commit()
+    resumiveis.sessao_aberta()
+    return _sessao_para_dict(sessao, [])
+
+
+# === ANDAMENTO (para retomar) ===
+@router.get("/uploads/{upload_id}")
+async def status_upload(
+    upload_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    sessao = await _sessao(db, upload_id, usuario)
+    return _sessao_para_dict(sessao, await _partes_recebidas(db, upload_id))
+
+
+# === ENVIAR PARTE ===
+# Corpo cru (application/octet-stream): lido em blocos, sem multipart nem spool do Starlette
+@router.put("/uploads/{upload_id}/partes/{indice}")
+async def enviar_parte(
+    request: Request,
+    upload_id: str,
+    indice: int = Path(..., ge=0),
+    x_chunk_sha256: str = Header(..., min_length=64, max_length=64),
+    content_length: Optional[int] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    sessao = await _sessao(db, upload_id, usuario)
+    _aberta(sessao)
+    if indice >= sessao.total_partes:
+        raise HTTPException(status_code=400, detail=f"Parte inválida. O upload tem {sessao.total_partes} partes.")
+    esperado = resumiveis.tamanho_da_parte(sessao, indice)
+    if content_length is not None and content_length > esperado:
+        raise HTTPException(status_code=413, detail=f"Parte maior que {esperado} bytes.")
+
+    # Reenvio sobrescreve a parte: ela só volta a contar se a nova conferir
+    await db.execute(delete(UploadParte).where(UploadParte.upload_id == upload_id, UploadParte.indice == indice))
+    await db.commit()
+    try:
+        await resumiveis.gravar_parte(
+            upload_id, indice * sessao.tamanho_parte, esperado, x_chunk_sha256, request.stream()
+        )
+    except resumiveis.ParteInvalida as e:
+        raise HTTPException(status_code=413 if e.grande else 400, detail=str(e))
+
+    insert_ = upsert_insert(db.get_bind().dialect.name)
+    await db.execute(
+        insert_(UploadParte)
+        .values(upload_id=upload_id, indice=indice, tamanho=esperado, sha256=x_chunk_sha256.lower(),
+                recebido_em=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["upload_id", "indice"])
+    )
+    await db.commit()
+    recebidas = (await db.execute(
+        select(func.count()).select_from(UploadParte).where(UploadParte.upload_id == upload_id)
+    )).scalar()
+    return {"upload_id": upload_id, "indice": indice, "recebidas": recebidas, "total_partes": sessao.total_partes}
+
+
+# === CONCLUIR ===
+@router.post("/uploads/{upload_id}/concluir")
+async def concluir_upload(
+    upload_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    sessao = await _sessao(db, upload_id, usuario)
+    if sessao.status == "concluida":
+        return _sessao_para_dict(sessao, range(sessao.total_partes))   # repetição da conclusão
+    _aberta(sessao)
+
+    recebidas = await _partes_recebidas(db, upload_id)
+    if len(recebidas) < sessao.total_partes:
+        faltam = sorted(set(range(sessao.total_partes)) - set(recebidas))
+        raise HTTPException(status_code=409, detail={"mensagem": "Faltam partes do arquivo.", "faltam": faltam})
+
+    # Só uma conclusão cria o job, mesmo com pedidos simultâneos
+    concluida = await db.execute(
+        update(UploadSessao)
+        .where(UploadSessao.id == upload_id, UploadSessao.status == "aberta")
+        .values(status="concluida")
+    )
+    if concluida.rowcount:
+        media_jobs.criar_job(db, upload_id, sessao.user_id, [{
+            "caminho": resumiveis.caminho_arquivo(upload_id), "nome": sessao.nome, "tipo": sessao.tipo,
+        }])
+        await db.execute(delete(UploadParte).where(UploadParte.upload_id == upload_id))
+    await db.commit()
+    await db.refresh(sessao)
+    if concluida.rowcount:
+        media_jobs.fila.enqueue(upload_id)
+    return _sessao_para_dict(sessao, recebidas)
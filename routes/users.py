@@ -1,29 +1,27 @@
 # app/routes/users.py
-import cloudinary.uploader
-import cloudinary
-import os
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
+import hashlib
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, ConfigDict
 from fastapi import status
-from database import get_db
-from models import User as DBUser
+from database import get_db, get_read_db, get_async_db
+from models import User as DBUser, ConversaResumo, UserMedia
+from midias import public_id_da_url, remover_midia, marcar_perfil_alterado
+from pagination import codificar_cursor, decodificar_cursor
+from conversas import renomear_contraparte
+from media_uploads import get_uploader
+import media_jobs
+import search
+import security
+from security import UsuarioToken, usuario_da_requisicao, garantir_dono, exigir_admin
+from sqlalchemy import or_, select, func
 
 router = APIRouter()
 
-# === CONFIG CLOUDINARY ===
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET")
-)
-
-# === FUNÇÃO DE UPLOAD ===
-def upload_to_cloudinary(file: UploadFile, folder: str = "usuarios"):
-    result = cloudinary.uploader.upload(file.file, folder=folder, resource_type="auto")
-    return result["secure_url"]
-
 # === SCHEMA DE RETORNO ===
 class UserSchema(BaseModel):
     id: int
@@ -36,24 +34,30 @@ class UserSchema(BaseModel):
     foto2: Optional[str] = None
     galeria: Optional[List[str]] = []
     video: Optional[str] = None
+    videos: List[str] = []
     valor_acompanhante: Optional[int] = 0
     exclusao_pendente: Optional[bool] = False
     whatsapp: Optional[str] = None
     chave_pix: Optional[str] = None
     maior_idade: Optional[bool] = False 
 
-    @validator("galeria", pre=True)
-    def split_galeria(cls, v):
-        if isinstance(v, str):
-            return v.split(",") if v else []
-        return v
-
-    class Config:
-        from_attributes = True
-
-# === SCHEMA COM SENHA (interno) ===
-class UserWithPasswordSchema(UserSchema):
-    senha: Optional[str] = None
+    model_config = ConfigDict(from_attributes=True)
+
+# === SERIALIZAÇÃO COMPLETA (respostas de cadastro, login e atualização) ===
+def usuario_para_dict(user: DBUser) -> dict:
+    dados = {
+        c.key: getattr(user, c.key)
+        for c in DBUser.__mapper__.column_attrs
+        if not c.key.endswith("_legado") and c.key != "senha"
+    }
+    dados.update(
+        foto1=user.foto1,
+        foto2=user.foto2,
+        galeria=user.galeria,
+        video=user.video,
+        videos=user.videos,
+    )
+    return dados
 
 # === CADASTRO DE USUÁRIO ===
 @router.post("/users/register")
@@ -99,36 +103,14 @@ async def register_user(
         if not forma_pagamento:
             raise HTTPException(status_code=400, detail="Clientes devem informar a forma de pagamento.")
 
-    # Upload das fotos
-    foto1 = None
-    foto2 = None
-    galeria = []
-
-    if fotos:
-        for index, foto in enumerate(fotos):
-            url = upload_to_cloudinary(foto)
-            if index == 0:
-                foto1 = url
-            elif index == 1:
-                foto2 = url
-            else:
-                galeria.append(url)
-
-    # Upload do vídeo (se houver)
-    video_url = upload_to_cloudinary(video) if video else None
-
     # Criação do usuário no banco
     user = DBUser(
         name=name,
         email=email,
         role=role,
-        senha=senha,
+        senha=await security.hash_senha_async(senha) if senha else None,
         bio=bio,
         status=status,
-        foto1=foto1,
-        foto2=foto2,
-        galeria=",".join(galeria),
-        video=video_url,
         forma_pagamento=forma_pagamento,
         forma_recebimento=forma_recebimento,
         tipo_chave_pix=tipo_chave_pix,
@@ -139,24 +121,45 @@ async def register_user(
     )
 
     db.add(user)
+    db.flush()
+
+    # Fotos e vídeo vão para a fila de mídia; o perfil é preenchido em segundo plano
+    job_id = None
+    if fotos or video:
+        job_id = media_jobs.novo_job_id()
+        arquivos = await media_jobs.salvar_no_spool(job_id, fotos or [], "foto")
+        arquivos += await media_jobs.salvar_no_spool(job_id, [video] if video else [], "video")
+        media_jobs.criar_job(db, job_id, user.id, arquivos)
+
     db.commit()
     db.refresh(user)
-    return {"message": "Usuário registrado com sucesso", "user": user}
+    search.atualizar_usuario(user)
+    if job_id:
+        media_jobs.fila.enqueue(job_id)
+    return {
+        "message": "Usuário registrado com sucesso", "user": usuario_para_dict(user), "job_id": job_id,
+        **security.emitir_tokens(user),
+    }
 
 
-# === LOGIN SIMPLES ===
+# === LOGIN (emite access e refresh token) ===
 @router.post("/users/login")
-def login_user(
+async def login_user(
     email: str = Form(...),
     senha: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(DBUser).filter(DBUser.email == email, DBUser.senha == senha).first()
-    if not user:
+    user = (await db.execute(select(DBUser).where(DBUser.email == email))).scalars().first()
+    # O hash roda no pool de threads do security: o event loop segue atendendo
+    if not user or not await security.verificar_senha_async(senha, user.senha):
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     if user.status == "suspenso":
         raise HTTPException(status_code=403, detail="Usuário suspenso")
-    return {"message": "Login autorizado", "user": user}
+    if security.precisa_rehash(user.senha):
+        # Senha antiga em texto puro (ou com menos iterações): grava o hash novo
+        user.senha = await security.hash_senha_async(senha)
+        await db.commit()
+    return {"message": "Login autorizado", "user": usuario_para_dict(user), **security.emitir_tokens(user)}
 
 # === ATUALIZAR PERFIL ===
 @router.put("/users/update/{user_id}")
@@ -171,44 +174,43 @@ async def update_user(
     fotos: List[UploadFile] = None,
     videos: List[UploadFile] = None,
     db: Session = Depends(get_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
 ):
+    garantir_dono(usuario, user_id)
     user = db.query(DBUser).filter(DBUser.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado.")
 
+    if user.name != name:
+        # Mantém o nome exibido nas caixas de entrada de quem conversa com ele
+        db.execute(renomear_contraparte(user.id, name))
     user.name = name
     user.email = email
     user.bio = bio
     user.status = status
     user.valor_acompanhante = valor_acompanhante
     if senha:
-        user.senha = senha  # Em produção, usar hash
-
-    # Upload de novas fotos (mantendo antigas)
-    if fotos:
-        if len(fotos) > 20:
-            raise HTTPException(status_code=400, detail="Máximo de 20 fotos permitido.")
-        existing_fotos = [user.foto1, user.foto2] + (user.galeria.split(',') if user.galeria else [])
-        for foto in fotos:
-            upload_result = cloudinary.uploader.upload(foto.file, folder="usuarios")
-            existing_fotos.append(upload_result["secure_url"])
-        user.foto1 = existing_fotos[0] if len(existing_fotos) > 0 else None
-        user.foto2 = existing_fotos[1] if len(existing_fotos) > 1 else None
-        user.galeria = ",".join(existing_fotos[2:]) if len(existing_fotos) > 2 else None
-
-    # Upload de novos vídeos (mantendo antigos)
-    if videos:
-        if len(videos) > 5:
-            raise HTTPException(status_code=400, detail="Máximo de 5 vídeos permitido.")
-        existing_videos = user.video.split(',') if user.video else []
-        for video in videos:
-            upload_result = cloudinary.uploader.upload(video.file, resource_type="video", folder="usuarios")
-            existing_videos.append(upload_result["secure_url"])
-        user.video = ",".join(existing_videos)
+        user.senha = await security.hash_senha_async(senha)
+
+    if fotos and len(fotos) > 20:
+        raise HTTPException(status_code=400, detail="Máximo de 20 fotos permitido.")
+    if videos and len(videos) > 5:
+        raise HTTPException(status_code=400, detail="Máximo de 5 vídeos permitido.")
+
+    # Novas fotos e vídeos (mantendo antigos) vão para a fila de mídia
+    job_id = None
+    if fotos or videos:
+        job_id = media_jobs.novo_job_id()
+        arquivos = await media_jobs.salvar_no_spool(job_id, fotos or [], "foto")
+        arquivos += await media_jobs.salvar_no_spool(job_id, videos or [], "video")
+        media_jobs.criar_job(db, job_id, user.id, arquivos)
 
     db.commit()
     db.refresh(user)
-    return {"mensagem": "Perfil atualizado com sucesso!", "user": user}
+    search.atualizar_usuario(user)
+    if job_id:
+        media_jobs.fila.enqueue(job_id)
+    return {"mensagem": "Perfil atualizado com sucesso!", "user": usuario_para_dict(user), "job_id": job_id}
 
 # === EXCLUIR MÍDIA DO PERFIL ===
 @router.delete("/users/{user_id}/delete_media")
@@ -216,73 +218,199 @@ def delete_media(
     user_id: int,
     media_url: str,
     tipo: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
 ):
+    garantir_dono(usuario, user_id)
     user = db.query(DBUser).filter(DBUser.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
 
+    if tipo not in ("foto", "video"):
+        raise HTTPException(status_code=400, detail="Tipo inválido. Use 'foto' ou 'video'.")
+
     try:
-        # Extrair public_id da URL
-        parts = media_url.split('/')
-        file_name = parts[-1].split('.')[0]
-        public_id = f"usuarios/{file_name}"
+        midia = db.query(UserMedia).filter(
+            UserMedia.user_id == user_id, UserMedia.tipo == tipo, UserMedia.url == media_url
+        ).first()
+        public_id = midia.public_id if midia and midia.public_id else public_id_da_url(media_url)
 
         # Excluir do Cloudinary
         resource_type = "video" if tipo == "video" else "image"
-        cloudinary.uploader.destroy(public_id, resource_type=resource_type)
-
-        # Remover do banco
-        if tipo == "foto":
-            fotos = [user.foto1, user.foto2] + (user.galeria.split(',') if user.galeria else [])
-            fotos = [f for f in fotos if f and f != media_url]
-            user.foto1 = fotos[0] if len(fotos) > 0 else None
-            user.foto2 = fotos[1] if len(fotos) > 1 else None
-            user.galeria = ','.join(fotos[2:]) if len(fotos) > 2 else None
-        elif tipo == "video":
-            videos = user.video.split(',') if user.video else []
-            videos = [v for v in videos if v != media_url]
-            user.video = ','.join(videos) if videos else None
+        get_uploader().destroy(public_id, resource_type=resource_type)
 
+        # Remover do banco (DELETE de uma linha)
+        db.execute(remover_midia(user_id, tipo, media_url))
+        db.execute(marcar_perfil_alterado(user_id))
         db.commit()
         return {"message": "Mídia excluída com sucesso"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao excluir mídia: {str(e)}")
 
 # === LISTAR USUÁRIOS ===
-@router.get("/users/list", response_model=List[UserWithPasswordSchema])
-async def list_users(role: Optional[str] = None, db: Session = Depends(get_db)):
+@router.get("/users/list", response_model=List[UserSchema])
+async def list_users(role: Optional[str] = None, db: Session = Depends(get_read_db)):
     query = db.query(DBUser)
     if role:
         query = query.filter(DBUser.role == role)
     return query.filter(DBUser.status != "suspenso").all()
 
+# === FEED DE PARTICIPANTES (paginado, filtrado e projetado) ===
+CAMPOS_FEED = [
+    DBUser.id, DBUser.name, DBUser.role, DBUser.status,
+    DBUser.valor_acompanhante, DBUser.maior_idade,
+]
+EXTRAS_FEED = {"bio", "galeria", "videos"}
+
+
+def _midias_do_feed(db: Session, ids: List[int], galeria: bool, videos: bool) -> dict:
+    """Mídias da página numa query só; sem galeria, só as duas fotos de capa."""
+    tipos = ["foto"] + (["video"] if videos else [])
+    ordem = func.row_number().over(
+        partition_by=(UserMedia.user_id, UserMedia.tipo),
+        order_by=(UserMedia.posicao, UserMedia.id),
+    ).label("ordem")
+    sub = select(UserMedia.user_id, UserMedia.tipo, UserMedia.url, ordem).where(
+        UserMedia.user_id.in_(ids), UserMedia.tipo.in_(tipos)
+    ).subquery()
+    query = select(sub.c.user_id, sub.c.tipo, sub.c.url)
+    if not galeria:
+        query = query.where(or_(sub.c.tipo != "foto", sub.c.ordem <= 2))
+    midias = {}
+    for user_id, tipo, url in db.execute(query.order_by(sub.c.user_id, sub.c.tipo, sub.c.ordem)):
+        midias.setdefault(user_id, {"foto": [], "video": []})[tipo].append(url)
+    return midias
+
+
+@router.get("/users/feed")
+def feed_usuarios(
+    request: Request,
+    role: Optional[str] = "participante",
+    status: Optional[str] = None,
+    preco_min: Optional[int] = None,
+    preco_max: Optional[int] = None,
+    maior_idade: Optional[bool] = None,
+    campos: Optional[str] = None,   # extras separados por vírgula: bio,galeria,videos
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    extras = {c.strip() for c in campos.split(",") if c.strip()} if campos else set()
+    if extras - EXTRAS_FEED:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(sorted(extras - EXTRAS_FEED))}")
+
+    filtros = [DBUser.status == status] if status else [DBUser.status != "suspenso"]
+    if role:
+        filtros.append(DBUser.role == role)
+    if preco_min is not None:
+        filtros.append(DBUser.valor_acompanhante >= preco_min)
+    if preco_max is not None:
+        filtros.append(DBUser.valor_acompanhante <= preco_max)
+    if maior_idade is not None:
+        filtros.append(DBUser.maior_idade == maior_idade)
+    if cursor:
+        filtros.append(DBUser.id > decodificar_cursor(cursor, 1)[0])
+
+    # 1) Só ids e versões: barato, e suficiente para responder 304
+    versoes = db.execute(
+        select(DBUser.id, DBUser.atualizado_em).where(*filtros).order_by(DBUser.id).limit(limit + 1)
+    ).all()
+    proximo_cursor = None
+    if len(versoes) > limit:
+        versoes = versoes[:limit]
+        proximo_cursor = codificar_cursor(versoes[-1].id)
+
+    assinatura = hashlib.sha1(request.url.query.encode())
+    for user_id, atualizado_em in versoes:
+        assinatura.update(f"|{user_id}:{atualizado_em}".encode())
+    etag = f'W/"{assinatura.hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    # 2) Página projetada: bio e galeria só quando pedidas
+    ids = [v.id for v in versoes]
+    colunas = CAMPOS_FEED + ([DBUser.bio] if "bio" in extras else [])
+    linhas = db.execute(select(*colunas).where(DBUser.id.in_(ids)).order_by(DBUser.id)).all() if ids else []
+    midias = _midias_do_feed(db, ids, "galeria" in extras, "videos" in extras) if ids else {}
+
+    usuarios = []
+    for linha in linhas:
+        item = dict(linha._mapping)
+        fotos = midias.get(linha.id, {}).get("foto", [])
+        item["foto1"] = fotos[0] if len(fotos) > 0 else None
+        item["foto2"] = fotos[1] if len(fotos) > 1 else None
+        if "galeria" in extras:
+            item["galeria"] = fotos[2:]
+        if "videos" in extras:
+            item["videos"] = midias.get(linha.id, {}).get("video", [])
+        usuarios.append(item)
+
+    return JSONResponse({"usuarios": jsonable_encoder(usuarios), "proximo_cursor": proximo_cursor}, headers=headers)
+
+# === BUSCA POR NOME E BIO ===
+@router.get("/users/search")
+def buscar_usuarios(
+    q: str = Query(..., min_length=2, max_length=100),
+    role: Optional[str] = "participante",
+    limit: int = Query(20, ge=1, le=50),
+    db: Session = Depends(get_db)
+):
+    encontrados = search.buscar(db, q, role, limit)
+    if not encontrados:
+        return {"usuarios": []}
+    ids = [user_id for user_id, _ in encontrados]
+    linhas = {l.id: l for l in db.execute(select(*CAMPOS_FEED).where(DBUser.id.in_(ids)))}
+    midias = _midias_do_feed(db, ids, galeria=False, videos=False)
+
+    usuarios = []
+    for user_id, relevancia in encontrados:
+        linha = linhas.get(user_id)
+        if linha is None:
+            continue  # excluído depois de indexado
+        item = dict(linha._mapping)
+        fotos = midias.get(user_id, {}).get("foto", [])
+        item["foto1"] = fotos[0] if len(fotos) > 0 else None
+        item["foto2"] = fotos[1] if len(fotos) > 1 else None
+        item["relevancia"] = round(relevancia, 4)
+        usuarios.append(item)
+    return {"usuarios": usuarios}
+
 # === SUSPENDER USUÁRIO ===
 @router.post("/admin/suspend/{id}")
-def suspender_usuario(id: int, db: Session = Depends(get_db)):
+def suspender_usuario(id: int, db: Session = Depends(get_db), admin: UsuarioToken = Depends(exigir_admin)):
     user = db.query(DBUser).filter(DBUser.id == id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     user.status = "suspenso"
     db.commit()
+    security.revogar_usuario(id)
+    search.atualizar_usuario(user)
     return {"message": "Usuário suspenso com sucesso"}
 
 # === EXCLUIR USUÁRIO ===
 @router.delete("/admin/delete/{id}")
-def excluir_usuario(id: int, db: Session = Depends(get_db)):
+def excluir_usuario(id: int, db: Session = Depends(get_db), admin: UsuarioToken = Depends(exigir_admin)):
     user = db.query(DBUser).filter(DBUser.id == id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    db.query(ConversaResumo).filter(
+        or_(ConversaResumo.user_id == id, ConversaResumo.contraparte_id == id)
+    ).delete(synchronize_session=False)
     db.delete(user)
     db.commit()
+    security.revogar_usuario(id)
+    search.remover_usuario(id)
     return {"message": "Usuário excluído com sucesso"}
 
 # === PEDIDO DE EXCLUSÃO (usando exclusao_pendente) ===
 @router.post("/users/request_delete")
 def request_delete(
     user_id: int = Form(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
 ):
+    garantir_dono(usuario, user_id)
     user = db.query(DBUser).filter(DBUser.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
@@ -296,12 +424,17 @@ def request_delete(
 
 # === LISTAR PEDIDOS DE EXCLUSÃO (usando exclusao_pendente) ===
 @router.get("/admin/pedidos_exclusao")
-def listar_pedidos_exclusao(db: Session = Depends(get_db)):
+def listar_pedidos_exclusao(db: Session = Depends(get_db), admin: UsuarioToken = Depends(exigir_admin)):
     users = db.query(DBUser).filter(DBUser.exclusao_pendente == True).all()
     return [{"id": u.id, "name": u.name, "email": u.email, "timestamp": u.updated_at if hasattr(u, "updated_at") else None} for u in users]
 
 @router.put("/users/confirmar_maioridade/{user_id}")
-def confirmar_maioridade(user_id: int, db: Session = Depends(get_db)):
+def confirmar_maioridade(
+    user_id: int,
+    db: Session = Depends(get_db),
+    usuario: Optional[UsuarioToken] = Depends(usuario_da_requisicao),
+):
+    garantir_dono(usuario, user_id)
     user = db.query(DBUser).filter(DBUser.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado.")
@@ -0,0 +1,263 @@
+# search.py
+# Busca de usuários por nome e bio.
+#
+# No PostgreSQL usa um índice GIN de tsvector (config "portuguese") com prefixo
+# nos termos (ana:*) e, se a extensão pg_trgm existir, similaridade de trigramas
+# no nome para tolerar erros de digitação. Com a extensão unaccent (migração
+# 12), documento e termos ficam sem acento dos dois lados ("monica" acha
+# "Mônica"); sem ela, os termos mantêm os acentos, como o documento.
+#
+# Em outros bancos (SQLite nos testes) mantém um índice invertido em memória,
+# construído na primeira busca e atualizado pelas rotas de cadastro, edição,
+# suspensão e exclusão do próprio processo. Como cada worker tem o seu, uma
+# tarefa em segundo plano (iniciada no lifespan) reconstrói o índice do banco a
+# cada SEARCH_MEMORIA_TTL segundos e o troca pelo atual; as buscas continuam
+# usando o anterior enquanto isso. O que outro worker alterou aparece em no
+# máximo esse tempo.
+import asyncio
+import bisect
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, text
+
+from database import SessionLocal
+from models import User
+
+logger = logging.getLogger(__name__)
+
+PESO_NOME = 3.0
+PESO_BIO = 1.0
+# Termo que só casa por prefixo vale menos que o termo exato
+FATOR_PREFIXO = 0.5
+SEARCH_MEMORIA_TTL = float(os.getenv("SEARCH_MEMORIA_TTL", "60"))
+
+
+def normalizar(texto: Optional[str], manter_acentos: bool = False) -> List[str]:
+    """Minúsculas, sem acentos (salvo manter_acentos), quebrado em palavras."""
+    if not texto:
+        return []
+    if not manter_acentos:
+        texto = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode()
+    return re.findall(r"\w+", texto.lower())
+
+
+# === POSTGRESQL ===
+# As expressões precisam ser idênticas às dos índices (migrações 8 e 12) para
+# eles serem usados. f_unaccent é o wrapper IMMUTABLE de unaccent (migração 12).
+DOCUMENTO_PG = "to_tsvector('portuguese', coalesce(name, '') || ' ' || coalesce(bio, ''))"
+DOCUMENTO_PG_SEM_ACENTO = (
+    "to_tsvector('portuguese', f_unaccent(coalesce(name, '') || ' ' || coalesce(bio, '')))"
+)
+
+
+# URL do banco -> (tem pg_trgm, tem f_unaccent). Extensões só mudam por
+# migração, que roda antes de a API subir: basta consultar uma vez por processo
+_recursos_pg = {}
+
+
+def _recursos(db) -> Tuple[bool, bool]:
+    chave = str(db.get_bind().url)
+    recursos = _recursos_pg.get(chave)
+    if recursos is None:
+        recursos = _recursos_pg[chave] = tuple(db.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'), "
+            "to_regprocedure('f_unaccent(text)') IS NOT NULL"
+        )).one())
+    return recursos
+
+
+def buscar_postgres(db, texto: str, role: Optional[str], limit: int) -> List[Tuple[int, float]]:
+    trigramas, sem_acento = _recursos(db)
+    termos = normalizar(texto, manter_acentos=not sem_acento)
+    if not termos:
+        return []
+    consulta = " & ".join(f"{t}:*" for t in termos)
+    documento = DOCUMENTO_PG_SEM_ACENTO if sem_acento else DOCUMENTO_PG
+    campo = "f_unaccent(coalesce({0}, ''))" if sem_acento else "coalesce({0}, '')"
+    similaridade = "similarity(name, :texto)" if trigramas else "0"
+    por_nome = "OR name % :texto" if trigramas else ""
+    filtro_role = "AND role = :role" if role else ""
+    sql = text(f"""
+        SELECT id,
+               ts_rank(
+                   setweight(to_tsvector('portuguese', {campo.format('name')}), 'A') ||
+                   setweight(to_tsvector('portuguese', {campo.format('bio')}), 'B'),
+                   to_tsquery('portuguese', :consulta)
+               ) + {similaridade} AS relevancia
+        FROM usuarios
+        WHERE ({documento} @@ to_tsquery('portuguese', :consulta) {por_nome})
+          AND status != 'suspenso' {filtro_role}
+        ORDER BY relevancia DESC, id
+        LIMIT :limit
+    """)
+    linhas = db.execute(sql, {"consulta": consulta, "texto": texto, "role": role, "limit": limit})
+    return [(linha.id, float(linha.relevancia)) for linha in linhas]
+
+
+# === ÍNDICE INVERTIDO EM MEMÓRIA ===
+class InvertedIndex:
+    def __init__(self):
+        self._postings = {}   # termo -> {user_id: peso}
+        self._termos = []     # termos ordenados (busca por prefixo com bisect)
+        self._docs = {}       # user_id -> (role, status, termos do documento)
+        self._lock = threading.Lock()
+        self.carregado = False
+
+    def _adicionar_termo(self, termo: str, user_id: int, peso: float) -> None:
+        postings = self._postings.get(termo)
+        if postings is None:
+            postings = self._postings[termo] = {}
+            bisect.insort(self._termos, termo)
+        postings[user_id] = postings.get(user_id, 0.0) + peso
+
+    def _remover(self, user_id: int) -> None:
+        doc = self._docs.pop(user_id, None)
+        if not doc:
+            return
+        for termo in doc[2]:
+            postings = self._postings.get(termo)
+            if postings is None:
+                continue
+            postings.pop(user_id, None)
+            if not postings:
+                del self._postings[termo]
+                i = bisect.bisect_left(self._termos, termo)
+                if i < len(self._termos) and self._termos[i] == termo:
+                    self._termos.pop(i)
+
+    def indexar(self, user_id: int, name: str, bio: Optional[str], role: str, status: Optional[str]) -> None:
+        with self._lock:
+            self._remover(user_id)
+            termos = set()
+            for termo in normalizar(name):
+                self._adicionar_termo(termo, user_id, PESO_NOME)
+                termos.add(termo)
+            for termo in normalizar(bio):
+                self._adicionar_termo(termo, user_id, PESO_BIO)
+                termos.add(termo)
+            self._docs[user_id] = (role, status, termos)
+
+    def remover(self, user_id: int) -> None:
+        with self._lock:
+            self._remover(user_id)
+
+    def _casar(self, termo: str) -> dict:
+        """Documentos que contêm o termo exato ou alguma palavra que começa com ele."""
+        pontos = dict(self._postings.get(termo, {}))
+        i = bisect.bisect_right(self._termos, termo)
+        while i < len(self._termos) and self._termos[i].startswith(termo):
+            for user_id, peso in self._postings[self._termos[i]].items():
+                pontos[user_id] = max(pontos.get(user_id, 0.0), peso * FATOR_PREFIXO)
+            i += 1
+        return pontos
+
+    def buscar(self, termos: List[str], role: Optional[str], limit: int) -> List[Tuple[int, float]]:
+        with self._lock:
+            resultado = None
+            for termo in termos:
+                pontos = self._casar(termo)
+                if resultado is None:
+                    resultado = pontos
+                else:
+                    # Todos os termos precisam casar (AND)
+                    resultado = {u: resultado[u] + p for u, p in pontos.items() if u in resultado}
+                if not resultado:
+                    return []
+            candidatos = [
+                (user_id, pontos) for user_id, pontos in resultado.items()
+                if self._docs[user_id][1] != "suspenso" and (not role or self._docs[user_id][0] == role)
+            ]
+        candidatos.sort(key=lambda c: (-c[1], c[0]))
+        return candidatos[:limit]
+
+    def carregar(self, db) -> None:
+        resultado = db.execute(
+            select(User.id, User.name, User.bio, User.role, User.status).execution_options(yield_per=5000)
+        )
+        for linha in resultado:
+            self.indexar(linha.id, linha.name, linha.bio, linha.role, linha.status)
+        self.carregado = True
+
+
+indice = InvertedIndex()
+_carga_lock = threading.Lock()
+
+
+def _usa_postgres(db) -> bool:
+    return os.getenv("SEARCH_BACKEND", "auto") != "memory" and db.get_bind().dialect.name == "postgresql"
+
+
+def buscar(db, texto: str, role: Optional[str] = None, limit: int = 20) -> List[Tuple[int, float]]:
+    """Retorna [(user_id, relevância)] em ordem decrescente de relevância."""
+    if _usa_postgres(db):
+        return buscar_postgres(db, texto, role, limit)
+    termos = normalizar(texto)
+    if not termos:
+        return []
+    global indice
+    if not indice.carregado:
+        # Só a primeira busca monta o índice; depois ele é renovado em segundo plano
+        with _carga_lock:
+            if not indice.carregado:
+                novo = InvertedIndex()
+                novo.carregar(db)
+                indice = novo
+    return indice.buscar(termos, role, limit)
+
+
+# === RENOVAÇÃO DO ÍNDICE EM MEMÓRIA ===
+def recarregar_indice() -> None:
+    """Monta um índice novo do banco e troca pelo atual (roda em thread)."""
+    global indice
+    db = SessionLocal()
+    try:
+        if _usa_postgres(db) or not indice.carregado:
+            return   # busca no PostgreSQL, ou nenhuma busca feita ainda neste processo
+        novo = InvertedIndex()
+        novo.carregar(db)
+    finally:
+        db.close()
+    with _carga_lock:
+        indice = novo
+
+
+class AtualizadorIndice:
+    def __init__(self, intervalo: float = SEARCH_MEMORIA_TTL):
+        self.intervalo = intervalo
+        self._tarefa = None
+
+    def start(self) -> None:
+        self._tarefa = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._tarefa:
+            self._tarefa.cancel()
+            await asyncio.gather(self._tarefa, return_exceptions=True)
+            self._tarefa = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await asyncio.to_thread(recarregar_indice)
+            except Exception:
+                logger.exception("Falha ao renovar o índice de busca em memória")
+
+
+atualizador_indice = AtualizadorIndice()
+
+
+# === MANUTENÇÃO DO ÍNDICE EM MEMÓRIA (chamado pelas rotas) ===
+def atualizar_usuario(user: User) -> None:
+    if indice.carregado:
+        indice.indexar(user.id, user.name, user.bio, user.role, user.status)
+
+
+def remover_usuario(user_id: int) -> None:
+    if indice.carregado:
+        indice.remover(user_id)
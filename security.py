@@ -0,0 +1,270 @@
+# security.py
+# Senhas com hash e tokens de acesso assinados.
+#
+# Os tokens são HMAC-SHA256 (AUTH_SECRET) sobre um JSON com id, role e status
+# do usuário: a verificação é feita em memória, sem consultar "usuarios". O
+# access token vale pouco (ACCESS_TOKEN_TTL_MIN); o refresh token vale mais e,
+# na renovação, o usuário é relido do banco, então suspensões e trocas de role
+# valem no máximo até o access token expirar. A suspensão revoga os tokens na
+# hora no processo que a atendeu (revogar_usuario) e grava a revogação em
+# tokens_revogados; os outros processos a recarregam a cada REVOGACOES_SYNC_S
+# segundos (SincronizadorRevogacoes, no lifespan).
+#
+# As rotas de usuário exigem token (usuario_da_requisicao). Durante a migração
+# dos clientes antigos, AUTH_OBRIGATORIA=false deixa passar chamadas sem token;
+# o padrão é exigir. Rotas de administração e de repasse sempre exigem token
+# de administrador (exigir_admin).
+#
+# O hash de senha (PBKDF2) é caro de propósito e roda num pool de threads
+# próprio (HASH_MAX_WORKERS), fora do event loop.
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException
+from pydantic import BaseModel
+from sqlalchemy import delete, select
+
+from database import SessionLocal, upsert_insert
+from models import TokenRevogado
+
+logger = logging.getLogger(__name__)
+
+AUTH_SECRET = os.getenv("AUTH_SECRET")
+if not AUTH_SECRET:
+    # Sem segredo fixo os tokens só valem neste processo e até ele reiniciar
+    logger.warning("AUTH_SECRET não definido; usando segredo temporário")
+    AUTH_SECRET = secrets.token_urlsafe(32)
+_CHAVE = AUTH_SECRET.encode()
+
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL_MIN", "15")) * 60
+REFRESH_TOKEN_TTL = int(os.getenv("REFRESH_TOKEN_TTL_DIAS", "30")) * 86400
+PBKDF2_ITERACOES = int(os.getenv("PBKDF2_ITERACOES", "200000"))
+HASH_MAX_WORKERS = int(os.getenv("HASH_MAX_WORKERS", "4"))
+AUTH_OBRIGATORIA = os.getenv("AUTH_OBRIGATORIA", "true").lower() in ("1", "true", "sim")
+REVOGACOES_SYNC_S = float(os.getenv("REVOGACOES_SYNC_S", "30"))
+
+_executor = ThreadPoolExecutor(max_workers=HASH_MAX_WORKERS, thread_name_prefix="hash")
+
+
+# === SENHAS ===
+PREFIXO_HASH = "pbkdf2_sha256"
+
+
+def hash_senha(senha: str) -> str:
+    sal = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", senha.encode(), sal, PBKDF2_ITERACOES)
+    return "$".join([
+        PREFIXO_HASH, str(PBKDF2_ITERACOES),
+        base64.b64encode(sal).decode(), base64.b64encode(digest).decode(),
+    ])
+
+
+def verificar_senha(senha: str, armazenada: Optional[str]) -> bool:
+    if not armazenada:
+        return False
+    if not armazenada.startswith(PREFIXO_HASH + "$"):
+        # Senhas antigas em texto puro: aceitas uma vez e trocadas pelo hash no login
+        return hmac.compare_digest(senha.encode(), armazenada.encode())
+    _, iteracoes, sal, digest = armazenada.split("$")
+    calculado = hashlib.pbkdf2_hmac("sha256", senha.encode(), base64.b64decode(sal), int(iteracoes))
+    return hmac.compare_digest(calculado, base64.b64decode(digest))
+
+
+def precisa_rehash(armazenada: str) -> bool:
+    partes = armazenada.split("$")
+    return partes[0] != PREFIXO_HASH or int(partes[1]) < PBKDF2_ITERACOES
+
+
+async def hash_senha_async(senha: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_executor, hash_senha, senha)
+
+
+async def verificar_senha_async(senha: str, armazenada: Optional[str]) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(_executor, verificar_senha, senha, armazenada)
+
+
+# === TOKENS ===
+def _b64(dados: bytes) -> str:
+    return base64.urlsafe_b64encode(dados).rstrip(b"=").decode()
+
+
+def _unb64(texto: str) -> bytes:
+    return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+
+def _assinar(payload: dict) -> str:
+    corpo = _b64(json.dumps(payload, separators=(",", ":")).encode())
+    assinatura = _b64(hmac.new(_CHAVE, corpo.encode(), hashlib.sha256).digest())
+    return f"{corpo}.{assinatura}"
+
+
+def emitir_tokens(user) -> dict:
+    agora = int(time.time())
+    base = {"sub": user.id, "role": user.role, "status": user.status, "iat": agora}
+    return {
+        "access_token": _assinar({**base, "tipo": "access", "exp": agora + ACCESS_TOKEN_TTL}),
+        "refresh_token": _assinar({"sub": user.id, "iat": agora, "tipo": "refresh", "exp": agora + REFRESH_TOKEN_TTL}),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_TTL,
+    }
+
+
+# user_id -> instante (epoch) da revogação; tokens emitidos antes dele são recusados
+_revogados = {}
+_revogados_lock = threading.Lock()
+
+
+def revogar_usuario(user_id: int) -> None:
+    agora = time.time()
+    with _revogados_lock:
+        _revogados[user_id] = agora
+    db = SessionLocal()
+    try:
+        insert_ = upsert_insert(db.get_bind().dialect.name)
+        db.execute(
+            insert_(TokenRevogado).values(user_id=user_id, revogado_em=agora)
+            .on_conflict_do_update(index_elements=["user_id"], set_={"revogado_em": agora})
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def carregar_revogacoes() -> None:
+    """Traz as revogações feitas em outros processos (roda em thread)."""
+    # Depois do TTL do refresh nenhum token antigo sobrevive: essas linhas saem
+    limite = time.time() - REFRESH_TOKEN_TTL
+    db = SessionLocal()
+    try:
+        db.execute(delete(TokenRevogado).where(TokenRevogado.revogado_em < limite))
+        db.commit()
+        linhas = db.execute(select(TokenRevogado.user_id, TokenRevogado.revogado_em)).all()
+    finally:
+        db.close()
+    global _revogados
+    with _revogados_lock:
+        recentes = {u: t for u, t in _revogados.items() if t >= limite}
+        for user_id, revogado_em in linhas:
+            recentes[user_id] = max(revogado_em, recentes.get(user_id, 0))
+        _revogados = recentes
+
+
+class SincronizadorRevogacoes:
+    def __init__(self, intervalo: float = REVOGACOES_SYNC_S):
+        self.intervalo = intervalo
+        self._tarefa = None
+
+    def start(self) -> None:
+        self._tarefa = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._tarefa:
+            self._tarefa.cancel()
+            await asyncio.gather(self._tarefa, return_exceptions=True)
+            self._tarefa = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(carregar_revogacoes)
+            except Exception:
+                logger.exception("Falha ao recarregar tokens revogados")
+            await asyncio.sleep(self.intervalo)
+
+
+sincronizador_revogacoes = SincronizadorRevogacoes()
+
+
+def decodificar_token(token: str, tipo: str = "access") -> dict:
+    """Valida assinatura, tipo, expiração e revogação. Levanta 401 se inválido."""
+    try:
+        corpo, assinatura = token.split(".")
+        esperado = hmac.new(_CHAVE, corpo.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(esperado, _unb64(assinatura)):
+            raise ValueError
+        payload = json.loads(_unb64(corpo))
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Token inválido.")
+    if payload.get("tipo") != tipo:
+        raise HTTPException(status_code=401, detail="Token inválido.")
+    if payload["exp"] <= time.time():
+        raise HTTPException(status_code=401, detail="Token expirado.")
+    revogado_em = _revogados.get(payload["sub"])
+    if revogado_em is not None and payload["iat"] <= revogado_em:
+        raise HTTPException(status_code=401, detail="Token revogado.")
+    return payload
+
+
+# === DEPENDÊNCIAS ===
+class UsuarioToken(BaseModel):
+    id: int
+    role: str
+    status: Optional[str] = None
+
+
+def usuario_do_token(token: str) -> UsuarioToken:
+    """Valida um access token e devolve o usuário dele (401/403 como nas rotas)."""
+    payload = decodificar_token(token)
+    if payload.get("status") == "suspenso":
+        raise HTTPException(status_code=403, detail="Usuário suspenso")
+    return UsuarioToken(id=payload["sub"], role=payload["role"], status=payload.get("status"))
+
+
+def sub_do_header(authorization: Optional[str]) -> Optional[int]:
+    """Id do token válido no header, sem levantar erro (para middlewares)."""
+    esquema, _, token = (authorization or "").partition(" ")
+    if esquema.lower() != "bearer" or not token:
+        return None
+    try:
+        return decodificar_token(token)["sub"]
+    except HTTPException:
+        return None
+
+
+def _do_header(authorization: Optional[str]) -> Optional[UsuarioToken]:
+    if not authorization:
+        return None
+    esquema, _, token = authorization.partition(" ")
+    if esquema.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Token inválido.")
+    return usuario_do_token(token)
+
+
+def usuario_da_requisicao(authorization: Optional[str] = Header(None)) -> Optional[UsuarioToken]:
+    """Usuário do token. Sem token: 401, ou None só com AUTH_OBRIGATORIA=false (transição)."""
+    usuario = _do_header(authorization)
+    if usuario is None and AUTH_OBRIGATORIA:
+        raise HTTPException(status_code=401, detail="Autenticação necessária.")
+    return usuario
+
+
+def usuario_atual(authorization: Optional[str] = Header(None)) -> UsuarioToken:
+    usuario = _do_header(authorization)
+    if usuario is None:
+        raise HTTPException(status_code=401, detail="Autenticação necessária.")
+    return usuario
+
+
+def exigir_admin(usuario: UsuarioToken = Depends(usuario_atual)) -> UsuarioToken:
+    if usuario.role != "administrador":
+        raise HTTPException(status_code=403, detail="Acesso restrito a administradores.")
+    return usuario
+
+
+def garantir_dono(usuario: Optional[UsuarioToken], *user_ids: int) -> None:
+    """Só um dos user_ids (ou um administrador) age sobre o recurso.
+
+    usuario None só chega aqui com AUTH_OBRIGATORIA=false.
+    """
+    if usuario and usuario.id not in user_ids and usuario.role != "administrador":
+        raise HTTPException(status_code=403, detail="Acesso não permitido.")
@@ -0,0 +1,133 @@
+# uploads_resumiveis.py
+# Upload de mídia em partes, com retomada (rotas em routes/uploads.py).
+#
+# O app abre uma sessão informando nome, tipo e tamanho total. Arquivo acima
+# do limite do tipo é recusado (413) antes de qualquer byte ser enviado. A
+# resposta traz o tamanho de cada parte. Cada parte vai num PUT próprio com o
+# SHA-256 dela no header X-Chunk-SHA256. O corpo é lido em blocos e gravado
+# direto na posição final do arquivo no spool (MEDIA_SPOOL_DIR/<upload_id>),
+# sem juntar a parte em memória. Uma parte só conta como recebida se o tamanho
+# e o hash conferem. Se a conexão cai, o app consulta as partes já recebidas e
+# reenvia só as que faltam. Na conclusão, o arquivo vira um MediaJob com o
+# mesmo id da sessão, e a fila de mídia o envia ao storage como os demais.
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+import aiofiles
+from sqlalchemy import delete, select
+
+from database import SessionLocal
+from media_jobs import SPOOL_DIR
+from models import UploadParte, UploadSessao
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+UPLOAD_PARTE_BYTES = int(float(os.getenv("UPLOAD_PARTE_MB", "8")) * MB)
+UPLOAD_MAX_BYTES = {
+    "video": int(float(os.getenv("UPLOAD_MAX_VIDEO_MB", "500")) * MB),
+    "foto": int(float(os.getenv("UPLOAD_MAX_FOTO_MB", "20")) * MB),
+}
+UPLOAD_SESSAO_TTL = timedelta(hours=float(os.getenv("UPLOAD_SESSAO_HORAS", "24")))
+# A cada quantas sessões abertas o processo apaga as vencidas
+LIMPAR_A_CADA = 100
+
+
+class ParteInvalida(Exception):
+    """Parte maior que o esperado (grande=True), menor ou com hash diferente."""
+
+    def __init__(self, mensagem: str, grande: bool = False):
+        super().__init__(mensagem)
+        self.grande = grande
+
+
+def caminho_arquivo(upload_id: str) -> str:
+    # Mesma pasta que o job usa no spool: processar() a apaga ao terminar
+    return os.path.join(SPOOL_DIR, upload_id, "arquivo")
+
+
+def total_partes(tamanho: int, tamanho_parte: int) -> int:
+    return -(-tamanho // tamanho_parte)
+
+
+def tamanho_da_parte(sessao: UploadSessao, indice: int) -> int:
+    """A última parte leva o que sobra do arquivo."""
+    if indice == sessao.total_partes - 1:
+        return sessao.tamanho - indice * sessao.tamanho_parte
+    return sessao.tamanho_parte
+
+
+def preparar_arquivo(upload_id: str) -> None:
+    caminho = caminho_arquivo(upload_id)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    open(caminho, "wb").close()
+
+
+async def gravar_parte(upload_id: str, offset: int, esperado: int, sha256: str,
+                       blocos: AsyncIterator[bytes]) -> None:
+    """Grava os blocos a partir de offset, conferindo tamanho e hash enquanto lê."""
+    resumo, recebidos = hashlib.sha256(), 0
+    async with aiofiles.open(caminho_arquivo(upload_id), "r+b") as saida:
+        await saida.seek(offset)
+        async for bloco in blocos:
+            recebidos += len(bloco)
+            if recebidos > esperado:
+                # Para de ler na hora: o resto do corpo não é gravado
+                raise ParteInvalida(f"Parte maior que {esperado} bytes.", grande=True)
+            resumo.update(bloco)
+            await saida.write(bloco)
+    if recebidos != esperado:
+        raise ParteInvalida(f"Parte com {recebidos} bytes; esperado {esperado}.")
+    if resumo.hexdigest() != sha256.lower():
+        raise ParteInvalida("SHA-256 da parte não confere.")
+
+
+# === LIMPEZA DAS SESSÕES VENCIDAS ===
+def limpar_expiradas(agora: Optional[datetime] = None) -> int:
+    """Apaga as sessões vencidas. Retorna quantas foram apagadas.
+
+    Só os arquivos das abertas saem do spool; os das concluídas são do job de mídia.
+    """
+    agora = agora or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        vencidas = db.execute(
+            select(UploadSessao.id, UploadSessao.status).where(UploadSessao.expira_em < agora)
+        ).all()
+        ids = [v.id for v in vencidas]
+        if ids:
+            db.execute(delete(UploadParte).where(UploadParte.upload_id.in_(ids)))
+            db.execute(delete(UploadSessao).where(UploadSessao.id.in_(ids)))
+            db.commit()
+    finally:
+        db.close()
+    for upload_id in (v.id for v in vencidas if v.status == "aberta"):
+        shutil.rmtree(os.path.dirname(caminho_arquivo(upload_id)), ignore_errors=True)
+    return len(ids)
+
+
+_abertas = {"total": 0}
+_limpeza: Optional[asyncio.Future] = None
+
+
+def _limpeza_terminou(futuro: asyncio.Future) -> None:
+    if not futuro.cancelled() and futuro.exception():
+        logger.error("Falha na limpeza das sessões de upload", exc_info=futuro.exception())
+
+
+def sessao_aberta() -> None:
+    """Conta as sessões abertas e, de tempos em tempos, agenda a limpeza em thread."""
+    global _limpeza
+    _abertas["total"] += 1
+    if _abertas["total"] % LIMPAR_A_CADA == 0 and (_limpeza is None or _limpeza.done()):
+        _limpeza = asyncio.get_running_loop().run_in_executor(None, limpar_expiradas)
+        _limpeza.add_done_callback(_limpeza_terminou)
+
+
+if __name__ == "__main__":
+    print(f"Sessões de upload vencidas apagadas: {limpar_expiradas()}")